@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Request to response latency analytics of parsed plain traces"""
+import numpy as np
+import pandas as pd
+
+import trace_analyzer_constants as tac
+
+TIMESTAMP_COLUMN = tac.MESSAGE_FIELDS[tac.TIMESTAMP_INDEX]
+TYPE_COLUMN = tac.MESSAGE_FIELDS[tac.TYPE_INDEX]
+
+
+class TraceAnalytics():
+    ''' Request to response latencies of TraceReaderPlain results
+        Messages are paired within each TID by transaction type, the message
+        type without its request or response suffix (e.g. "Create Session"
+        for "Create Session Request"): the n-th request of a type with the
+        n-th response of that type, in timestamp order.
+        Data is added with add, either whole results or the chunks of
+        iter_trace_file, which never split a transaction. Work is done with
+        vectorized operations on message type codes, as the distinct types
+        are few
+        - timeout: pd.Timedelta, or value accepted by it (e.g. '5s').
+          Answers later than timeout are counted as timed out
+        - timestamp_format: format of timestamps not converted by the config
+    '''
+    def __init__(self, timeout=None,
+                 timestamp_format=tac.TRACE_TIMESTAMP_FORMAT,
+                 request_suffix=tac.ANALYTICS_REQUEST_SUFFIX,
+                 response_suffix=tac.ANALYTICS_RESPONSE_SUFFIX):
+        self.timeout = pd.Timedelta(timeout) if timeout is not None else None
+        self.timestamp_format = timestamp_format
+        self.request_suffix = request_suffix
+        self.response_suffix = response_suffix
+        self.latencies = []
+        self.message_counts = pd.Series(dtype=np.int64)
+        self.unsolicited_counts = pd.Series(dtype=np.int64)
+
+    def get_message_kinds(self, message_types):
+        ''' Returns (transaction type, kind) of each distinct message type.
+            kind is 1 for requests, -1 for responses and 0 otherwise
+        '''
+        transaction_types, kinds = [], []
+        for message_type in message_types:
+            message_type = str(message_type).strip()
+            kind = 0
+            for suffix, suffix_kind in ((self.request_suffix, 1),
+                                        (self.response_suffix, -1)):
+                if message_type.endswith(suffix):
+                    message_type = message_type[:-len(suffix)].strip()
+                    kind = suffix_kind
+                    break
+            transaction_types.append(message_type)
+            kinds.append(kind)
+        return transaction_types, np.array(kinds, dtype=np.int8)
+
+    def get_timestamps(self, df):
+        timestamps = df[TIMESTAMP_COLUMN]
+        if pd.api.types.is_datetime64_any_dtype(timestamps):
+            return timestamps.to_numpy()
+        return pd.to_datetime(timestamps, format=self.timestamp_format,
+                              errors='coerce').to_numpy()
+
+    def add(self, df):
+        ''' Adds the messages of whole transactions. Returns the number of
+            requests found in them
+        '''
+        if df is None or df.empty:
+            return 0
+        message_codes, message_types = pd.factorize(df[TYPE_COLUMN])
+        valid = message_codes >= 0
+        message_codes = message_codes[valid]
+        self.message_counts = self.message_counts.add(pd.Series(
+            np.bincount(message_codes, minlength=len(message_types)),
+            index=message_types.astype(str)), fill_value=0).astype(np.int64)
+        transaction_types, kinds = self.get_message_kinds(message_types)
+        transaction_codes, transaction_names = pd.factorize(
+            pd.Index(transaction_types))
+        transactions = transaction_codes[message_codes]
+        kinds = kinds[message_codes]
+        tids = df['TID'].to_numpy(np.int64)[valid]
+        times = self.get_timestamps(df)[valid]
+        # Messages by TID and transaction type, in timestamp order
+        keys = tids * len(transaction_names) + transactions
+        order = np.lexsort((times, keys))
+        keys, kinds = keys[order], kinds[order]
+        tids, times, transactions = tids[order], times[order], \
+            transactions[order]
+        groups = np.cumsum(np.r_[True, keys[1:] != keys[:-1]]) - 1
+        requests = kinds == 1
+        responses = kinds == -1
+        request_numbers = get_group_numbers(groups[requests])
+        response_numbers = get_group_numbers(groups[responses])
+        # (group, number in group) as a single sorted key
+        width = max(request_numbers.max(initial=0),
+                    response_numbers.max(initial=0)) + 1
+        request_keys = groups[requests] * width + request_numbers
+        response_keys = groups[responses] * width + response_numbers
+        answers, answered = find_sorted(response_keys, request_keys)
+        response_times = np.full(len(request_keys), np.datetime64('NaT'),
+                                 dtype=times.dtype)
+        response_times[answered] = times[responses][answers[answered]]
+        request_times = times[requests]
+        request_transactions = transactions[requests]
+        _, solicited = find_sorted(request_keys, response_keys)
+        self.unsolicited_counts = self.unsolicited_counts.add(pd.Series(
+            np.bincount(transactions[responses][~solicited],
+                        minlength=len(transaction_names)),
+            index=transaction_names), fill_value=0).astype(np.int64)
+        latency = (response_times - request_times) / np.timedelta64(1, 'ms')
+        self.latencies.append(pd.DataFrame({
+            'TID' : tids[requests],
+            'transaction_type' : pd.Categorical.from_codes(
+                request_transactions, transaction_names),
+            'request_time' : request_times,
+            'response_time' : response_times,
+            'latency_ms' : latency}))
+        return len(request_keys)
+
+    def add_trace_file(self, trace_reader, trace_filename, **kwargs):
+        ''' Streams trace_filename through trace_reader, a TraceReaderPlain,
+            extracting message timestamps and types only. kwargs are passed
+            to iter_trace_file. Returns the number of requests found
+        '''
+        columns = [TIMESTAMP_COLUMN, TYPE_COLUMN]
+        requests = 0
+        for df in trace_reader.iter_trace_file(trace_filename, columns=columns,
+                                               **kwargs):
+            requests += self.add(df)
+        return requests
+
+    def get_latencies(self):
+        ''' Returns one row per request: TID, transaction type, request and
+            response times and latency in milliseconds, NaN if unanswered
+        '''
+        if not self.latencies:
+            return pd.DataFrame(columns=['TID', 'transaction_type',
+                                         'request_time', 'response_time',
+                                         'latency_ms'])
+        if len(self.latencies) > 1:
+            # Categories of each chunk are merged once
+            self.latencies = [pd.concat(
+                [latencies.astype({'transaction_type': str})
+                 for latencies in self.latencies], ignore_index=True).astype(
+                     {'transaction_type': 'category'})]
+        return self.latencies[0]
+
+    def get_latency_report(self, percentiles=tac.ANALYTICS_PERCENTILES):
+        ''' Returns, by transaction type, the number of requests, answered,
+            unanswered and timed out requests, responses without request,
+            and mean, percentiles and maximum latency in milliseconds
+        '''
+        latencies = self.get_latencies()
+        transaction_types = latencies['transaction_type'].astype('category')
+        codes = transaction_types.cat.codes.to_numpy()
+        values = latencies['latency_ms'].to_numpy(np.float64)
+        names = list(transaction_types.cat.categories)
+        names += [name for name in self.unsolicited_counts.index
+                  if name not in names]
+        timeout_ms = np.inf
+        if self.timeout is not None:
+            timeout_ms = self.timeout.total_seconds() * 1000
+        rows = []
+        for code, name in enumerate(names):
+            type_values = values[codes == code]
+            answered = type_values[~np.isnan(type_values)]
+            row = {'requests' : len(type_values),
+                   'answered' : len(answered),
+                   'unanswered' : len(type_values) - len(answered),
+                   'timed_out' : int(np.count_nonzero(answered > timeout_ms)),
+                   'unsolicited' : int(self.unsolicited_counts.get(name, 0))}
+            # One partial sort for all the percentiles
+            quantiles = np.quantile(answered, percentiles) if len(answered) \
+                else [np.nan] * len(percentiles)
+            row['mean_ms'] = answered.mean() if len(answered) else np.nan
+            for percentile, quantile in zip(percentiles, quantiles):
+                row[f'p{percentile * 100:g}_ms'] = quantile
+            row['max_ms'] = answered.max() if len(answered) else np.nan
+            rows.append(row)
+        report = pd.DataFrame(rows, index=pd.Index(names,
+                                                   name='transaction_type'))
+        return report.sort_index()
+
+    def get_message_counts(self):
+        ''' Returns the number of messages of each message type '''
+        return self.message_counts.sort_values(ascending=False)
+
+
+def get_group_numbers(groups):
+    ''' Returns the position of each item within its group, for sorted
+        group numbers
+    '''
+    positions = np.arange(len(groups))
+    starts = np.r_[True, groups[1:] != groups[:-1]]
+    return positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def find_sorted(sorted_keys, keys):
+    ''' Returns the positions of keys in sorted_keys and whether each key
+        was found there
+    '''
+    positions = np.searchsorted(sorted_keys, keys)
+    found = np.zeros(len(keys), dtype=bool)
+    in_range = positions < len(sorted_keys)
+    found[in_range] = sorted_keys[positions[in_range]] == keys[in_range]
+    return positions, found
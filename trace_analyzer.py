@@ -5,26 +5,86 @@ Created on Wed Sep 29 11:28:46 2021
 @author: orubio
 """
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from collections import defaultdict
+import datetime
+import locale
+import logging
+import mmap
+import numpy as np
+import os
 import pandas as pd
+import pickle
 import re
+import time
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 import trace_analyzer_constants as tac
+from trace_compression import get_compression, open_trace_file
+from trace_pipeline import BlockReader, SinkWriter, iter_block_lines
+
+logger = logging.getLogger(__name__)
 
 
 class TraceReader(ABC):
     ''' Abstract class to define the interface to trace readers '''
     
-    def __init__(self):
+    def __init__(self, cache=None):
         self.df = None
         self.fields = {}
+        # Optional trace_cache.TraceCache of parsed traces
+        self.cache = cache
         
     def get_data(self):
         return self.df
+
+    def load_cached(self, trace_filename, config):
+        ''' Sets data from cache if available. Returns True if found '''
+        if self.cache is None:
+            return False
+        df = self.cache.load(trace_filename, config)
+        if df is None:
+            return False
+        self.df = df
+        return True
+
+    def store_cached(self, trace_filename, config):
+        if self.cache is not None:
+            self.cache.store(trace_filename, config, self.df)
     
     def get_fields(self):
         return self.fields
 
+    def get_columns(self):
+        ''' Returns all the columns the config can produce, in order '''
+        return list(self.fields)
+
+    def get_column_types(self):
+        ''' Returns the declared dtype names of the columns, by column '''
+        return dict(self.fields)
+
+    def write_trace_file(self, trace_filename, sink, pipelined=True,
+                         **kwargs):
+        ''' Reads the trace file chunk by chunk, writing each chunk to sink,
+            e.g. a trace_sink.ParquetSink, as soon as it is parsed. If 
+            pipelined, chunks are written by another thread while the next
+            ones are parsed. The sink is closed at the end. kwargs are passed
+            to iter_trace_file. Returns the number of rows written
+        '''
+        with sink:
+            if not pipelined:
+                for df in self.iter_trace_file(trace_filename, **kwargs):
+                    sink.write(df)
+                return sink.rows
+            with SinkWriter(sink) as writer:
+                for df in self.iter_trace_file(trace_filename, **kwargs):
+                    writer.write(df)
+        return sink.rows
+
     def get_key_value(self, input_line, sep='\t'):
         ''' Helper function to extract key : value pairs '''
         key, value = None, None
@@ -41,12 +101,16 @@ class TraceReader(ABC):
     def read_trace_file(self, trace_filename, **kwargs):
         pass
 
+    @abstractmethod
+    def iter_trace_file(self, trace_filename, **kwargs):
+        pass
+
 
 class TraceReaderCSV(TraceReader):
     ''' Concrete TraceReader class to read CSV trace files'''
     def __init__(self, config_filename=None,
-                 trace_filename=None, sep='\t', skiprows=0):
-        super().__init__()
+                 trace_filename=None, sep='\t', skiprows=0, cache=None):
+        super().__init__(cache)
         if not config_filename:
             return
         self.read_config_file(config_filename)
@@ -54,7 +118,10 @@ class TraceReaderCSV(TraceReader):
             self.read_trace_file(trace_filename, sep=sep, skiprows=skiprows)
             
     def read_config_file(self, config_filename, sep='\t'):
-        ''' Assumes each line contains a pair of Field, dtype '''
+        ''' Assumes each line contains a pair of Field, dtype
+            dtype is a pandas dtype name (object, int64, Int64, category,
+            string[pyarrow]...) or datetime64 for dates
+        '''
         fields_found = 0
         if not config_filename:
             raise(ValueError("Incorrect config file"))
@@ -68,25 +135,86 @@ class TraceReaderCSV(TraceReader):
                 input_line = f.readline()
         return fields_found  
     
-    def read_trace_file(self, trace_filename, sep='\t', skiprows=0):
+    def read_trace_file(self, trace_filename, sep='\t', skiprows=0,
+                        use_cache=True, engine=None):
+        ''' Reads the whole CSV file. engine is passed to pd.read_csv, e.g.
+            'pyarrow' for multithreaded parsing
+        '''
         if not trace_filename:
             raise(ValueError("Incorrect file name"))
-        non_datetime_fields = {key:value for key, value in self.fields.items() 
-            if value != tac.PD_DATETIME_TYPE}
-        datetime_fields = [key for key, value in self.fields.items() if value == 
-                           tac.PD_DATETIME_TYPE]
-        self.df = pd.read_csv(trace_filename, sep=sep, skiprows=skiprows,
-                              usecols=self.fields.keys(),
-                              dtype=non_datetime_fields,
-                              parse_dates=datetime_fields)
+        cache_config = repr((self.fields, sep, skiprows, engine))
+        if use_cache and self.load_cached(trace_filename, cache_config):
+            return
+        self.df = pd.read_csv(trace_filename,
+                              **self.get_read_csv_args(
+                                  sep, skiprows, engine,
+                                  get_compression(trace_filename)))
+        if use_cache:
+            self.store_cached(trace_filename, cache_config)
+
+    def iter_trace_file(self, trace_filename, sep='\t', skiprows=0,
+                        chunksize=tac.CSV_CHUNK_ROWS):
+        ''' Reads the CSV file yielding DataFrames of chunksize rows, so 
+            memory use does not depend on file size. Categorical columns
+            only hold the categories found in their own chunk
+        '''
+        if not trace_filename:
+            raise(ValueError("Incorrect file name"))
+        with pd.read_csv(trace_filename, chunksize=chunksize,
+                         **self.get_read_csv_args(
+                             sep, skiprows, 
+                             compression=get_compression(trace_filename))
+                         ) as reader:
+            yield from reader
+
+    def get_read_csv_args(self, sep='\t', skiprows=0, engine=None,
+                          compression=None):
+        ''' Returns pd.read_csv arguments to read the configured fields.
+            compression is that of the file, see trace_compression.py
+        '''
+        dtypes = {}
+        datetime_fields = []
+        for key, value in self.fields.items():
+            if value == tac.PD_DATETIME_TYPE:
+                datetime_fields.append(key)
+            else:
+                dtypes[key] = self.get_dtype(value)
+        return {'sep' : sep, 'skiprows' : skiprows, 
+                'usecols' : list(self.fields), 'dtype' : dtypes,
+                'parse_dates' : datetime_fields, 'engine' : engine,
+                'compression' : compression}
+
+    def get_dtype(self, value):
+        ''' Converts a config dtype name, e.g. 'category', 'Int64' (nullable
+            integer) or 'string[pyarrow]', to a pandas dtype
+        '''
+        return get_dtype(value)
 
 
 class TraceReaderPlain(TraceReader):
-    ''' Concrete TraceReader class to read plain text trace files'''
+    ''' Concrete TraceReader class to read plain text trace files
+        - encoding, errors: as in open(). Default to the locale encoding
+        - use_mmap: scan the trace as bytes through a memory map, decoding 
+          only lines that may match a trigger
+        - instrumentation: TraceInstrumentation collecting metrics and 
+          reporting progress of trace reads, and optionally profiling
+          config patterns
+        - cache: trace_cache.TraceCache where parsed traces are kept
+    '''
     def __init__(self, config_filename=None,
-                 trace_filename=None):
-        super().__init__()
+                 trace_filename=None, encoding=None, errors=None,
+                 use_mmap=False, instrumentation=None, cache=None):
+        super().__init__(cache)
         self.transaction_triggers = []
+        self.transaction_matcher = TransactionMatcher([])
+        self.encoding = encoding
+        self.errors = errors
+        self.use_mmap = use_mmap
+        self.instrumentation = instrumentation
+        # TraceFollower of each trace read with follow_trace_file
+        self.followers = {}
+        # TransactionMatcher of each set of projected columns
+        self.projected_matchers = {}
         if not config_filename:
             return
         self.read_config_file(config_filename)
@@ -101,35 +229,427 @@ class TraceReaderPlain(TraceReader):
         if not config_filename:
             raise(ValueError("Incorrect config file"))
         t_config_context = TransactionConfigContext()
-        with open(config_filename, 'r') as f:
+        with open(config_filename, 'r', encoding=self.encoding,
+                  errors=self.errors) as f:
             input_line = f.readline()
             while (t_config_context.process_line(input_line)):
                 input_line = f.readline()
             self.transaction_triggers = t_config_context.get_transaction_triggers()
+            self.transaction_matcher = t_config_context.get_transaction_matcher()
         return len(self.transaction_triggers)
     
-    def read_trace_file(self, trace_filename):
+    def read_trace_file(self, trace_filename, workers=1, use_cache=True,
+                        columns=None, filters=None, time_range=None):
+        ''' Reads the whole trace file. With workers > 1 the file is split in
+            byte ranges starting at transaction start lines, which are parsed
+            by a pool of processes. Assumes transactions do not span those 
+            lines, as in any well formed trace.
+            Results are taken from and stored in the reader cache, if any,
+            unless use_cache is False.
+            columns, filters and time_range are applied while parsing, see
+            get_trace_context
+        '''
         if not trace_filename:
             raise(ValueError("Incorrect file name"))
-        transaction_context = TransactionTraceContext(self.transaction_triggers)
-        with open(trace_filename, 'r') as f:
-            input_line = f.readline()
-            while (transaction_context.process_line(input_line)):
-                input_line = f.readline()
+        read_options = {'columns': columns, 'filters': filters,
+                        'time_range': time_range}
+        cache_config = self.get_cache_config(**read_options)
+        if use_cache and self.load_cached(trace_filename, cache_config):
+            return self.df.shape[0]
+        if workers > 1 and get_compression(trace_filename):
+            logger.warning('Compressed trace cannot be split. Reading %s '
+                           'sequentially', trace_filename)
+            workers = 1
+        if workers > 1:
+            self.df = self.read_trace_file_parallel(trace_filename, workers,
+                                                    read_options)
+        else:
+            transaction_context = self.get_trace_context(**read_options)
+            for input_line in self.get_trace_lines(
+                    trace_filename, transaction_context=transaction_context):
+                if input_line is None:
+                    transaction_context.process_unmatched_line()
+                else:
+                    transaction_context.process_line(input_line)
+            transaction_context.process_line('')
             self.df = transaction_context.get_result()
+        if use_cache:
+            self.store_cached(trace_filename, cache_config)
+        return self.df.shape[0]
+
+    def read_trace_file_parallel(self, trace_filename, workers,
+                                 read_options=None):
+        ''' Parses byte ranges of the trace in parallel and merges results.
+            Transaction IDs are renumbered as in a sequential read.
+            read_options are passed to get_trace_context
+        '''
+        file_size = os.path.getsize(trace_filename)
+        num_ranges = min(workers * tac.TRACE_RANGES_PER_WORKER,
+                         file_size // tac.TRACE_MIN_RANGE_SIZE)
+        offsets = self.find_split_offsets(trace_filename, num_ranges)
+        ranges = list(zip(offsets, offsets[1:] + [file_size]))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(read_trace_range, self.get_reader_copy(),
+                                       trace_filename, start, end, 
+                                       read_options)
+                       for start, end in ranges]
+            results = [future.result() for future in futures]
+        frames = []
+        tid_offset = 0
+        for df, num_transactions, instrumentation in results:
+            if self.instrumentation:
+                self.instrumentation.merge(instrumentation)
+            if not df.empty:
+                df['TID'] += tid_offset
+                frames.append(df)
+            tid_offset += num_transactions
+        if not frames:
+            return pd.DataFrame()
+        return self.transaction_matcher.get_column_converter().convert(
+            pd.concat(frames, ignore_index=True))
+
+    def read_trace_file_offsets(self, trace_filename):
+        ''' Reads the whole trace file, as read_trace_file without cache,
+            also finding where each transaction starts. Returns the result
+            without column types and the byte offsets of the transaction 
+            start lines, by TID - 1, followed by the trace size
+        '''
+        if not trace_filename:
+            raise(ValueError("Incorrect file name"))
+        if get_compression(trace_filename):
+            raise(ValueError("Byte offsets of compressed traces not supported"))
+        transaction_context = self.get_trace_context()
+        offsets = []
+        lines_read = None
+        if transaction_context.instrumentation:
+            lines_read = transaction_context.instrumentation.lines_read
+        for position, input_line in iter_trace_line_offsets(
+                trace_filename, encoding=self.encoding, errors=self.errors,
+                lines_read=lines_read):
+            tid = transaction_context.current_transaction_index
+            transaction_context.process_line(input_line)
+            if transaction_context.current_transaction_index != tid:
+                offsets.append(position)
+        transaction_context.process_line('')
+        offsets.append(os.path.getsize(trace_filename))
+        df = transaction_context.get_result(convert=False)
+        self.df = self.transaction_matcher.get_column_converter().convert(df)
+        return df, offsets
+
+    def find_split_offsets(self, trace_filename, num_ranges):
+        ''' Returns the byte offsets splitting the trace in up to num_ranges
+            ranges. Each range but the first begins with a line matching a 
+            transaction start trigger
+        '''
+        offsets = [0]
+        file_size = os.path.getsize(trace_filename)
+        encoding = self.encoding or locale.getpreferredencoding(False)
+        with open(trace_filename, 'rb') as f:
+            for index in range(1, max(num_ranges, 1)):
+                position = max(index * file_size // num_ranges, offsets[-1])
+                f.seek(position)
+                # Skips the (possibly partial) line at the seek position
+                position += len(f.readline())
+                for raw_line in f:
+                    input_line = raw_line.decode(encoding, errors='replace')
+                    input_line = input_line.replace('\r\n', '\n')
+                    if self.transaction_matcher.search_start_triggers(
+                            input_line):
+                        break
+                    position += len(raw_line)
+                if position >= file_size:
+                    break
+                if position > offsets[-1]:
+                    offsets.append(position)
+        return offsets
+
+    def iter_trace_file(self, trace_filename,
+                        chunk_transactions=tac.TRACE_CHUNK_TRANSACTIONS,
+                        columns=None, filters=None, time_range=None,
+                        prefetch=False):
+        ''' Reads the trace file yielding a DataFrame each time
+            chunk_transactions transactions have been completed, so memory use
+            does not depend on trace size. The last chunk may be smaller.
+            Chunks keep the columns of previous chunks, in the same order.
+            With prefetch, another thread reads the trace ahead in large 
+            blocks while lines are parsed. Not used with use_mmap
+        '''
+        if not trace_filename:
+            raise(ValueError("Incorrect file name"))
+        if chunk_transactions < 1:
+            raise(ValueError("Incorrect number of transactions per chunk"))
+        transaction_context = self.get_trace_context(columns, filters,
+                                                     time_range)
+        result = transaction_context.result
+        blocks = None
+        encoding = self.encoding or locale.getpreferredencoding(False)
+        if prefetch and not self.use_mmap and '\n'.encode(encoding) == b'\n':
+            # Blocks are split at b'\n', which must be a whole character
+            blocks = BlockReader(trace_filename,
+                                 get_compression(trace_filename))
+            lines_read = None
+            if transaction_context.instrumentation:
+                lines_read = transaction_context.instrumentation.lines_read
+            trace_lines = iter_block_lines(blocks, encoding,
+                                           self.errors or 'strict', lines_read)
+        else:
+            trace_lines = self.get_trace_lines(
+                trace_filename, transaction_context=transaction_context)
+        try:
+            for input_line in trace_lines:
+                if input_line is None:
+                    transaction_context.process_unmatched_line()
+                else:
+                    transaction_context.process_line(input_line)
+                if result.num_transactions >= chunk_transactions:
+                    yield transaction_context.flush_result()
+        finally:
+            if blocks is not None:
+                blocks.stop()
+        transaction_context.process_line('')
+        if result.num_transactions:
+            yield transaction_context.flush_result()
+
+    def write_trace_file(self, trace_filename, sink, pipelined=True,
+                         **kwargs):
+        ''' As TraceReader.write_trace_file. If pipelined, the trace is also
+            read ahead by another thread, see iter_trace_file
+        '''
+        if pipelined:
+            kwargs.setdefault('prefetch', True)
+        return super().write_trace_file(trace_filename, sink, pipelined,
+                                        **kwargs)
+
+    def follow_trace_file(self, trace_filename):
+        ''' Reads a trace file that keeps growing, e.g. while a capture is 
+            running. Each call only parses the data appended since the 
+            previous call and sets data to the transactions completed in it
+        '''
+        if not trace_filename:
+            raise(ValueError("Incorrect file name"))
+        follower = self.followers.get(trace_filename)
+        if follower is None:
+            follower = TraceFollower(self, trace_filename)
+            self.followers[trace_filename] = follower
+        self.df = follower.update()
         return self.df.shape[0]
+
+    def get_cache_config(self, columns=None, filters=None, time_range=None):
+        ''' Describes the options affecting parsed results, for the cache '''
+        if filters:
+            # Same description for the same values, in any order
+            filters = sorted((column, sorted(TransactionFilter.get_values(
+                values))) for column, values in filters.items())
+        if time_range:
+            time_range = tuple(TransactionFilter.get_time(value)
+                               for value in time_range)
+        return repr((self.transaction_triggers, self.encoding, self.errors,
+                     columns, filters, time_range))
+
+    def get_trace_context(self, columns=None, filters=None, time_range=None):
+        ''' Returns a new TransactionTraceContext. Optionally:
+            - columns: result columns, besides TID. Parameters of other 
+              columns are not extracted
+            - filters, time_range: transactions are dropped while parsing 
+              unless they meet them, see TransactionFilter
+        '''
+        transaction_matcher = self.transaction_matcher
+        projected_columns = None
+        if columns is not None:
+            columns = list(columns)
+            for column in columns + list(filters or {}):
+                if column not in transaction_matcher.field_index.indexes:
+                    raise(ValueError(f"Incorrect column: {column}"))
+            projected_columns = frozenset(columns) | frozenset(filters or {})
+            transaction_matcher = self.get_projected_matcher(projected_columns)
+        if self.instrumentation and self.instrumentation.profile:
+            # Profiled patterns must not be shared with other reads
+            transaction_matcher = TransactionMatcher(self.transaction_triggers,
+                                                     projected_columns)
+            transaction_matcher.profile(self.instrumentation)
+        transaction_filter = None
+        if filters or time_range:
+            transaction_filter = TransactionFilter(
+                transaction_matcher.get_field_index(), filters, time_range,
+                transaction_matcher.get_timestamp_format())
+        return TransactionTraceContext(self.transaction_triggers,
+                                       transaction_matcher,
+                                       self.instrumentation,
+                                       transaction_filter, columns)
+
+    def get_projected_matcher(self, columns):
+        ''' Returns the TransactionMatcher extracting only columns '''
+        key = frozenset(columns)
+        transaction_matcher = self.projected_matchers.get(key)
+        if transaction_matcher is None:
+            transaction_matcher = TransactionMatcher(self.transaction_triggers,
+                                                     key)
+            self.projected_matchers[key] = transaction_matcher
+        return transaction_matcher
+
+    def get_trace_lines(self, trace_filename, start=0, end=None,
+                        transaction_context=None):
+        ''' Returns an iterator over the lines of the trace file, optionally
+            restricted to byte offsets start to end. With use_mmap, runs of
+            lines that cannot match any trigger are returned as a single None,
+            and while transaction_context, if given, searches for a
+            transaction start, lines up to the next start are skipped as bytes.
+            Compressed traces are decompressed while reading, always in 
+            text mode. Lines read are counted by the instrumentation of
+            transaction_context, if any
+        '''
+        lines_read = None
+        if transaction_context is not None and \
+                transaction_context.instrumentation:
+            lines_read = transaction_context.instrumentation.lines_read
+        compression = get_compression(trace_filename)
+        if compression:
+            if start or end is not None:
+                raise(ValueError("Byte ranges of compressed traces not supported"))
+            if self.use_mmap:
+                logger.warning('Compressed trace cannot be mapped. Reading '
+                               '%s in text mode', trace_filename)
+            return iter_text_trace_lines(trace_filename, self.encoding,
+                                         self.errors, compression, lines_read)
+        if self.use_mmap:
+            skipping = None
+            if transaction_context is not None:
+                skipping = transaction_context.is_searching
+            return iter_mapped_trace_lines(
+                trace_filename, self.transaction_matcher.get_required_literals(),
+                start, end, self.encoding, self.errors,
+                self.transaction_matcher.get_start_literals(), skipping,
+                lines_read)
+        if start or end is not None:
+            return iter_trace_lines(trace_filename, start, end, 
+                                    self.encoding, self.errors, lines_read)
+        return iter_text_trace_lines(trace_filename, self.encoding,
+                                     self.errors, lines_read=lines_read)
+
+    def get_reader_copy(self):
+        ''' Returns a reader with the same config and options but no data,
+            cheap to send to worker processes
+        '''
+        instrumentation = None
+        if self.instrumentation:
+            instrumentation = TraceInstrumentation(
+                report_interval=float('inf'),
+                profile=self.instrumentation.profile)
+        reader = TraceReaderPlain(encoding=self.encoding, errors=self.errors,
+                                  use_mmap=self.use_mmap,
+                                  instrumentation=instrumentation)
+        reader.transaction_triggers = self.transaction_triggers
+        reader.transaction_matcher = self.transaction_matcher
+        return reader
     
     def get_triggers(self):
         return self.transaction_triggers
 
+    def get_matcher(self):
+        return self.transaction_matcher
+
+    def get_columns(self):
+        ''' Returns all the columns the config can produce, in order '''
+        return ['TID'] + list(self.transaction_matcher.get_field_index().names)
+
+    def get_column_types(self):
+        ''' Returns the dtype names declared in the config, by column.
+            Other columns are text
+        '''
+        column_types = self.transaction_matcher.get_column_converter(
+            ).column_types
+        return {'TID' : 'int64', **{column: dtype for column, (dtype, _)
+                                    in column_types.items()}}
+
+
+class TraceFollower():
+    ''' Incremental reader of a growing plain trace file
+        Only complete lines are parsed. Between updates the follower keeps 
+        the byte offset of the first line not yet parsed and the 
+        TransactionTraceContext, with its current state, partial transaction
+        and empty line counter. Both can be saved to disk to resume later
+    '''
+    def __init__(self, trace_reader, trace_filename, offset=0,
+                 transaction_context=None):
+        self.trace_reader = trace_reader
+        self.trace_filename = trace_filename
+        self.offset = offset
+        if transaction_context is None:
+            transaction_context = trace_reader.get_trace_context()
+        self.transaction_context = transaction_context
+
+    def update(self):
+        ''' Parses the lines appended since the last update. Returns a
+            DataFrame with the transactions completed by them
+        '''
+        file_size = os.path.getsize(self.trace_filename)
+        if file_size < self.offset:
+            # Truncated or replaced trace. Starts all over again
+            self.offset = 0
+            self.transaction_context = self.trace_reader.get_trace_context()
+        end = self.find_last_line_end(file_size)
+        transaction_context = self.transaction_context
+        for input_line in self.trace_reader.get_trace_lines(
+                self.trace_filename, self.offset, end, transaction_context):
+            if input_line is None:
+                transaction_context.process_unmatched_line()
+            else:
+                transaction_context.process_line(input_line)
+        self.offset = end
+        return transaction_context.flush_result()
+
+    def finish(self):
+        ''' Parses any pending data as if the trace had ended. Returns a
+            DataFrame with the remaining transactions
+        '''
+        df = self.update()
+        self.transaction_context.process_line('')
+        remaining = self.transaction_context.flush_result()
+        if remaining.empty:
+            return df
+        if df.empty:
+            return remaining
+        return pd.concat([df, remaining], ignore_index=True)
+
+    def find_last_line_end(self, file_size):
+        ''' Returns the offset following the last end of line in the trace,
+            or the current offset if no line has been completed since
+        '''
+        block_size = tac.TRACE_FOLLOW_BLOCK_SIZE
+        with open(self.trace_filename, 'rb') as f:
+            end = file_size
+            while end > self.offset:
+                start = max(end - block_size, self.offset)
+                f.seek(start)
+                position = f.read(end - start).rfind(b'\n')
+                if position >= 0:
+                    return start + position + 1
+                end = start
+        return self.offset
+
+    def save(self, state_filename):
+        ''' Saves the parsing state. Data already returned is not saved '''
+        with open(state_filename, 'wb') as f:
+            pickle.dump((self.trace_filename, self.offset,
+                         self.transaction_context), f)
+
+    @classmethod
+    def load(cls, trace_reader, state_filename):
+        ''' Returns a follower resuming from a state saved with save() '''
+        with open(state_filename, 'rb') as f:
+            trace_filename, offset, transaction_context = pickle.load(f)
+        return cls(trace_reader, trace_filename, offset, transaction_context)
+
 
 @dataclass
 class SectionTrigger:
     section_trigger : str = ""
     parameters : list = field(default_factory=list)
+    # Optional parameter: (dtype, format)
+    parameter_types : dict = field(default_factory=dict)
     
     def is_complete(self):
-        return all(self.__dict__.values())   
+        return all((self.section_trigger, self.parameters))
 
         
 @dataclass
@@ -140,55 +660,1074 @@ class TransactionTrigger():
     msg_timestamp_trigger : str = ""
     msg_trigger : str = ""
     section_triggers : list = field(default_factory=list)      
+    # Optional timestamp (dtype, format)
+    msg_timestamp_type : tuple = ()
 
     def is_complete(self):
-        return all(self.__dict__.values())
+        return all((self.transaction_name, self.transaction_start_trigger,
+                    self.msg_timestamp_trigger, self.msg_trigger,
+                    self.section_triggers))
+
+
+class CompiledPattern():
+    ''' Trigger pattern compiled once per config
+        Patterns without regex metacharacters (e.g. "IMSI = ") are matched
+        with plain string operations instead of the regex engine.
+        Pickled with its analysis, so unpickling only compiles the regex
+    '''
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.literal = self.get_literal(pattern)
+        self.required_literal = self.find_required_literal()
+        self.set_functions()
+
+    def set_functions(self):
+        if self.literal is None:
+            self.regex = re.compile(self.pattern)
+            self.search = self.regex.search
+            self.match = self.regex.match
+        else:
+            literal = self.literal
+            self.regex = None
+            self.search = lambda input_line: literal in input_line
+            self.match = lambda input_line: input_line.startswith(literal)
+
+    def __getstate__(self):
+        return (self.pattern, self.literal, self.required_literal)
+
+    def __setstate__(self, state):
+        self.pattern, self.literal, self.required_literal = state
+        self.set_functions()
+
+    def profile(self, instrumentation, kind):
+        ''' Adds searches and matches to the stats of instrumentation '''
+        self.search = instrumentation.profile_function(kind, self.pattern,
+                                                       self.search)
+        self.match = instrumentation.profile_function(kind, self.pattern,
+                                                      self.match)
+
+    def get_required_literal(self):
+        ''' Returns the longest text that any line matching the pattern
+            contains, or None if no such text can be found
+        '''
+        return self.required_literal
+
+    def find_required_literal(self):
+        if self.literal is not None:
+            return self.literal
+        try:
+            parsed = sre_parse.parse(self.pattern)
+        except re.error:
+            return None
+        if parsed.state.flags & re.IGNORECASE:
+            return None
+        runs = [[]]
+        self.collect_literal_runs(parsed, runs)
+        literal = max((''.join(run) for run in runs), key=len)
+        return literal or None
+
+    @classmethod
+    def collect_literal_runs(cls, parsed, runs):
+        ''' Appends to runs the sequences of literal characters found in
+            parsed that are always part of a match
+        '''
+        for opcode, argument in parsed:
+            if opcode is sre_parse.LITERAL:
+                runs[-1].append(chr(argument))
+            elif opcode is sre_parse.SUBPATTERN and not argument[1]:
+                # Group without inline flags
+                cls.collect_literal_runs(argument[-1], runs)
+            elif opcode in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                minimum, _, repeated = argument
+                runs.append([])
+                if minimum > 0:
+                    cls.collect_literal_runs(repeated, runs)
+                    runs.append([])
+            else:
+                runs.append([])
+
+    @staticmethod
+    def get_literal(pattern):
+        ''' Returns the text matched by pattern when it contains no regex
+            metacharacters, None otherwise
+        '''
+        literal = []
+        escaped = False
+        for char in pattern:
+            if escaped:
+                escaped = False
+                if char in tac.REGEX_LITERAL_ESCAPES:
+                    literal.append(tac.REGEX_LITERAL_ESCAPES[char])
+                elif char.isalnum():
+                    # Character classes (\d, \w...) or back references
+                    return None
+                else:
+                    literal.append(char)
+            elif char == '\\':
+                escaped = True
+            elif char in tac.REGEX_METACHARACTERS:
+                return None
+            else:
+                literal.append(char)
+        if escaped or not literal:
+            return None
+        return ''.join(literal)
+
+
+class PatternSet():
+    ''' Ordered collection of patterns checked with a single combined
+        alternation regex. Lines not matching any pattern, the vast majority,
+        are rejected with one test. Results follow the pattern order, exactly
+        as if every pattern was searched on its own
+    '''
+    def __init__(self, patterns):
+        self.patterns = [CompiledPattern(pattern) for pattern in patterns]
+        self.group_index = {}
+        self.combined = None
+        self.search_combined = None
+        if len(patterns) > 1:
+            self.combined = self.combine(patterns)
+        if self.combined is not None:
+            self.search_combined = self.combined.search
+
+    def __getstate__(self):
+        combined = self.combined.pattern if self.combined is not None \
+            else None
+        return (self.patterns, self.group_index, combined)
+
+    def __setstate__(self, state):
+        self.patterns, self.group_index, combined = state
+        self.combined = None
+        self.search_combined = None
+        if combined is not None:
+            self.combined = re.compile(combined)
+            self.search_combined = self.combined.search
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def profile(self, instrumentation, kind):
+        ''' Adds pattern searches to the stats of instrumentation. The 
+            combined regex has stats of its own
+        '''
+        for pattern in self.patterns:
+            pattern.profile(instrumentation, kind)
+        if self.search_combined is not None:
+            self.search_combined = instrumentation.profile_function(
+                f'{kind} (combined)',
+                ' | '.join(pattern.pattern for pattern in self.patterns),
+                self.search_combined)
+
+    def combine(self, patterns):
+        ''' Builds one regex with a named group per pattern '''
+        if any(re.search(r'\\[1-9]', pattern) for pattern in patterns):
+            # Back references would be renumbered by the new groups
+            return None
+        alternatives = []
+        for index, pattern in enumerate(patterns):
+            group_name = f'{tac.REGEX_GROUP_PREFIX}{index}'
+            self.group_index[group_name] = index
+            alternatives.append(f'(?P<{group_name}>{pattern})')
+        try:
+            return re.compile('|'.join(alternatives))
+        except re.error:
+            # E.g. inline flags, only valid at the start of a pattern
+            return None
+
+    def search_first(self, input_line):
+        ''' Returns index of the first pattern found in line, or None '''
+        if self.combined is None:
+            for index, pattern in enumerate(self.patterns):
+                if pattern.search(input_line):
+                    return index
+            return None
+        match = self.search_combined(input_line)
+        if not match:
+            return None
+        found = self.group_index[match.lastgroup]
+        # Earlier patterns may still match further on in the line
+        for index in range(found):
+            if self.patterns[index].search(input_line):
+                return index
+        return found
+
+    def search_all(self, input_line):
+        ''' Returns indexes of all the patterns found in line '''
+        if self.combined is None:
+            return [index for index, pattern in enumerate(self.patterns)
+                    if pattern.search(input_line)]
+        match = self.search_combined(input_line)
+        if not match:
+            return []
+        found = self.group_index[match.lastgroup]
+        return [index for index, pattern in enumerate(self.patterns)
+                if index == found or pattern.search(input_line)]
+
+
+class CompiledSectionTrigger():
+    ''' Compiled form of a SectionTrigger. Parameter column names and their
+        FieldIndex indexes are computed here once.
+        Literal "key =" parameters go to a dispatch table by key, so a line
+        costs one split and one dict lookup. Keys are compared without the
+        whitespace around them, so "Rat Type Value =" also matches a
+        "Rat Type Value=2" line, but not "Old Rat Type Value = 2". Other
+        parameters are searched with a PatternSet
+    '''
+    def __init__(self, section_trigger, field_index, columns=None):
+        self.section_trigger = section_trigger.section_trigger
+        self.parameters = section_trigger.parameters
+        self.parameter_names = [self.format_parameter_name(parameter)
+                                for parameter in self.parameters]
+        # Parameter key: FieldIndex indexes
+        self.parameter_keys = {}
+        # Parameters of other columns, only matched to set a hidden field
+        hidden_parameters = []
+        if columns is not None:
+            # Transactions are kept as when all columns are extracted
+            self.parameters, self.parameter_names = [], []
+            for parameter in section_trigger.parameters:
+                name = self.format_parameter_name(parameter)
+                if name in columns:
+                    self.parameters.append(parameter)
+                    self.parameter_names.append(name)
+                else:
+                    hidden_parameters.append(parameter)
+        self.parameter_indexes = [field_index.get_index(name)
+                                  for name in self.parameter_names]
+        pattern_parameters = []
+        found_index = field_index.get_index(tac.PARAMETER_FOUND_FIELD) \
+            if hidden_parameters else None
+        for parameter, index in list(zip(self.parameters,
+                                         self.parameter_indexes)) + \
+                [(parameter, found_index) for parameter in hidden_parameters]:
+            key = self.get_parameter_key(parameter)
+            if key is None:
+                pattern_parameters.append((parameter, index))
+            else:
+                self.parameter_keys.setdefault(key, []).append(index)
+        self.parameter_patterns = PatternSet(
+            [parameter for parameter, _ in pattern_parameters])
+        self.pattern_indexes = [index for _, index in pattern_parameters]
+
+    @staticmethod
+    def get_parameter_key(parameter):
+        ''' Returns the key of a literal "key =" parameter, the text before
+            "=" stripped of whitespace. None if the parameter is a regex or
+            has text after "="
+        '''
+        literal = CompiledPattern.get_literal(parameter)
+        if literal is None:
+            return None
+        key, sep, rest = literal.partition('=')
+        key = key.strip()
+        if not sep or rest.strip() or not key:
+            return None
+        return key
+
+    def format_parameter_name(self, parameter):
+        ''' Returns the column name of a parameter in this section '''
+        return get_parameter_name(self.section_trigger, parameter)
+
+    def get_patterns(self):
+        return self.parameter_patterns.patterns
+
+    def profile(self, instrumentation):
+        ''' Adds parameter searches to the stats of instrumentation '''
+        self.parameter_patterns.profile(instrumentation, 'param')
+        self.search_parameter_indexes = instrumentation.profile_function(
+            'section params', self.section_trigger,
+            self.search_parameter_indexes)
+
+    def get_required_literals(self):
+        ''' Returns texts such that any line with a parameter contains at
+            least one of them. None if some parameter has no required text
+        '''
+        literals = set(self.parameter_keys)
+        for pattern in self.parameter_patterns.patterns:
+            literal = pattern.get_required_literal()
+            if literal is None:
+                return None
+            literals.add(literal)
+        return literals
+
+    def search_parameters(self, input_line):
+        ''' Returns the parameters found in input_line '''
+        indexes = self.search_parameter_indexes(input_line)
+        return [parameter for parameter, index in 
+                zip(self.parameters, self.parameter_indexes) 
+                if index in indexes]
+
+    def search_parameter_indexes(self, input_line, key=None):
+        ''' Returns FieldIndex indexes of the parameters found in input_line.
+            key is the text before "=" in input_line, if already known
+        '''
+        if key is None:
+            key = input_line.split('=', 1)[0].strip()
+        indexes = self.parameter_keys.get(key, [])
+        if self.pattern_indexes:
+            found = self.parameter_patterns.search_all(input_line)
+            if found:
+                indexes = indexes + [self.pattern_indexes[index] 
+                                     for index in found]
+        return indexes
+
+
+class CompiledTransactionTrigger():
+    ''' Compiled form of a TransactionTrigger '''
+    def __init__(self, transaction_trigger, field_index, columns=None):
+        self.trigger = transaction_trigger
+        self.transaction_name = transaction_trigger.transaction_name
+        self.msg_timestamp_trigger = CompiledPattern(
+            transaction_trigger.msg_timestamp_trigger)
+        self.msg_trigger = CompiledPattern(transaction_trigger.msg_trigger)
+        self.section_triggers = [
+            CompiledSectionTrigger(section_trigger, field_index, columns) 
+            for section_trigger in transaction_trigger.section_triggers]
+        self.section_patterns = PatternSet(
+            [section_trigger.section_trigger for section_trigger in
+             transaction_trigger.section_triggers])
+
+    def profile(self, instrumentation):
+        ''' Adds pattern searches to the stats of instrumentation '''
+        self.msg_timestamp_trigger.profile(instrumentation, 'timestamp')
+        self.msg_trigger.profile(instrumentation, 'message')
+        self.section_patterns.profile(instrumentation, 'section')
+        for section_trigger in self.section_triggers:
+            section_trigger.profile(instrumentation)
+
+    def search_section_trigger(self, input_line):
+        ''' Returns the first section trigger found in input_line '''
+        index = self.section_patterns.search_first(input_line)
+        if index is None:
+            return None
+        return self.section_triggers[index]
+
+
+class TriggerDispatcher():
+    ''' Picks the transaction trigger of a timestamp line among candidate
+        triggers, as the first one in config order whose timestamp pattern
+        matches and whose transaction name is in the message type.
+        Triggers sharing a timestamp pattern are grouped, so each distinct
+        pattern is matched once per line, and the trigger of each message
+        type is looked up in a dict once it is known
+    '''
+    def __init__(self, triggers):
+        self.triggers = triggers
+        # Timestamp pattern: (position of first trigger, triggers)
+        groups = {}
+        for position, trigger in enumerate(triggers):
+            pattern = trigger.trigger.msg_timestamp_trigger
+            groups.setdefault(pattern, (position, []))[1].append(
+                (position, trigger))
+        self.groups = [(trigger_group[0][1].msg_timestamp_trigger, 
+                        first_position, trigger_group)
+                       for first_position, trigger_group in groups.values()]
+        # Message type by group: (position, trigger), or None if no match
+        self.type_triggers = [{} for _ in self.groups]
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def get_trigger(self, input_line):
+        ''' Returns (trigger, timestamp match groups), or (None, None) '''
+        best = None
+        best_groups = None
+        for group_index, (pattern, first_position, trigger_group) in \
+                enumerate(self.groups):
+            if best is not None and first_position > best[0]:
+                # No trigger of this or later groups comes first
+                break
+            match = pattern.match(input_line)
+            if not match:
+                continue
+            groups = match.groups()
+            assert(len(groups) == 3)
+            candidate = self.get_type_trigger(group_index, trigger_group,
+                                              groups[2])
+            if candidate is not None and (best is None or 
+                                          candidate[0] < best[0]):
+                best = candidate
+                best_groups = groups
+        if best is None:
+            return None, None
+        return best[1], best_groups
+
+    def get_type_trigger(self, group_index, trigger_group, message_type):
+        type_triggers = self.type_triggers[group_index]
+        try:
+            return type_triggers[message_type]
+        except KeyError:
+            pass
+        candidate = None
+        # groups[2] contains the transaction type
+        for position, trigger in trigger_group:
+            if trigger.transaction_name in message_type:
+                candidate = (position, trigger)
+                break
+        if len(type_triggers) >= tac.TRIGGER_DISPATCH_CACHE_SIZE:
+            type_triggers.clear()
+        type_triggers[message_type] = candidate
+        return candidate
+
+
+class TransactionMatcher():
+    ''' Compiled form of all the transaction triggers of a config.
+        Built once per config and shared by all trace reads. If columns is 
+        given, only parameters of those columns are extracted
+    '''
+    def __init__(self, transaction_triggers, columns=None):
+        # Column index of every field of the config
+        self.field_index = FieldIndex(tac.MESSAGE_FIELDS)
+        self.triggers = [
+            CompiledTransactionTrigger(transaction_trigger, self.field_index,
+                                       columns)
+            for transaction_trigger in transaction_triggers]
+        self.column_converter = ColumnConverter(
+            self.get_column_types(transaction_triggers))
+        # Triggers sharing a start pattern are checked only once
+        start_patterns = {}
+        for trigger in self.triggers:
+            start_pattern = trigger.trigger.transaction_start_trigger
+            start_patterns.setdefault(start_pattern, []).append(trigger)
+        self.start_patterns = PatternSet(list(start_patterns))
+        self.start_literals = self.get_start_literals()
+        self.required_literals = self.find_required_literals()
+        self.start_pattern_triggers = [TriggerDispatcher(triggers) 
+                                       for triggers in start_patterns.values()]
+        # Dispatchers of lines matching several start patterns, by patterns
+        self.dispatchers = {}
+
+    def get_triggers(self):
+        return self.triggers
+
+    def profile(self, instrumentation):
+        ''' Adds the evaluations, matches and time of every pattern to the
+            stats of instrumentation. Patterns stay profiled, so the matcher
+            should not be shared with other reads
+        '''
+        self.start_patterns.profile(instrumentation, 'start')
+        if self.start_literals is not None:
+            self.may_start = instrumentation.profile_function(
+                'start literals', ' | '.join(self.start_literals),
+                self.may_start)
+        for trigger in self.triggers:
+            trigger.profile(instrumentation)
+
+    def get_field_index(self):
+        return self.field_index
 
+    def get_column_converter(self):
+        return self.column_converter
 
-class Message(dict):
-    ''' Data container for a message '''
-    def __init__(self, message_id):
-        self.message_id = {'Message ID': message_id}
+    def get_timestamp_format(self):
+        ''' Format of message timestamps, as declared in the config '''
+        column_type = self.column_converter.column_types.get(
+            tac.MESSAGE_FIELDS[tac.TIMESTAMP_INDEX])
+        if column_type and column_type[1]:
+            return column_type[1]
+        return tac.TRACE_TIMESTAMP_FORMAT
+
+    def has_parameters(self):
+        return len(self.field_index) > len(tac.MESSAGE_FIELDS)
+
+    def get_column_types(self, transaction_triggers):
+        ''' Returns the declared (dtype, format) of columns, by name '''
+        column_types = {}
+        def add_column_type(name, column_type):
+            if column_types.setdefault(name, column_type) != column_type:
+                raise(ValueError(f"Conflicting types of column: {name}"))
+        for transaction_trigger, trigger in zip(transaction_triggers,
+                                                self.triggers):
+            if transaction_trigger.msg_timestamp_type:
+                add_column_type(tac.MESSAGE_FIELDS[tac.TIMESTAMP_INDEX],
+                                transaction_trigger.msg_timestamp_type)
+            for section_trigger, compiled_section_trigger in zip(
+                    transaction_trigger.section_triggers,
+                    trigger.section_triggers):
+                for parameter, name in zip(
+                        compiled_section_trigger.parameters,
+                        compiled_section_trigger.parameter_names):
+                    column_type = section_trigger.parameter_types.get(parameter)
+                    if column_type:
+                        add_column_type(name, column_type)
+        return column_types
+
+    def get_patterns(self):
+        ''' Returns all the compiled patterns of the config '''
+        patterns = list(self.start_patterns.patterns)
+        for trigger in self.triggers:
+            patterns.append(trigger.msg_timestamp_trigger)
+            patterns.append(trigger.msg_trigger)
+            patterns.extend(trigger.section_patterns.patterns)
+            for section_trigger in trigger.section_triggers:
+                patterns.extend(section_trigger.get_patterns())
+        return patterns
+
+    def get_required_literals(self):
+        ''' Returns texts such that any line matched by a pattern or with a
+            parameter key contains at least one of them. None if some pattern
+            has no required text
+        '''
+        return self.required_literals
+
+    def find_required_literals(self):
+        literals = set()
+        for pattern in self.start_patterns.patterns:
+            literals.add(pattern.get_required_literal())
+        for trigger in self.triggers:
+            literals.add(trigger.msg_timestamp_trigger.get_required_literal())
+            literals.add(trigger.msg_trigger.get_required_literal())
+            for pattern in trigger.section_patterns.patterns:
+                literals.add(pattern.get_required_literal())
+            for section_trigger in trigger.section_triggers:
+                parameter_literals = section_trigger.get_required_literals()
+                if parameter_literals is None:
+                    return None
+                literals.update(parameter_literals)
+        if None in literals:
+            return None
+        return sorted(literals)
+
+    def get_start_literals(self):
+        ''' Returns texts such that any transaction start line contains at
+            least one of them. None if some start pattern has no required text
+        '''
+        literals = set()
+        for pattern in self.start_patterns.patterns:
+            literal = pattern.get_required_literal()
+            if literal is None:
+                return None
+            literals.add(literal)
+        return sorted(literals)
+
+    def may_start(self, input_line):
+        ''' Plain substring check. False if input_line cannot be a
+            transaction start line
+        '''
+        start_literals = self.start_literals
+        if start_literals is None:
+            return True
+        for literal in start_literals:
+            if literal in input_line:
+                return True
+        return False
+
+    def search_start_triggers(self, input_line):
+        ''' Returns a TriggerDispatcher of the triggers whose transaction
+            start pattern is found in input_line, or None if there are none
+        '''
+        if not self.may_start(input_line):
+            # Plain substring check, before any regex
+            return None
+        found = self.start_patterns.search_all(input_line)
+        if len(found) == 1:
+            return self.start_pattern_triggers[found[0]]
+        if not found:
+            return None
+        found = tuple(found)
+        dispatcher = self.dispatchers.get(found)
+        if dispatcher is None:
+            trigger_matches = []
+            for index in found:
+                trigger_matches.extend(
+                    self.start_pattern_triggers[index].triggers)
+            dispatcher = TriggerDispatcher(
+                [trigger for trigger in self.triggers 
+                 if trigger in trigger_matches])
+            self.dispatchers[found] = dispatcher
+        return dispatcher
+
+
+class FieldIndex():
+    ''' Interned field names. Each name gets a column index that never
+        changes, so messages store values by position
+    '''
+    def __init__(self, names=()):
+        self.names = []
+        self.indexes = {}
+        for name in names:
+            self.get_index(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_index(self, name):
+        ''' Returns the index of name, assigning a new one if needed '''
+        index = self.indexes.get(name)
+        if index is None:
+            index = len(self.names)
+            self.indexes[name] = index
+            self.names.append(name)
+        return index
+
+
+class Message():
+    ''' Data container for a message
+        Field values are stored by FieldIndex position. None means not set.
+        order keeps the indexes of the fields set, in the order they were
+        first set, as the keys of a dict would
+    '''
+    __slots__ = ('message_id', 'values', 'order')
+
+    def __init__(self, message_id, num_fields=0):
+        self.message_id = message_id
+        self.values = [None] * num_fields
+        self.order = []
+
+    def __len__(self):
+        return len(self.order)
+
+    def set_value(self, index, value):
+        values = self.values
+        if index >= len(values):
+            values.extend([None] * (index + 1 - len(values)))
+        if values[index] is None and value is not None:
+            self.order.append(index)
+        values[index] = value
+
+    def to_dict(self, names):
+        values = self.values
+        return {names[index]: values[index] for index in self.order}
     
 
-class Transaction(dict):
+class Transaction():
     ''' Data container for a transaction 
-        It is a collection of Message objects plus control info
+        It is a collection of Message objects, by message ID, plus control 
+        info. Field names are resolved through field_index, by default one
+        holding only the common message fields
     '''
-    def __init__(self, transaction_id, transaction_trigger):
+    __slots__ = ('transaction_id', 'transaction_trigger', 'field_index',
+                 'messages')
+
+    def __init__(self, transaction_id, transaction_trigger, field_index=None):
         self.transaction_id = transaction_id
         self.transaction_trigger = transaction_trigger
+        if field_index is None:
+            field_index = FieldIndex(tac.MESSAGE_FIELDS)
+        self.field_index = field_index
+        self.messages = {}
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, message_id):
+        return self.messages[message_id]
+
+    def values(self):
+        return self.messages.values()
     
     def get_section_triggers(self):
         return self.transaction_trigger.section_triggers 
     
     def get_trigger(self):
         return self.transaction_trigger
+
+    def get_message(self, message_id):
+        ''' Returns the message, creating it if it does not exist yet '''
+        message = self.messages.get(message_id)
+        if message is None:
+            message = Message(message_id, len(self.field_index))
+            self.messages[message_id] = message
+        return message
     
     def set_field(self, message_id, field, value):
-        message = self.get(message_id, Message(message_id))
-        message[field] = value
-        self[message_id] = message
+        self.set_value(message_id, self.field_index.get_index(field), value)
+
+    def set_value(self, message_id, index, value):
+        ''' set_field with the FieldIndex index of the field '''
+        self.get_message(message_id).set_value(index, value)
     
+    def get_field_names(self):
+        ''' Returns the union of the field names of all messages '''
+        names = self.field_index.names
+        return {names[index] for index in self.get_field_indexes()}
+
+    def get_field_indexes(self):
+        ''' Returns the union of the field indexes of all messages '''
+        field_indexes = set()
+        for message in self.messages.values():
+            field_indexes.update(message.order)
+        return field_indexes
+
+    def has_more_fields(self, num_fields):
+        ''' True if more than num_fields distinct fields are set. Stops at
+            the first message where the count is reached
+        '''
+        field_indexes = set()
+        for message in self.messages.values():
+            if len(message.order) > num_fields:
+                return True
+            field_indexes.update(message.order)
+            if len(field_indexes) > num_fields:
+                return True
+        return False
+
+    def to_dict(self):
+        names = self.field_index.names
+        return {message_id: message.to_dict(names)
+                for message_id, message in self.messages.items()}
+
     def to_DataFrame(self):
         rows = []
-        for message in self.values():
+        for message in self.to_dict().values():
             row = {**{'TID':self.transaction_id}, **message}
             rows.append(row)
         return pd.DataFrame(rows)
     
     def __repr__(self):
         result = f'TID = {self.transaction_id}\n'
-        result += super().__repr__()
+        result += repr(self.to_dict())
         return result
+
+
+class TransactionAccumulator():
+    ''' Columnar container for the rows of completed transactions
+        Each field is kept in its own list, so adding a transaction only costs
+        its own size. The DataFrame is built once, when requested.
+        Columns are indexed as in the FieldIndex of the first transaction
+        added, and follow the order in which fields first appear in the trace
+    '''
+    def __init__(self):
+        self.tids = []
+        self.field_index = None
+        # Lists of values by field index, None for fields not seen yet
+        self.columns = []
+        # Field indexes in order of first appearance
+        self.column_order = []
+        self.num_transactions = 0
+
+    def __len__(self):
+        return len(self.tids)
+
+    def clear(self):
+        ''' Removes all rows. Known columns are kept '''
+        self.tids = []
+        self.columns = [None if column is None else []
+                        for column in self.columns]
+        self.num_transactions = 0
+
+    def add_transaction(self, transaction):
+        if self.field_index is None:
+            self.field_index = transaction.field_index
+        tids = self.tids
+        columns = self.columns
+        column_order = self.column_order
+        for message in transaction.values():
+            values = message.values
+            order = message.order
+            if transaction.field_index is not self.field_index:
+                values, order = self.translate_values(
+                    values, order, transaction.field_index)
+            if len(values) > len(columns):
+                columns.extend([None] * (len(values) - len(columns)))
+            for index in order:
+                if columns[index] is None:
+                    # Fields seen for the first time are back filled, in
+                    # the order they were set in the message
+                    columns[index] = [None] * len(tids)
+                    column_order.append(index)
+            num_values = len(values)
+            for index in column_order:
+                columns[index].append(values[index] if index < num_values
+                                      else None)
+            tids.append(transaction.transaction_id)
+        self.num_transactions += 1
+
+    def translate_values(self, values, order, field_index):
+        ''' Maps values and their order, indexed by field_index, to own field
+            index
+        '''
+        translated = []
+        translated_order = []
+        for index in order:
+            own_index = self.field_index.get_index(field_index.names[index])
+            if own_index >= len(translated):
+                translated.extend([None] * (own_index + 1 - len(translated)))
+            translated[own_index] = values[index]
+            translated_order.append(own_index)
+        return translated, translated_order
+
+    def to_DataFrame(self):
+        if not self.tids:
+            return pd.DataFrame()
+        names = self.field_index.names
+        return pd.DataFrame({**{'TID':self.tids}, 
+                             **{names[index]: self.columns[index]
+                                for index in self.column_order}})
         
-    
+
+class TransactionFilter():
+    ''' Predicates checked while parsing, so transactions not needed are
+        dropped early. A transaction is kept if, for every filter, one of its
+        messages has one of the filter values, and if one of its message
+        timestamps is in time_range.
+        - filters: column name: value, or set (list, tuple) of values. Values
+          are compared with the text found in the trace
+        - time_range: (start, end), end excluded. Either can be None
+    '''
+    def __init__(self, field_index, filters=None, time_range=None,
+                 timestamp_format=tac.TRACE_TIMESTAMP_FORMAT):
+        self.value_filters = []
+        for column, values in (filters or {}).items():
+            if column not in field_index.indexes:
+                raise(ValueError(f"Incorrect column: {column}"))
+            self.value_filters.append((field_index.indexes[column],
+                                       self.get_values(values)))
+        start_time, end_time = time_range or (None, None)
+        self.start_time = self.get_time(start_time)
+        self.end_time = self.get_time(end_time)
+        self.timestamp_format = timestamp_format
+
+    @staticmethod
+    def get_values(values):
+        if isinstance(values, (set, frozenset, list, tuple)):
+            return {str(value) for value in values}
+        return {str(values)}
+
+    @staticmethod
+    def get_time(value):
+        if value is None:
+            return None
+        return pd.Timestamp(value).to_pydatetime()
+
+    def check_times(self, transaction):
+        ''' True if a message timestamp is in time range '''
+        if self.start_time is None and self.end_time is None:
+            return True
+        for message in transaction.values():
+            try:
+                timestamp = datetime.datetime.strptime(
+                    message.values[tac.TIMESTAMP_INDEX], self.timestamp_format)
+            except (TypeError, ValueError):
+                continue
+            if (self.start_time is None or timestamp >= self.start_time) and \
+                    (self.end_time is None or timestamp < self.end_time):
+                return True
+        return False
+
+    def check_values(self, transaction):
+        ''' True if every value filter is met by a message '''
+        for index, values in self.value_filters:
+            for message in transaction.values():
+                message_values = message.values
+                if index < len(message_values) and \
+                        message_values[index] in values:
+                    break
+            else:
+                return False
+        return True
+
+
+class ColumnConverter():
+    ''' Converts result columns from strings to the types declared in the
+        config, a whole column at a time:
+        - datetime64: with the declared format, if any. Unparseable values
+          are NaT
+        - numeric types: from the first number in the value, e.g. 64000 in
+          "64000 kbps". Non integer values of integer columns, e.g. "64.5
+          kbps", are missing, with a warning. Integer columns with missing
+          values get the nullable integer type, e.g. Int64 for int64
+        - other pandas dtypes, e.g. category or string: with astype
+    '''
+    def __init__(self, column_types):
+        self.column_types = column_types
+
+    def convert(self, df):
+        for column, (dtype, value_format) in self.column_types.items():
+            if column in df:
+                df[column] = self.convert_column(df[column], dtype,
+                                                 value_format)
+        return df
+
+    def convert_column(self, values, dtype, value_format=''):
+        if dtype == tac.PD_DATETIME_TYPE:
+            return pd.to_datetime(values, format=value_format or None,
+                                  errors='coerce')
+        pandas_dtype = get_dtype(dtype)
+        if not pd.api.types.is_numeric_dtype(pandas_dtype) or \
+                pd.api.types.is_bool_dtype(pandas_dtype):
+            return values.astype(pandas_dtype)
+        numbers = pd.to_numeric(values, errors='coerce')
+        # Values with units or other text around the number
+        missing = numbers.isna() & values.notna()
+        if missing.any():
+            numbers[missing] = pd.to_numeric(
+                values[missing].astype(str).str.extract(
+                    tac.NUMBER_PATTERN, expand=False), errors='coerce')
+        if pd.api.types.is_integer_dtype(pandas_dtype):
+            fractional = numbers.notna() & (numbers % 1 != 0)
+            if fractional.any():
+                logger.warning('%d non integer values of %s read as missing,'
+                               ' e.g. %s', fractional.sum(), values.name,
+                               values[fractional].iloc[0])
+                numbers = numbers.mask(fractional)
+        if isinstance(pandas_dtype, np.dtype) and pandas_dtype.kind in 'iu' \
+                and numbers.isna().any():
+            pandas_dtype = pd.api.types.pandas_dtype(
+                tac.PD_NULLABLE_INTEGER_TYPES[pandas_dtype.name])
+        return numbers.astype(pandas_dtype)
+
+
+class TraceInstrumentation():
+    ''' Collects metrics of a trace read: lines and bytes read from the trace
+        file, including lines skipped unparsed (unmatched_lines), transactions
+        found, emitted and discarded, and time spent in each state. Progress is reported at most every report_interval
+        seconds to callback(metrics), or logged if there is no callback.
+        With profile, evaluations, matches and time of every config pattern
+        are collected too, see get_profile_report. Patterns then run
+        wrapped in timers, so reads are slower
+    '''
+    def __init__(self, callback=None,
+                 report_interval=tac.TRACE_REPORT_INTERVAL, profile=False):
+        self.callback = callback
+        self.report_interval = report_interval
+        self.profile = profile
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.perf_counter()
+        self.last_report_time = self.start_time
+        self.lines = 0
+        self.unmatched_lines = 0
+        self.bytes = 0
+        self.transactions_found = 0
+        self.transactions_emitted = 0
+        self.transactions_discarded = 0
+        self.state_times = defaultdict(float)
+        self.state_lines = defaultdict(int)
+        # (pattern kind, pattern): [evaluations, matches, seconds]
+        self.pattern_stats = {}
+
+    def lines_read(self, num_lines, num_bytes, skipped=False):
+        ''' Counts lines read from the trace, num_bytes long as stored.
+            skipped for lines never parsed, e.g. by the mmap scanner
+        '''
+        self.lines += num_lines
+        self.bytes += num_bytes
+        if skipped:
+            self.unmatched_lines += num_lines
+
+    def line_processed(self, state, start_time, end_time):
+        state_name = state.__class__.__name__
+        self.state_times[state_name] += end_time - start_time
+        self.state_lines[state_name] += 1
+        if end_time - self.last_report_time >= self.report_interval:
+            self.last_report_time = end_time
+            self.report()
+
+    def transaction_found(self):
+        self.transactions_found += 1
+
+    def transaction_emitted(self):
+        self.transactions_emitted += 1
+
+    def transaction_discarded(self):
+        self.transactions_discarded += 1
+
+    def merge(self, other):
+        ''' Adds the counters of other, e.g. collected by another process '''
+        self.lines += other.lines
+        self.unmatched_lines += other.unmatched_lines
+        self.bytes += other.bytes
+        self.transactions_found += other.transactions_found
+        self.transactions_emitted += other.transactions_emitted
+        self.transactions_discarded += other.transactions_discarded
+        for state_name, state_time in other.state_times.items():
+            self.state_times[state_name] += state_time
+        for state_name, state_lines in other.state_lines.items():
+            self.state_lines[state_name] += state_lines
+        for key, stats in other.pattern_stats.items():
+            total_stats = self.pattern_stats.setdefault(key, [0, 0, 0.0])
+            for index, value in enumerate(stats):
+                total_stats[index] += value
+
+    def profile_function(self, kind, pattern, function):
+        ''' Returns function wrapped to add its calls to the stats of
+            pattern. Calls returning a true value count as matches
+        '''
+        key = (kind, pattern)
+        self.pattern_stats.setdefault(key, [0, 0, 0.0])
+        perf_counter = time.perf_counter
+        def profiled(*args):
+            start_time = perf_counter()
+            result = function(*args)
+            seconds = perf_counter() - start_time
+            # Looked up on each call, as reset replaces the stats
+            stats = self.pattern_stats.setdefault(key, [0, 0, 0.0])
+            stats[0] += 1
+            stats[2] += seconds
+            if result:
+                stats[1] += 1
+            return result
+        return profiled
+
+    def get_profile_report(self):
+        ''' Returns (patterns, states) DataFrames, most expensive first.
+            Times of patterns are part of the times of the states running
+            them. "section params" entries cover every param of a section,
+            including its "param" patterns
+        '''
+        patterns = pd.DataFrame(
+            [(kind, pattern, evaluations, matches, seconds)
+             for (kind, pattern), (evaluations, matches, seconds) in
+             self.pattern_stats.items()],
+            columns=['kind', 'pattern', 'evaluations', 'matches', 'seconds'])
+        patterns['us_per_evaluation'] = 1e6 * patterns['seconds'] / \
+            patterns['evaluations'].clip(lower=1)
+        states = pd.DataFrame(
+            [(state_name, self.state_lines[state_name], seconds)
+             for state_name, seconds in self.state_times.items()],
+            columns=['state', 'lines', 'seconds'])
+        states['us_per_line'] = 1e6 * states['seconds'] / \
+            states['lines'].clip(lower=1)
+        return (patterns.sort_values('seconds', ascending=False,
+                                     ignore_index=True),
+                states.sort_values('seconds', ascending=False,
+                                   ignore_index=True))
+
+    def get_metrics(self):
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        return {'elapsed' : elapsed,
+                'lines' : self.lines,
+                'unmatched_lines' : self.unmatched_lines,
+                'bytes' : self.bytes,
+                'lines_per_sec' : self.lines / elapsed,
+                'bytes_per_sec' : self.bytes / elapsed,
+                'transactions_found' : self.transactions_found,
+                'transactions_emitted' : self.transactions_emitted,
+                'transactions_discarded' : self.transactions_discarded,
+                'state_times' : dict(self.state_times)}
+
+    def report(self):
+        metrics = self.get_metrics()
+        if self.callback:
+            self.callback(metrics)
+            return
+        logger.info('%d lines (%.0f lines/s, %.1f MB/s), transactions: '
+                    '%d found, %d emitted, %d discarded', metrics['lines'],
+                    metrics['lines_per_sec'], metrics['bytes_per_sec'] / 1e6,
+                    metrics['transactions_found'],
+                    metrics['transactions_emitted'],
+                    metrics['transactions_discarded'])
+
+    def __getstate__(self):
+        # Callbacks may not be picklable
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+
 class TransactionConfigContext():
     ''' Context to implement transaction config state machine '''
 
     def __init__(self):
         self.current_trigger = TransactionTrigger()
         self.current_section = SectionTrigger()
+        # Optional (dtype, format) of the line being processed
+        self.current_value_type = ()
         # Collected triggers
         self.transaction_triggers = []
         # Machine states
@@ -209,6 +1748,7 @@ class TransactionConfigContext():
         key, value = self.get_key_value(input_line)
         if key is None:
             return False
+        self.current_value_type = self.get_value_type(input_line)
         self.next_state.process_line(key, value)
         return True
 
@@ -235,9 +1775,30 @@ class TransactionConfigContext():
         if value and tac.TRANSACTION_CONFIG_REMOVE_QUOTES:
             value = value.replace('\"', '')
         return key, value   
+
+    def get_value_type(self, input_line, sep='\t'):
+        ''' Returns the optional (dtype, format) columns after key and value,
+            e.g. param "Rate =" float64, or msg_timestamp_trigger "(...)"
+            datetime64 "%a %d %b %Y %H:%M:%S.%f". Empty tuple if missing
+        '''
+        columns = [x.strip().replace('\"', '') 
+                   for x in input_line.split(sep)[2:4]]
+        if not columns or not columns[0]:
+            return ()
+        dtype = columns[0]
+        value_format = columns[1] if len(columns) > 1 else ''
+        if dtype != tac.PD_DATETIME_TYPE:
+            if value_format:
+                raise(ValueError(f"Format only supported for {tac.PD_DATETIME_TYPE}"))
+            # Checks the dtype while loading the config
+            get_dtype(dtype)
+        return (dtype, value_format)
     
     def get_transaction_triggers(self):
         return self.transaction_triggers
+
+    def get_transaction_matcher(self):
+        return TransactionMatcher(self.transaction_triggers)
     
 
 class TransactionConfigState(ABC):
@@ -281,6 +1842,8 @@ class TransactionConfigCollectParms(TransactionConfigState):
             self.context.current_trigger.transaction_start_trigger = value
         if key == tac.MSG_TIMESTAMP_TRIGGER:
             self.context.current_trigger.msg_timestamp_trigger = value
+            self.context.current_trigger.msg_timestamp_type = \
+                self.context.current_value_type
         if key == tac.MSG_TRIGGER:
             self.context.current_trigger.msg_trigger = value
         if key == tac.SECTION_TRIGGER:
@@ -300,21 +1863,40 @@ class TransactionConfigSection(TransactionConfigState):
             self.context.current_section.section_trigger = value
         if key == tac.SECTION_PARAM:
             self.context.current_section.parameters.append(value)
+            if self.context.current_value_type:
+                self.context.current_section.parameter_types[value] = \
+                    self.context.current_value_type
 
     
 class TransactionTraceContext():
     ''' Context to implement transaction trace state machine '''
 
-    def __init__(self, transaction_triggers):
-        self.trigger_matches = []
+    def __init__(self, transaction_triggers, transaction_matcher=None,
+                 instrumentation=None, transaction_filter=None, columns=None):
+        self.trigger_matches = None
         self.current_trigger = None
         self.current_section_trigger = None
         self.current_transaction_index = 0
         self.current_transaction = None
         self.empty_lines = 0
-        self.df = pd.DataFrame()
+        self.result = TransactionAccumulator()
         # Info to find
         self.transaction_triggers = transaction_triggers
+        if transaction_matcher is None:
+            transaction_matcher = TransactionMatcher(transaction_triggers)
+        self.transaction_matcher = transaction_matcher
+        self.field_index = transaction_matcher.get_field_index()
+        # Transactions need a parameter, unless none is extracted
+        self.min_fields = len(tac.MESSAGE_FIELDS)
+        if not transaction_matcher.has_parameters():
+            self.min_fields = 0
+        # Optional TransactionFilter and result columns
+        self.transaction_filter = transaction_filter
+        self.columns = columns
+        self.instrumentation = instrumentation
+        if instrumentation:
+            # Metrics are only collected, and paid for, if requested
+            self.process_line = self.process_line_instrumented
         # Machine states
         self.state_search_for_start = TransactionTraceSearchForStart(self)
         self.state_collect_time = TransactionTraceCollectTime(self)
@@ -333,22 +1915,64 @@ class TransactionTraceContext():
         self.next_state.process_line(input_line)
         return True
 
+    def process_unmatched_line(self):
+        ''' Processes a non empty line known not to match any trigger '''
+        self.next_state.unmatched_line()
+
+    def process_line_instrumented(self, input_line):
+        state = self.next_state
+        start_time = time.perf_counter()
+        result = TransactionTraceContext.process_line(self, input_line)
+        self.instrumentation.line_processed(state, start_time,
+                                            time.perf_counter())
+        return result
+
     def set_state(self, state):
         self.next_state = state 
+
+    def is_searching(self):
+        ''' True while only transaction start lines matter '''
+        return self.next_state is self.state_search_for_start
    
-    def get_result(self):
-        return self.df
+    def get_result(self, convert=True):
+        ''' Returns the transactions completed so far, with the column types
+            declared in the config unless convert is False
+        '''
+        df = self.result.to_DataFrame()
+        if self.columns is not None and not df.empty:
+            df = df.reindex(columns=['TID'] + list(self.columns))
+        if convert:
+            df = self.transaction_matcher.get_column_converter().convert(df)
+        return df
+
+    def flush_result(self):
+        ''' Returns the transactions completed so far and removes them '''
+        df = self.get_result()
+        self.result.clear()
+        return df
     
     def update_result(self):
         self.current_section_trigger = None
-        df_current_transaction = self.current_transaction.to_DataFrame()
-        if (df_current_transaction.shape[1] > 4):
-            # At least one message has been added to the transaction
-            self.df = self.df.append(df_current_transaction,
-                                     ignore_index=True)
+        transaction = self.current_transaction
+        if transaction is None:
+            # Nothing pending (e.g. already stored before EOF)
+            return
+        if transaction.has_more_fields(self.min_fields) and (
+                self.transaction_filter is None or
+                self.transaction_filter.check_values(transaction)):
+            # At least one parameter has been added to the transaction
+            self.result.add_transaction(transaction)
+            if self.instrumentation:
+                self.instrumentation.transaction_emitted()
+        elif self.instrumentation:
+            self.instrumentation.transaction_discarded()
+        self.current_transaction = None
     
     def get_triggers(self):
         return self.transaction_triggers
+
+    def get_matcher(self):
+        return self.transaction_matcher
         
     
 class TransactionTraceState(ABC):
@@ -364,6 +1988,10 @@ class TransactionTraceState(ABC):
     @abstractmethod
     def empty_line(self):
         pass
+
+    def unmatched_line(self):
+        ''' Line not matching any trigger. Ignored by default '''
+        pass
     
     def eof_found(self):
         self.context.update_result()
@@ -376,18 +2004,15 @@ class TransactionTraceSearchForStart(TransactionTraceState):
         ''' Checks if there is matching transaction trigger. If found
             makes it the current trigger and move to next state
         '''
-        transaction_triggers = self.context.get_triggers()
-        trigger_matches = []
-        for trigger in transaction_triggers:
-            match = re.search(trigger.transaction_start_trigger,
-                              input_line)
-            if match:
-                trigger_matches.append(trigger)
+        matcher = self.context.get_matcher()
+        trigger_matches = matcher.search_start_triggers(input_line)
         if trigger_matches:
             self.context.trigger_matches = trigger_matches
             self.context.current_transaction_index += 1
-            print(f'Transaction = {self.context.current_transaction_index}')
+            if self.context.instrumentation:
+                self.context.instrumentation.transaction_found()
             self.context.current_transaction = None
+            self.context.current_trigger = None
             self.context.set_state(self.context.state_collect_time)
 
 
@@ -402,35 +2027,52 @@ class TransactionTraceCollectTime(TransactionTraceState):
     def process_line(self, input_line):
         transaction = self.context.current_transaction
         if transaction:
-            trigger = transaction.get_trigger()
+            trigger = self.context.current_trigger
             self.collect_info(input_line, transaction, trigger)
         else:
-            for trigger in self.context.trigger_matches:
+            trigger, groups = self.context.trigger_matches.get_trigger(
+                input_line)
+            if trigger is not None:
                 tid = self.context.current_transaction_index    
-                transaction = Transaction(tid, trigger)
-                groups = self.collect_info(input_line, transaction, trigger)
-                if groups:
-                    # groups[2] contains the transaction type
-                    if trigger.transaction_name in groups[2]:
-                        self.context.current_transaction = transaction
-                        break
+                transaction = Transaction(tid, trigger.trigger,
+                                          self.context.field_index)
+                self.set_message_info(transaction, groups)
+                self.context.current_transaction = transaction
+                self.context.current_trigger = trigger
     
     def collect_info(self, input_line, transaction, trigger):
         ''' TransactionTraceCollectTime helper function '''
         groups = []
-        match = re.match(trigger.msg_timestamp_trigger, input_line)
+        match = trigger.msg_timestamp_trigger.match(input_line)
         if match:
             groups = match.groups()
             assert(len(groups) == 3)
-            message_id = groups[0]
-            transaction.set_field(message_id, 'message_id', message_id)
-            transaction.set_field(message_id, 'timestamp', groups[1])
-            transaction.set_field(message_id, 'type', groups[2]) 
+            self.set_message_info(transaction, groups)
         return groups
-        
+
+    def set_message_info(self, transaction, groups):
+        ''' Sets message ID, timestamp and type from timestamp groups '''
+        message_id = groups[0]
+        message = transaction.get_message(message_id)
+        message.set_value(tac.MESSAGE_ID_INDEX, message_id)
+        message.set_value(tac.TIMESTAMP_INDEX, groups[1])
+        message.set_value(tac.TYPE_INDEX, groups[2])
 
     def empty_line(self):
-        ''' All timestamps collected. Capture individual messages'''
+        ''' All timestamps collected. Capture individual messages. If no 
+            trigger matched, the transaction is skipped up to the next start
+        '''
+        transaction_filter = self.context.transaction_filter
+        if self.context.current_transaction is not None and \
+                transaction_filter is not None and \
+                not transaction_filter.check_times(
+                    self.context.current_transaction):
+            self.context.current_transaction = None
+        if self.context.current_transaction is None:
+            if self.context.instrumentation:
+                self.context.instrumentation.transaction_discarded()
+            self.context.set_state(self.context.state_search_for_start)
+            return
         self.context.state_start_message.initialize_state()
         self.context.set_state(self.context.state_start_message)
     
@@ -446,15 +2088,17 @@ class TransactionTraceStartMessage(TransactionTraceState):
         self.context.empty_lines = 0
     
     def process_line(self, input_line):
-        transaction = self.context.current_transaction
-        trigger = transaction.get_trigger()
-        match = re.match(trigger.msg_trigger, input_line)
+        trigger = self.context.current_trigger
+        match = trigger.msg_trigger.match(input_line)
         if match:
             self.context.current_message_id = match.group(1)
             self.context.set_state(self.context.state_collect_section)
             return
         self.initialize_state()
 
+    def unmatched_line(self):
+        self.initialize_state()
+
     def empty_line(self):
         ''' All timestamps collected. Capture individual messages'''
         if self.context.empty_lines:
@@ -475,7 +2119,7 @@ class TransactionTraceCollectSection(TransactionTraceState):
     
     def process_line(self, input_line):
         transaction = self.context.current_transaction
-        trigger = transaction.get_trigger()
+        trigger = self.context.current_trigger
         message_id = self.context.current_message_id     
         # Checks first for beginning of section
         if self.check_section_triggers(input_line, transaction, trigger, message_id):
@@ -485,37 +2129,30 @@ class TransactionTraceCollectSection(TransactionTraceState):
         return True
     
     def check_section_triggers(self, input_line, transaction, trigger, message_id):
-        for sect_trigger in trigger.section_triggers:
-            match = re.search(sect_trigger.section_trigger, input_line)
-            if match:
-                self.context.current_section_trigger = sect_trigger
-                return True
+        sect_trigger = trigger.search_section_trigger(input_line)
+        if sect_trigger:
+            self.context.current_section_trigger = sect_trigger
+            return True
     
     def check_section_parms(self, input_line, transaction, trigger, message_id):
         current_section_trigger = self.context.current_section_trigger
         if current_section_trigger:
-            for parameter in current_section_trigger.parameters:
-                match = re.search(parameter, input_line)
-                if match:
-                    _, value = self.get_key_value(input_line)
-                    formatted_name = self.format_section_parm_name(parameter)
-                    transaction.set_field(message_id,
-                                          formatted_name,
-                                          value)
+            key, value = self.get_key_value(input_line)
+            indexes = current_section_trigger.search_parameter_indexes(
+                input_line, key if key is not None else '')
+            if indexes:
+                message = transaction.get_message(message_id)
+                for index in indexes:
+                    message.set_value(index, value)
     
     def format_section_parm_name(self, parameter):
         current_section_trigger = self.context.current_section_trigger
-        section_parm_name = current_section_trigger.section_trigger.strip()
-        section_parm_name += ' - '
-        section_parm_name += parameter.replace('=', '')
-        section_parm_name = section_parm_name.replace('\\n', '')
-        section_parm_name = section_parm_name.replace('\\r', '')
-        return section_parm_name.strip()
+        return current_section_trigger.format_parameter_name(parameter)
         
     def get_key_value(self, input_line, sep='='):
         ''' Helper function to extract key : value pairs '''
         key, value = None, None
-        input_line = input_line.split(sep)
+        input_line = input_line.split(sep, 2)
         if len(input_line) >= 2:
             key, value = [x.strip() for x in input_line][:2]
         return key, value        
@@ -526,3 +2163,203 @@ class TransactionTraceCollectSection(TransactionTraceState):
     
     def initialize_state(self):
         self.context.empty_lines = 0
+
+
+
+def get_parameter_name(section_trigger, parameter):
+    ''' Returns the column name of a parameter of section_trigger '''
+    section_parm_name = section_trigger.strip()
+    section_parm_name += ' - '
+    section_parm_name += parameter.replace('=', '')
+    section_parm_name = section_parm_name.replace('\\n', '')
+    section_parm_name = section_parm_name.replace('\\r', '')
+    return section_parm_name.strip()
+
+
+def get_dtype(value):
+    ''' Converts a config dtype name, e.g. 'category', 'Int64' (nullable
+        integer) or 'string[pyarrow]', to a pandas dtype
+    '''
+    try:
+        return pd.api.types.pandas_dtype(value)
+    except ImportError:
+        if value != tac.PD_PYARROW_STRING_TYPE:
+            raise
+        logger.warning('pyarrow not available. Reading %s as %s', value,
+                       tac.PD_STRING_TYPE)
+        return pd.api.types.pandas_dtype(tac.PD_STRING_TYPE)
+    except TypeError:
+        raise(ValueError(f"Incorrect field type: {value}"))
+
+
+def iter_text_trace_lines(trace_filename, encoding=None, errors=None,
+                          compression=None, lines_read=None):
+    ''' Yields the lines of the trace file read in text mode, decompressing
+        it if compression is given. If given, lines_read(1, num_bytes) is
+        called for each line, with its encoded length before line endings
+        are translated
+    '''
+    newline = None if lines_read is None else ''
+    if compression:
+        f = open_trace_file(trace_filename, compression, encoding, errors,
+                            newline)
+    else:
+        f = open(trace_filename, 'r', encoding=encoding, errors=errors,
+                 newline=newline)
+    with f:
+        if lines_read is None:
+            yield from f
+            return
+        encoding = f.encoding
+        errors = errors or 'strict'
+        for input_line in f:
+            lines_read(1, len(input_line.encode(encoding, errors)))
+            # Translated as in the default newline mode
+            if input_line.endswith('\r\n'):
+                input_line = input_line[:-2] + '\n'
+            elif input_line.endswith('\r'):
+                input_line = input_line[:-1] + '\n'
+            yield input_line
+
+
+def iter_trace_lines(trace_filename, start=0, end=None, encoding=None,
+                     errors=None, lines_read=None):
+    ''' Yields the lines of the trace file found between byte offsets start
+        and end, decoded and with '\r\n' line endings translated to '\n'.
+        If given, lines_read(1, num_bytes) is called for each line
+    '''
+    encoding = encoding or locale.getpreferredencoding(False)
+    errors = errors or 'strict'
+    with open(trace_filename, 'rb') as f:
+        f.seek(start)
+        position = start
+        for raw_line in f:
+            if end is not None and position >= end:
+                break
+            position += len(raw_line)
+            if lines_read is not None:
+                lines_read(1, len(raw_line))
+            yield raw_line.decode(encoding, errors).replace('\r\n', '\n')
+
+
+def iter_trace_line_offsets(trace_filename, start=0, end=None, encoding=None,
+                            errors=None, lines_read=None):
+    ''' Same as iter_trace_lines, yielding (byte offset, line) '''
+    encoding = encoding or locale.getpreferredencoding(False)
+    errors = errors or 'strict'
+    with open(trace_filename, 'rb') as f:
+        f.seek(start)
+        position = start
+        for raw_line in f:
+            if end is not None and position >= end:
+                break
+            input_line = raw_line.decode(encoding, errors)
+            if lines_read is not None:
+                lines_read(1, len(raw_line))
+            yield position, input_line.replace('\r\n', '\n')
+            position += len(raw_line)
+
+
+def iter_mapped_trace_lines(trace_filename, literals, start=0, end=None,
+                            encoding=None, errors=None, start_literals=None,
+                            skipping=None, lines_read=None):
+    ''' Memory mapped version of iter_trace_lines. Lines are scanned as 
+        bytes and only empty lines and lines containing one of the literals 
+        are decoded. Each run of other lines is yielded as a single None.
+        If literals is None every line is decoded.
+        While skipping() is True, only transaction start lines matter, so the
+        trace is searched for the next line containing one of start_literals
+        and the lines before it are yielded as a single None.
+        If given, lines_read(num_lines, num_bytes, skipped) is called for
+        the lines yielded and for those skipped
+    '''
+    encoding = encoding or locale.getpreferredencoding(False)
+    errors = errors or 'strict'
+    if '\n'.encode(encoding) != b'\n':
+        raise(ValueError(f"Encoding not supported with mmap: {encoding}"))
+    relevant = None
+    if literals is not None:
+        # Line endings are only translated after decoding
+        literals = [literal.rstrip('\r\n') for literal in literals]
+        try:
+            if all(literals):
+                relevant = re.compile(b'|'.join(
+                    re.escape(literal.encode(encoding)) for literal in literals))
+        except UnicodeEncodeError:
+            relevant = None
+    start_search = None
+    if start_literals is not None and skipping is not None:
+        start_literals = [literal.rstrip('\r\n') for literal in start_literals]
+        try:
+            if all(start_literals):
+                start_search = re.compile(b'|'.join(
+                    re.escape(literal.encode(encoding)) 
+                    for literal in start_literals)).search
+        except UnicodeEncodeError:
+            start_search = None
+    with open(trace_filename, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        end = file_size if end is None else min(end, file_size)
+        if start >= end:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            find = mm.find
+            search = relevant.search if relevant is not None else None
+            position = start
+            skipped = False
+            while position < end:
+                if start_search is not None and skipping():
+                    match = start_search(mm, position, end)
+                    if match is None:
+                        next_start = end
+                    else:
+                        next_start = mm.rfind(b'\n', position, 
+                                              match.start()) + 1 or position
+                    if next_start > position:
+                        if lines_read is not None:
+                            # The last line of the trace may have no end
+                            num_lines = mm[position:next_start].count(b'\n') + \
+                                (mm[next_start - 1] != ord('\n'))
+                            lines_read(num_lines, next_start - position, True)
+                        if not skipped:
+                            skipped = True
+                            yield None
+                        position = next_start
+                        continue
+                line_end = find(b'\n', position, end) + 1 or end
+                if search is None or search(mm, position, line_end) or (
+                        line_end - position <= 2 and 
+                        mm[position:line_end] in (b'\n', b'\r\n')):
+                    skipped = False
+                    if lines_read is not None:
+                        lines_read(1, line_end - position)
+                    yield mm[position:line_end].decode(
+                        encoding, errors).replace('\r\n', '\n')
+                else:
+                    if lines_read is not None:
+                        lines_read(1, line_end - position, True)
+                    if not skipped:
+                        skipped = True
+                        yield None
+                position = line_end
+
+
+def read_trace_range(trace_reader, trace_filename, start, end,
+                     read_options=None):
+    ''' Process pool worker of TraceReaderPlain.read_trace_file_parallel.
+        Returns the DataFrame of the transactions found between byte offsets
+        start and end, with TIDs local to the range, the number of
+        transactions started in it and the worker instrumentation, if any
+    '''
+    transaction_context = trace_reader.get_trace_context(**(read_options or {}))
+    for input_line in trace_reader.get_trace_lines(trace_filename, start, end,
+                                                   transaction_context):
+        if input_line is None:
+            transaction_context.process_unmatched_line()
+        else:
+            transaction_context.process_line(input_line)
+    transaction_context.process_line('')
+    # Converted once merged, so categories are common to all ranges
+    return (transaction_context.get_result(convert=False),
+            transaction_context.current_transaction_index,
+            trace_reader.instrumentation)
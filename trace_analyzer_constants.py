@@ -5,6 +5,96 @@ Created on Wed Oct 13 23:38:58 2021
 @author: orubio
 """
 PD_DATETIME_TYPE = 'datetime64'
+PD_PYARROW_STRING_TYPE = 'string[pyarrow]'
+PD_STRING_TYPE = 'string'
+# Nullable integer types used for integer columns with missing values
+PD_NULLABLE_INTEGER_TYPES = {'int8': 'Int8', 'int16': 'Int16', 'int32': 'Int32',
+                             'int64': 'Int64', 'uint8': 'UInt8',
+                             'uint16': 'UInt16', 'uint32': 'UInt32',
+                             'uint64': 'UInt64'}
+# First number in a plain trace value, e.g. 64000 in "64000 kbps"
+NUMBER_PATTERN = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+
+# Default number of rows per chunk when iterating over a CSV trace
+CSV_CHUNK_ROWS = 100000
+
+# Default number of transactions per chunk when iterating over a trace
+TRACE_CHUNK_TRANSACTIONS = 10000
+
+# Parallel trace reading: byte ranges per worker and minimum range size
+TRACE_RANGES_PER_WORKER = 4
+TRACE_MIN_RANGE_SIZE = 1 << 20
+
+# Block size used to find the last complete line of a followed trace
+TRACE_FOLLOW_BLOCK_SIZE = 1 << 16
+
+# Compressed traces (see trace_compression.py). Compression by file extension
+# and by first bytes of the file
+TRACE_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz',
+                                '.zst': 'zstd'}
+TRACE_COMPRESSION_MAGIC = {b'\x1f\x8b': 'gzip', b'BZh': 'bz2',
+                           b'\xfd7zXZ\x00': 'xz', b'\x28\xb5\x2f\xfd': 'zstd'}
+TRACE_COMPRESSION_MAGIC_SIZE = 6
+# Decompressed block size and blocks decompressed ahead of the parser
+TRACE_DECOMPRESS_BLOCK_SIZE = 1 << 20
+TRACE_DECOMPRESS_QUEUE_SIZE = 8
+
+# Pipelined trace writes (see trace_pipeline.py). Blocks read ahead of the
+# parser, of about TRACE_PIPELINE_BLOCK_SIZE bytes, and chunks waiting to be
+# written
+TRACE_PIPELINE_BLOCK_SIZE = 1 << 20
+TRACE_PIPELINE_QUEUE_SIZE = 8
+TRACE_PIPELINE_WRITE_QUEUE_SIZE = 2
+
+# Latency analytics (see trace_analytics.TraceAnalytics). Message type
+# suffixes of requests and responses, and latency percentiles reported
+ANALYTICS_REQUEST_SUFFIX = 'Request'
+ANALYTICS_RESPONSE_SUFFIX = 'Response'
+ANALYTICS_PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Correlation of plain and CSV traces (see trace_correlation.py). Columns
+# of each join key in each source, as in TraceReaderPlain - config file.txt
+# and TraceReaderCSV - Test fields.txt
+CORRELATION_PLAIN_KEYS = {
+    'imsi': ('GTP v.1 - IMSI', 'GTP v.2 - IMSI'),
+    'ip_pair': ('IP - Source IP address', 'IP - Destination IP address'),
+    'time': ('timestamp',),
+}
+CORRELATION_CSV_KEYS = {
+    'imsi': ('GTP IMSI', 'Any Protocol IMSI'),
+    'ip_pair': ('IP Source Address', 'IP Dest Address'),
+    'time': ('Date', 'Start Time'),
+}
+CORRELATION_IMSI_PATTERN = r'(\d{6,15})'
+# Added to CSV columns named as plain ones in correlated results
+CORRELATION_CSV_SUFFIX = ' (CSV)'
+
+# Parsed trace cache (see trace_cache.TraceCache)
+TRACE_CACHE_VERSION = '1'
+TRACE_CACHE_DIR = '.trace_cache'
+TRACE_CACHE_MAX_SIZE = 10 << 30
+TRACE_CACHE_SAMPLE_SIZE = 1 << 20
+
+# Transaction index sidecar files (see trace_index.TraceIndex)
+TRACE_INDEX_VERSION = '1'
+TRACE_INDEX_EXTENSION = '.idx'
+
+# Compiled TraceReaderPlain configs (see trace_config.CompiledConfig)
+CONFIG_COMPILED_VERSION = '2'
+CONFIG_COMPILED_EXTENSION = '.compiled'
+CONFIG_ERROR = 'error'
+CONFIG_WARNING = 'warning'
+
+# Excel output (see trace_sink.ExcelSink). Rows per sheet, header included
+EXCEL_MAX_ROWS = 1048576
+EXCEL_SHEET_NAME = 'Trace'
+
+# Column with the trace file name of each row in merged batch outputs
+# (see trace_runner.py)
+TRACE_SOURCE_COLUMN = 'Source file'
+
+# Minimum seconds between two progress reports of TraceInstrumentation
+TRACE_REPORT_INTERVAL = 10.0
 
 # TraceConfigContext constants
 TRANSACTION_NAME = "transaction_name"
@@ -14,3 +104,30 @@ MSG_TRIGGER = "msg_trigger"
 SECTION_TRIGGER = "section_trigger"
 SECTION_PARAM = "param"
 TRANSACTION_CONFIG_REMOVE_QUOTES = True
+
+# Fields of every message, in FieldIndex order
+MESSAGE_FIELDS = ('message_id', 'timestamp', 'type')
+MESSAGE_ID_INDEX, TIMESTAMP_INDEX, TYPE_INDEX = range(len(MESSAGE_FIELDS))
+# Hidden field set by parameters not in the projected columns of a read
+PARAMETER_FOUND_FIELD = '_parameter_found'
+
+# Trigger matcher constants
+REGEX_METACHARACTERS = '.^$*+?{}[]|()'
+REGEX_LITERAL_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
+REGEX_GROUP_PREFIX = 'trace_analyzer_pattern_'
+# Message types remembered by each TriggerDispatcher
+TRIGGER_DISPATCH_CACHE_SIZE = 4096
+
+# Message timestamp format of plain traces, e.g. Fri 08 Oct 2021 12:00:01.001
+TRACE_TIMESTAMP_FORMAT = '%a %d %b %Y %H:%M:%S.%f'
+
+# Synthetic trace generator (see trace_generator.py)
+GENERATOR_TRANSACTION_NAMES = {1: 'Create PDP Context', 2: 'Create Session'}
+GENERATOR_VALUES = {
+    'Traffic group': ('Roaming In', 'Roaming Out', 'Home'),
+    'Protocol': ('GTP', 'GTPv2', 'Diameter'),
+    'GTP Message': ('Create PDP Context Request', 'Create Session Request',
+                    'Delete PDP Context Request', 'Delete Session Request'),
+    'GTP Version': ('1', '2'),
+    'GTP Radio Access Technology': ('UTRAN', 'GERAN', 'EUTRAN'),
+}
@@ -6,7 +6,31 @@ Created on Tue Oct 12 12:07:24 2021
 """
 
 from trace_analyzer import TraceReaderCSV, TraceReaderPlain, Transaction
+from trace_analyzer import TransactionAccumulator, CompiledPattern, PatternSet
+from trace_analyzer import TransactionTrigger, TransactionMatcher, SectionTrigger
+from trace_analyzer import CompiledSectionTrigger
+from trace_analyzer import TraceInstrumentation, TraceFollower, FieldIndex
+from trace_analytics import TraceAnalytics
+from trace_benchmark import run_benchmark
+from trace_cache import TraceCache
+from trace_config import CompiledConfig, compile_config, validate_triggers
+from trace_config import get_backtracking_risks
+from trace_correlation import TraceCorrelator, CorrelationKeys
+from trace_index import TraceIndex, get_trace_index
+from trace_sink import CSVSink, ParquetSink, ExcelSink
+from trace_pipeline import BlockReader, iter_block_lines
+from trace_runner import get_trace_files, run_batch
+from trace_generator import CSVTraceGenerator, PlainTraceGenerator
+from concurrent.futures import ThreadPoolExecutor
+import bz2
+import gzip
+import importlib.util
+import os
+import pandas as pd
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
 TRACE_READER_CSV_CONFIG_FILE = 'TraceReaderCSV - Test fields.txt'
 TRACE_SAMPLE_CSV = 'TraceReaderCSV - Test CSV.csv'
@@ -24,10 +48,39 @@ TRACE_READER_PLAIN_CONFIG_TESTS = {
 }
 
 TRACE_READER_PLAIN_CONFIG_FILE = 'TraceReaderPlain - test config file.txt'
+TRACE_READER_PLAIN_SAMPLE_CONFIG_FILE = 'TraceReaderPlain - config file.txt'
+TRACE_READER_PLAIN_TYPED_CONFIG_FILE = 'TraceReaderPlain - typed config file.txt'
 TRACE_SAMPLE_PLAIN = 'TraceReaderPlain - Test trace.txt'
 TRACE_SAMPLE_PLAIN_NUM_CALLS = 10
 TRACE_SAMPLE_PLAIN_NUM_MESSAGES = 45
 
+
+def write_plain_trace(trace_filename, num_calls):
+    ''' Writes a small trace matching TRACE_READER_PLAIN_CONFIG_FILE with two
+        messages per call, alternating GTP v.1 and GTP v.2 calls
+    '''
+    with open(trace_filename, 'w') as f:
+        for call in range(1, num_calls + 1):
+            version = 1 if call % 2 else 2
+            name = 'Create PDP Context' if version == 1 else 'Create Session'
+            f.write(f'Call #{call}\n')
+            for message, kind in ((1, 'Request'), (2, 'Response')):
+                f.write(f'Message #{message}\tMon 11 Oct 2021 '
+                        f'12:00:{call % 60:02d}.{message:03d}\t'
+                        f'{name} {kind}\tInfo\n')
+            f.write('\n')
+            for message in (1, 2):
+                f.write(f'Message #{message}\n')
+                f.write('IP\n')
+                f.write(f'   Source IP address = 10.0.0.{call % 250}\n')
+                f.write(f'   Destination IP address = 10.0.1.{message}\n')
+                f.write(f'GTP v.{version}\n')
+                f.write(f'   IMSI = 21401{call:010d}\n')
+                f.write('   Spare = 0\n')
+                f.write('\n')
+            f.write('\n\n')
+
+
 class TestTraceReaderCSV(unittest.TestCase):
     ''' TraceReaderCSV test cases '''
     def test_no_arg_constructor(self):
@@ -55,6 +108,68 @@ class TestTraceReaderCSV(unittest.TestCase):
         self.assertEqual(df_num_columns, fields_found)        
 
 
+class TestTraceReaderCSVTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config_filename = os.path.join(self.temp_dir.name, 'fields.txt')
+        with open(self.config_filename, 'w') as f:
+            f.write('Date\t datetime64\nProtocol\t category\n'
+                    '#Messages\t Int64\nGTP IMSI\t string\n')
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.csv')
+        with open(self.trace_filename, 'w') as f:
+            f.write('Date\tProtocol\t#Messages\tGTP IMSI\tUnused\n')
+            for row in range(10):
+                messages = row if row % 3 else ''
+                f.write(f'2021-10-{row + 1:02d}\tGTP\t{messages}\t'
+                        f'21401{row:010d}\tx\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_dtypes(self):
+        trace_reader = TraceReaderCSV(config_filename=self.config_filename,
+                                      trace_filename=self.trace_filename)
+        df = trace_reader.get_data()
+        self.assertTupleEqual(df.shape, (10, 4))
+        self.assertEqual(df['Protocol'].dtype, 'category')
+        self.assertEqual(df['#Messages'].dtype, 'Int64')
+        self.assertEqual(df['#Messages'].isna().sum(), 4)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['Date']))
+        with self.assertRaises(ValueError):
+            trace_reader.get_dtype('not a type')
+
+    def test_iter_trace_file(self):
+        trace_reader = TraceReaderCSV(config_filename=self.config_filename,
+                                      trace_filename=self.trace_filename)
+        chunks = list(trace_reader.iter_trace_file(self.trace_filename,
+                                                   chunksize=4))
+        self.assertListEqual([chunk.shape[0] for chunk in chunks], [4, 4, 2])
+        df = pd.concat(chunks, ignore_index=True)
+        pd.testing.assert_frame_equal(df, trace_reader.get_data())
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_pyarrow_engine(self):
+        trace_reader = TraceReaderCSV(config_filename=self.config_filename,
+                                      trace_filename=self.trace_filename)
+        df_expected = trace_reader.get_data()
+        trace_reader.read_trace_file(self.trace_filename, engine='pyarrow')
+        pd.testing.assert_frame_equal(trace_reader.get_data(), df_expected)
+
+    def test_compressed_trace(self):
+        trace_reader = TraceReaderCSV(config_filename=self.config_filename,
+                                      trace_filename=self.trace_filename)
+        df_expected = trace_reader.get_data()
+        # Compression found from the first bytes, not the extension
+        compressed_filename = os.path.join(self.temp_dir.name, 'trace.dat')
+        with open(self.trace_filename, 'rb') as f:
+            data = f.read()
+        with gzip.open(compressed_filename, 'wb') as f:
+            f.write(data)
+        trace_reader.read_trace_file(compressed_filename)
+        pd.testing.assert_frame_equal(trace_reader.get_data(), df_expected)
+
+
 class TestTraceReaderPlain(unittest.TestCase) :
     
     def setUp(self):
@@ -95,6 +210,880 @@ class TestTraceReaderPlain(unittest.TestCase) :
         print(f'Calls found: {df_result}')
         self.assertEqual(df_result.shape[0], TRACE_SAMPLE_PLAIN_NUM_MESSAGES)        
 
+
+class TestTraceReaderPlainSample(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(self.trace_filename, 10)
+        self.trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_trace_file(self):
+        num_messages = self.trace_reader.read_trace_file(self.trace_filename)
+        df_result = self.trace_reader.get_data()
+        self.assertEqual(num_messages, 20)
+        self.assertListEqual(list(df_result['TID'].unique()), 
+                             list(range(1, 11)))
+
+    def test_iter_trace_file(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        chunks = list(self.trace_reader.iter_trace_file(self.trace_filename,
+                                                        chunk_transactions=3))
+        self.assertListEqual([chunk.shape[0] for chunk in chunks],
+                             [6, 6, 6, 2])
+        df_result = pd.concat(chunks, ignore_index=True)
+        pd.testing.assert_frame_equal(df_result.fillna(''),
+                                      df_expected.fillna(''),
+                                      check_dtype=False)
+
+
+    def test_column_order(self):
+        # New columns follow the order of the fields in the trace, not in
+        # the config
+        with open(self.trace_filename, 'w') as f:
+            f.write('Call #1\n'
+                    'Message #1\tMon 11 Oct 2021 12:00:01.001\t'
+                    'Create PDP Context Request\tInfo\n\n'
+                    'Message #1\nIP\n'
+                    '   Destination IP address = 10.0.1.1\n'
+                    '   Source IP address = 10.0.0.1\n'
+                    'GTP v.1\n'
+                    '   Address signals = 123\n'
+                    '   IMSI = 214010000000001\n\n\n\n')
+        self.trace_reader.read_trace_file(self.trace_filename)
+        self.assertListEqual(list(self.trace_reader.get_data().columns),
+                             ['TID', 'message_id', 'timestamp', 'type',
+                              'IP - Destination IP address',
+                              'IP - Source IP address',
+                              'GTP v.1 - Address signals', 'GTP v.1 - IMSI'])
+
+    @mock.patch('trace_analyzer_constants.TRACE_MIN_RANGE_SIZE', 100)
+    def test_read_trace_file_parallel(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        offsets = self.trace_reader.find_split_offsets(self.trace_filename, 4)
+        self.assertEqual(len(offsets), 4)
+        with open(self.trace_filename, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                self.assertTrue(f.readline().startswith(b'Call #'))
+        num_messages = self.trace_reader.read_trace_file(self.trace_filename,
+                                                         workers=2)
+        self.assertEqual(num_messages, 20)
+        pd.testing.assert_frame_equal(self.trace_reader.get_data(),
+                                      df_expected)
+
+
+    def test_read_trace_file_mmap(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        # Latin-1 export with Windows line endings
+        with open(self.trace_filename, 'r') as f:
+            trace = f.read().replace('Spare', 'Se\xf1al')
+        latin1_filename = os.path.join(self.temp_dir.name, 'latin1.txt')
+        with open(latin1_filename, 'w', encoding='latin-1', newline='\r\n') as f:
+            f.write(trace)
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+            encoding='latin-1', use_mmap=True)
+        lines = list(trace_reader.get_trace_lines(latin1_filename))
+        self.assertIn(None, lines)
+        self.assertNotIn('   Se\xf1al = 0\n', lines)
+        trace_reader.read_trace_file(latin1_filename)
+        pd.testing.assert_frame_equal(trace_reader.get_data(), df_expected)
+
+    def test_read_compressed_trace_file(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        with open(self.trace_filename, 'rb') as f:
+            data = f.read()
+        # Two gzip members and a bz2 file without extension
+        gzip_filename = os.path.join(self.temp_dir.name, 'trace.txt.gz')
+        with open(gzip_filename, 'wb') as f:
+            middle = data.index(b'Call #6')
+            f.write(gzip.compress(data[:middle]))
+            f.write(gzip.compress(data[middle:]))
+        bz2_filename = os.path.join(self.temp_dir.name, 'trace')
+        with open(bz2_filename, 'wb') as f:
+            f.write(bz2.compress(data))
+        for compressed_filename in (gzip_filename, bz2_filename):
+            self.trace_reader.read_trace_file(compressed_filename)
+            pd.testing.assert_frame_equal(self.trace_reader.get_data(),
+                                          df_expected)
+        chunks = list(self.trace_reader.iter_trace_file(gzip_filename, 3))
+        self.assertEqual(sum(chunk.shape[0] for chunk in chunks), 20)
+        with self.assertRaises(ValueError):
+            self.trace_reader.follow_trace_file(gzip_filename)
+
+
+    def test_instrumentation(self):
+        reports = []
+        instrumentation = TraceInstrumentation(callback=reports.append,
+                                               report_interval=0)
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+            instrumentation=instrumentation)
+        trace_reader.read_trace_file(self.trace_filename)
+        metrics = instrumentation.get_metrics()
+        self.assertTrue(reports)
+        self.assertEqual(metrics['transactions_found'], 10)
+        self.assertEqual(metrics['transactions_emitted'], 10)
+        self.assertEqual(metrics['transactions_discarded'], 0)
+        self.assertEqual(metrics['bytes'],
+                         os.path.getsize(self.trace_filename))
+        self.assertIn('TransactionTraceCollectSection',
+                      metrics['state_times'])
+
+    def test_instrumentation_bytes(self):
+        # Non ASCII lines, CRLF line endings and lines skipped by the mmap
+        # scanner are counted as stored
+        with open(self.trace_filename, 'a', encoding='utf-8',
+                  newline='\r\n') as f:
+            f.write('Señal = ü\nÚltima línea\n')
+        with open(self.trace_filename, 'rb') as f:
+            num_lines = len(f.readlines())
+        for options in ({}, {'use_mmap': True}, {'prefetch': True}):
+            instrumentation = TraceInstrumentation(callback=lambda _: None)
+            trace_reader = TraceReaderPlain(
+                config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+                encoding='utf-8', instrumentation=instrumentation,
+                use_mmap=options.get('use_mmap', False))
+            if options.get('prefetch'):
+                list(trace_reader.iter_trace_file(self.trace_filename,
+                                                  prefetch=True))
+            else:
+                trace_reader.read_trace_file(self.trace_filename,
+                                             use_cache=False)
+            metrics = instrumentation.get_metrics()
+            self.assertEqual(metrics['bytes'],
+                             os.path.getsize(self.trace_filename), options)
+            self.assertEqual(metrics['lines'], num_lines, options)
+            if options.get('use_mmap'):
+                self.assertGreater(metrics['unmatched_lines'], 0)
+
+    def test_profile(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        instrumentation = TraceInstrumentation(callback=lambda _: None,
+                                               profile=True)
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+            instrumentation=instrumentation)
+        trace_reader.read_trace_file(self.trace_filename)
+        pd.testing.assert_frame_equal(trace_reader.get_data(), df_expected)
+        patterns, states = instrumentation.get_profile_report()
+        self.assertTrue(patterns['seconds'].is_monotonic_decreasing)
+        start = patterns[patterns['kind'] == 'start']
+        self.assertEqual(start['matches'].sum(), 10)
+        self.assertTrue((patterns['evaluations'] >= patterns['matches']).all())
+        self.assertIn('param', set(patterns['kind']))
+        # States also process the end of the trace
+        self.assertEqual(states['lines'].sum(),
+                         instrumentation.get_metrics()['lines'] + 1)
+        # The shared matcher is not profiled
+        self.assertEqual(trace_reader.get_matcher().may_start.__name__,
+                         'may_start')
+
+    def test_columns_and_filters(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_full = self.trace_reader.get_data()
+        columns = ['timestamp', 'GTP v.1 - IMSI']
+        self.trace_reader.read_trace_file(self.trace_filename, columns=columns)
+        df = self.trace_reader.get_data()
+        self.assertListEqual(list(df.columns), ['TID'] + columns)
+        pd.testing.assert_frame_equal(df, df_full[['TID'] + columns])
+        imsis = ['214010000000003', '214010000000007']
+        self.trace_reader.read_trace_file(
+            self.trace_filename, filters={'GTP v.1 - IMSI': imsis,
+                                          'IP - Destination IP address':
+                                              '10.0.1.1'})
+        self.assertListEqual(list(self.trace_reader.get_data()['TID']),
+                             [3, 3, 7, 7])
+        self.trace_reader.read_trace_file(
+            self.trace_filename, time_range=('2021-10-11 12:00:02',
+                                             '2021-10-11 12:00:05'))
+        self.assertListEqual(list(self.trace_reader.get_data()['TID']),
+                             [2, 2, 3, 3, 4, 4])
+        with self.assertRaises(ValueError):
+            self.trace_reader.read_trace_file(self.trace_filename,
+                                              columns=['IMSI'])
+
+    def test_columns_regex_parameters(self):
+        # Calls 2 and 4 only have a regex param, not in the projection
+        with open(self.trace_filename, 'w') as f:
+            for call in range(1, 5):
+                f.write(f'Call #{call}\nMessage #1\tMon 11 Oct 2021 '
+                        f'12:00:0{call}.001\tCreate PDP Context Request\t'
+                        f'Info\n\nMessage #1\nGTP v.1\n')
+                if call % 2:
+                    f.write(f'   IMSI = 21401{call:010d}\n')
+                else:
+                    f.write('   Charging Tag = 1\n')
+                f.write('\n\n\n')
+        for use_mmap in (False, True):
+            trace_reader = TraceReaderPlain(
+                config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+                use_mmap=use_mmap)
+            trace_reader.read_trace_file(self.trace_filename, use_cache=False)
+            df_full = trace_reader.get_data()
+            trace_reader.read_trace_file(self.trace_filename, use_cache=False,
+                                         columns=['GTP v.1 - IMSI'])
+            df = trace_reader.get_data()
+            self.assertListEqual(list(df_full['TID']), [1, 2, 3, 4])
+            self.assertEqual(df.shape[0], df_full.shape[0])
+            self.assertListEqual(list(df.columns), ['TID', 'GTP v.1 - IMSI'])
+
+    def test_parameter_key_spacing(self):
+        # "key =" params match lines with the same key, the text before "=",
+        # whatever the spacing around it
+        with open(self.trace_filename, 'w') as f:
+            for call, line in enumerate(('   Rat Type Value = 1\n',
+                                         '   Rat Type Value=2\n',
+                                         '      Rat Type Value   =  3\n',
+                                         '   Old Rat Type Value = 4\n'), 1):
+                f.write(f'Call #{call}\nMessage #1\tMon 11 Oct 2021 '
+                        f'12:00:0{call}.001\tCreate PDP Context Request\t'
+                        f'Info\n\nMessage #1\nGTP v.1\n{line}\n\n\n')
+        for use_mmap in (False, True):
+            trace_reader = TraceReaderPlain(
+                config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+                use_mmap=use_mmap)
+            trace_reader.read_trace_file(self.trace_filename, use_cache=False)
+            df = trace_reader.get_data()
+            # Call 4 has another key and no params found
+            self.assertListEqual(list(df['TID']), [1, 2, 3])
+            self.assertListEqual(df['GTP v.1 - Rat Type Value'].tolist(),
+                                 ['1', '2', '3'])
+
+    def test_skip_transactions(self):
+        # Calls 1, 4, 7 and 10 are of a type not in the config
+        skipped_filename = os.path.join(self.temp_dir.name, 'skipped.txt')
+        with open(self.trace_filename) as f:
+            calls = f.read().split('Call #')[1:]
+        with open(skipped_filename, 'w') as f:
+            for index, call in enumerate(calls):
+                if index % 3 == 0:
+                    call = call.replace('Create', 'Delete')
+                f.write('Call #' + call)
+        for use_mmap in (False, True):
+            instrumentation = TraceInstrumentation(report_interval=0,
+                                                   callback=lambda _: None)
+            trace_reader = TraceReaderPlain(
+                config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
+                use_mmap=use_mmap, instrumentation=instrumentation)
+            trace_reader.read_trace_file(skipped_filename)
+            df = trace_reader.get_data()
+            self.assertListEqual(sorted(df['TID'].unique()), 
+                                 [2, 3, 5, 6, 8, 9])
+            metrics = instrumentation.get_metrics()
+            self.assertEqual(metrics['transactions_discarded'], 4)
+
+
+    def test_follow_trace_file(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df_expected = self.trace_reader.get_data()
+        with open(self.trace_filename, 'rb') as f:
+            trace = f.read()
+        growing_filename = os.path.join(self.temp_dir.name, 'growing.txt')
+        chunks = []
+        # Cuts in the middle of a transaction and of a line
+        for cut in (0, len(trace) // 3, len(trace) // 2 + 5, len(trace)):
+            with open(growing_filename, 'wb') as f:
+                f.write(trace[:cut])
+            self.trace_reader.follow_trace_file(growing_filename)
+            chunks.append(self.trace_reader.get_data())
+            if cut == len(trace) // 3:
+                # Resumes from saved state
+                state_filename = os.path.join(self.temp_dir.name, 'state')
+                self.trace_reader.followers[growing_filename].save(
+                    state_filename)
+                self.trace_reader.followers[growing_filename] = \
+                    TraceFollower.load(self.trace_reader, state_filename)
+        self.assertTrue(chunks[0].empty)
+        self.assertTrue(chunks[1].shape[0] > 0)
+        df_result = pd.concat([chunk for chunk in chunks if not chunk.empty],
+                              ignore_index=True)
+        pd.testing.assert_frame_equal(df_result.fillna(''),
+                                      df_expected.fillna(''),
+                                      check_dtype=False)
+
+
+class TestTraceSink(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(self.trace_filename, 10)
+        self.trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+        self.trace_reader.read_trace_file(self.trace_filename, use_cache=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_expected(self):
+        return self.trace_reader.get_data().reindex(
+            columns=self.trace_reader.get_columns())
+
+    def test_csv_sink(self):
+        output_filename = os.path.join(self.temp_dir.name, 'out.csv')
+        sink = CSVSink(output_filename, self.trace_reader.get_columns())
+        rows = self.trace_reader.write_trace_file(self.trace_filename, sink,
+                                                  chunk_transactions=3)
+        self.assertEqual(rows, 20)
+        df = pd.read_csv(output_filename, dtype=str, keep_default_na=False)
+        df_expected = self.get_expected().fillna('').astype(str)
+        pd.testing.assert_frame_equal(df, df_expected)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_parquet_sink(self):
+        output_filename = os.path.join(self.temp_dir.name, 'out.parquet')
+        sink = ParquetSink(output_filename, self.trace_reader.get_columns())
+        self.trace_reader.write_trace_file(self.trace_filename, sink,
+                                           chunk_transactions=3)
+        import pyarrow.parquet
+        self.assertEqual(
+            pyarrow.parquet.ParquetFile(output_filename).num_row_groups, 4)
+        pd.testing.assert_frame_equal(pd.read_parquet(output_filename),
+                                      self.get_expected(), check_dtype=False)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_parquet_sink_column_types(self):
+        # Each chunk has one transaction, so GTP v.2 columns are missing from
+        # the first one and GTP v.1 columns from the second one
+        import pyarrow
+        import pyarrow.parquet
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_TYPED_CONFIG_FILE)
+        for column_types in (None, trace_reader.get_column_types()):
+            output_filename = os.path.join(self.temp_dir.name, 'out.parquet')
+            sink = ParquetSink(output_filename, trace_reader.get_columns(),
+                               column_types)
+            trace_reader.write_trace_file(self.trace_filename, sink,
+                                          chunk_transactions=1)
+            schema = pyarrow.parquet.read_schema(output_filename)
+            for column in ('GTP v.1 - IMSI', 'GTP v.2 - IMSI',
+                           'GTP v.2 - Address signals'):
+                self.assertEqual(schema.field(column).type, pyarrow.string())
+            df = pd.read_parquet(output_filename)
+            self.assertEqual(df['GTP v.2 - IMSI'].dropna().iloc[0],
+                             '214010000000002')
+        self.assertEqual(schema.field('timestamp').type,
+                         pyarrow.timestamp('ns'))
+        self.assertEqual(schema.field('GTP v.2 - APN-AMBR for uplink').type,
+                         pyarrow.int64())
+
+    @unittest.skipUnless(importlib.util.find_spec('openpyxl'),
+                         'requires openpyxl')
+    def test_excel_sink(self):
+        output_filename = os.path.join(self.temp_dir.name, 'out.xlsx')
+        sink = ExcelSink(output_filename, self.trace_reader.get_columns(),
+                         max_rows=9)
+        self.trace_reader.write_trace_file(self.trace_filename, sink)
+        sheets = pd.read_excel(output_filename, sheet_name=None)
+        self.assertEqual([df.shape[0] for df in sheets.values()], [8, 8, 4])
+
+
+class TestTracePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(self.trace_filename, 10)
+        self.trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_block_reader(self):
+        blocks = list(BlockReader(self.trace_filename, block_size=100))
+        self.assertTrue(all(block.endswith(b'\n') for block in blocks))
+        with open(self.trace_filename, 'rb') as f:
+            self.assertEqual(b''.join(blocks), f.read())
+        with open(self.trace_filename) as f:
+            self.assertListEqual(list(iter_block_lines(blocks, 'utf-8',
+                                                       'strict')),
+                                 f.readlines())
+
+    def test_write_trace_file(self):
+        outputs = []
+        for pipelined in (False, True):
+            output_filename = os.path.join(self.temp_dir.name,
+                                           f'{pipelined}.csv')
+            rows = self.trace_reader.write_trace_file(
+                self.trace_filename, CSVSink(output_filename),
+                pipelined=pipelined, chunk_transactions=3)
+            self.assertEqual(rows, 20)
+            outputs.append(pd.read_csv(output_filename))
+        pd.testing.assert_frame_equal(outputs[0], outputs[1])
+        sink = CSVSink(os.path.join(self.temp_dir.name, 'error.csv'))
+        with mock.patch.object(sink, 'write_chunk', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.trace_reader.write_trace_file(self.trace_filename, sink,
+                                                   chunk_transactions=3)
+
+
+class TestTraceRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_dir = os.path.join(self.temp_dir.name, 'traces')
+        os.makedirs(self.trace_dir)
+        for index in range(3):
+            write_plain_trace(
+                os.path.join(self.trace_dir, f'probe{index}.txt'), index + 1)
+        # The compiled config is written next to it
+        self.config_filename = shutil.copy(TRACE_READER_PLAIN_CONFIG_FILE,
+                                           self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_trace_files(self):
+        self.assertEqual(len(get_trace_files([self.trace_dir])), 3)
+        pattern = os.path.join(self.trace_dir, 'probe[01].txt')
+        self.assertEqual(len(get_trace_files([pattern, self.trace_dir],
+                                             'probe0*')), 2)
+        with self.assertRaises(ValueError):
+            get_trace_files([os.path.join(self.trace_dir, 'missing.txt')])
+
+    def test_run_batch(self):
+        trace_filenames = get_trace_files([self.trace_dir])
+        output_dir = os.path.join(self.temp_dir.name, 'out')
+        rows = run_batch(trace_filenames, 'plain', self.config_filename,
+                         output_dir=output_dir, output_format='csv', workers=2)
+        self.assertEqual(rows, 12)
+        self.assertEqual(len(os.listdir(output_dir)), 3)
+        merged_filename = os.path.join(self.temp_dir.name, 'merged.csv')
+        run_batch(trace_filenames, 'plain', self.config_filename,
+                  merged_filename=merged_filename, workers=2)
+        df = pd.read_csv(merged_filename)
+        self.assertEqual(df['Source file'].value_counts().to_dict(),
+                         {'probe0.txt': 2, 'probe1.txt': 4, 'probe2.txt': 6})
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_run_batch_parquet(self):
+        # A GTP v.1 only trace and a GTP v.2 only trace: each file has
+        # values in different columns
+        import pyarrow
+        import pyarrow.parquet
+        config_filename = shutil.copy(TRACE_READER_PLAIN_TYPED_CONFIG_FILE,
+                                      self.temp_dir.name)
+        trace_dir = os.path.join(self.temp_dir.name, 'gtp')
+        os.makedirs(trace_dir)
+        write_plain_trace(os.path.join(trace_dir, 'gtp1.txt'), 1)
+        gtp2_filename = os.path.join(trace_dir, 'gtp2.txt')
+        write_plain_trace(gtp2_filename, 2)
+        with open(gtp2_filename) as f:
+            trace = f.read()
+        with open(gtp2_filename, 'w') as f:
+            f.write(trace[trace.index('Call #2'):])
+        trace_filenames = get_trace_files([trace_dir])
+        output_dir = os.path.join(self.temp_dir.name, 'out')
+        rows = run_batch(trace_filenames, 'plain', config_filename,
+                         output_dir=output_dir, workers=2)
+        self.assertEqual(rows, 4)
+        schemas = [pyarrow.parquet.read_schema(
+            os.path.join(output_dir, f'gtp{version}.parquet'))
+            for version in (1, 2)]
+        self.assertTrue(schemas[0].equals(schemas[1]))
+        merged_filename = os.path.join(self.temp_dir.name, 'merged.parquet')
+        rows = run_batch(trace_filenames, 'plain', config_filename,
+                         merged_filename=merged_filename, workers=2)
+        self.assertEqual(rows, 4)
+        schema = pyarrow.parquet.read_schema(merged_filename)
+        self.assertEqual(schema.field('GTP v.2 - APN-AMBR for uplink').type,
+                         pyarrow.int64())
+        self.assertEqual(schema.field('timestamp').type,
+                         pyarrow.timestamp('ns'))
+        for column in ('GTP v.1 - IMSI', 'GTP v.2 - IMSI'):
+            self.assertEqual(schema.field(column).type, pyarrow.string())
+            self.assertEqual(schemas[0].field(column).type, pyarrow.string())
+        df = pd.read_parquet(merged_filename)
+        self.assertListEqual(df['GTP v.2 - IMSI'].dropna().tolist(),
+                             ['214010000000002'] * 2)
+
+    def test_run_batch_merged_in_flight(self):
+        # Merged results wait to be written in input order. Files are only
+        # submitted as earlier ones are written
+        trace_filenames = get_trace_files([self.trace_dir])
+        in_flight = []
+        progress = []
+        class Executor(ThreadPoolExecutor):
+            def submit(self, *args):
+                in_flight.append(len(in_flight) + 1 - len(progress))
+                return super().submit(*args)
+        def file_done(self, trace_filename, rows):
+            progress.append(trace_filename)
+        merged_filename = os.path.join(self.temp_dir.name, 'merged.csv')
+        with mock.patch('trace_runner.ProcessPoolExecutor', Executor), \
+                mock.patch('trace_runner.BatchProgress.file_done', file_done):
+            run_batch(trace_filenames, 'plain', self.config_filename,
+                      merged_filename=merged_filename, workers=1)
+        self.assertListEqual(progress, trace_filenames)
+        self.assertEqual(max(in_flight), 1)
+
+
+class TestTraceConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config_filename = shutil.copy(TRACE_READER_PLAIN_CONFIG_FILE,
+                                           self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_trigger(self, transaction_name, parameters):
+        section_trigger = SectionTrigger('GTP v.1\\n', parameters)
+        return TransactionTrigger(transaction_name, 'Call #[0-9]+\\n',
+                                  '(Message #\\d+)\\t(.*?)\\t(.*?)\\t',
+                                  '(Message #\\d+)\\n',
+                                  [section_trigger, section_trigger])
+
+    def test_validate_triggers(self):
+        issues = validate_triggers([
+            self.get_trigger('Create PDP Context', ['IMSI =', 'IMSI',
+                                                    'Rat Type (', 
+                                                    'Value = (.*?)\\t']),
+            self.get_trigger('Create PDP Context Request', ['IMSI ='])])
+        messages = [(issue.severity, issue.pattern, issue.message.split(' ')[0])
+                    for issue in issues]
+        self.assertIn(('warning', 'GTP v.1\\n', 'unreachable,'), messages)
+        self.assertIn(('warning', 'IMSI', 'duplicate'), messages)
+        self.assertIn(('error', 'Rat Type (', 'incorrect'), messages)
+        self.assertIn(('warning', 'Value = (.*?)\\t', 'wildcard'), messages)
+        self.assertIn(('warning', 'Create PDP Context Request', 'unreachable,'),
+                      messages)
+        self.assertListEqual(get_backtracking_risks('^(.*?)\\t'), [])
+        self.assertEqual(len(get_backtracking_risks('(\\w+\\s?)*$')), 1)
+
+    def test_compile_config(self):
+        compiled_config = compile_config(self.config_filename)
+        self.assertListEqual(compiled_config.issues, [])
+        compiled_filename = self.config_filename + '.compiled'
+        self.assertTrue(os.path.exists(compiled_filename))
+        trace_reader = compiled_config.apply(TraceReaderPlain())
+        self.assertListEqual(
+            trace_reader.get_columns(),
+            TraceReaderPlain(config_filename=self.config_filename).get_columns())
+        with mock.patch.object(CompiledConfig, '__init__') as init, \
+                mock.patch.object(CompiledPattern, 'find_required_literal') \
+                as find_required_literal:
+            loaded_config = compile_config(self.config_filename)
+            init.assert_not_called()
+            # Pattern analysis is loaded, not done again
+            matcher = loaded_config.transaction_matcher
+            self.assertEqual(matcher.get_required_literals(),
+                             trace_reader.get_matcher().get_required_literals())
+            find_required_literal.assert_not_called()
+        # Concurrent saves write their own temporary files
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(compiled_config.save, [compiled_filename] * 8))
+        self.assertListEqual(sorted(os.listdir(self.temp_dir.name)),
+                             sorted([os.path.basename(self.config_filename),
+                                     os.path.basename(compiled_filename)]))
+        with open(self.config_filename) as f:
+            config = f.read()
+        with open(self.config_filename, 'w') as f:
+            f.write(config.replace('(Message #\\d+)\\n', 'Message #\\d+\\n'))
+        with self.assertRaises(ValueError):
+            compile_config(self.config_filename)
+
+
+class TestTraceAnalytics(unittest.TestCase):
+
+    def test_add(self):
+        times = pd.Timestamp('2021-10-11 12:00:00') + pd.to_timedelta(
+            [0, 10, 0, 5, 0, 30, 20, 45, 0], unit='ms')
+        df = pd.DataFrame({
+            'TID' : [1, 1, 2, 3, 4, 4, 4, 4, 5],
+            'timestamp' : times,
+            'type' : ['Echo Request', 'Echo Response', 'Echo Request',
+                      'Echo Response', 'Create Session Request',
+                      'Create Session Request', 'Create Session Response',
+                      'Create Session Response', 'Error Indication']})
+        analytics = TraceAnalytics(timeout='25ms')
+        self.assertEqual(analytics.add(df), 4)
+        latencies = analytics.get_latencies()
+        self.assertListEqual(list(latencies['TID']), [1, 2, 4, 4])
+        self.assertListEqual(latencies['latency_ms'].fillna(-1).tolist(),
+                             [10.0, -1.0, 20.0, 15.0])
+        report = analytics.get_latency_report()
+        self.assertDictEqual(
+            report.loc['Echo', ['requests', 'answered', 'unanswered',
+                                'unsolicited']].to_dict(),
+            {'requests': 2, 'answered': 1, 'unanswered': 1, 'unsolicited': 1})
+        self.assertEqual(report.loc['Create Session', 'p50_ms'], 17.5)
+        self.assertEqual(report.loc['Create Session', 'timed_out'], 0)
+        self.assertEqual(analytics.get_message_counts()['Echo Request'], 2)
+
+    def test_add_trace_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_filename = os.path.join(temp_dir, 'trace.txt')
+            write_plain_trace(trace_filename, 10)
+            trace_reader = TraceReaderPlain(
+                config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+            analytics = TraceAnalytics(timeout='0.5ms')
+            self.assertEqual(analytics.add_trace_file(
+                trace_reader, trace_filename, chunk_transactions=3), 10)
+        report = analytics.get_latency_report()
+        self.assertListEqual(list(report.index),
+                             ['Create PDP Context', 'Create Session'])
+        self.assertListEqual(list(report['answered']), [5, 5])
+        self.assertListEqual(list(report['timed_out']), [5, 5])
+        self.assertListEqual(list(report['max_ms']), [1.0, 1.0])
+
+
+class TestTraceCorrelation(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(trace_filename, 4)
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+        trace_reader.read_trace_file(trace_filename)
+        self.plain_df = trace_reader.get_data()
+        # Call records of calls 1, 2 and 4, as read by TraceReaderCSV
+        self.csv_df = pd.DataFrame({
+            'Date' : pd.to_datetime(['2021-10-11'] * 3),
+            'Start Time' : ['12:00:01', '12:00:02', '12:00:09'],
+            'GTP IMSI' : ['214010000000001', None, '214010000000004'],
+            'Any Protocol IMSI' : [None, 'IMSI 214010000000002', None],
+            'IP Source Address' : ['10.0.1.1', '010.000.000.002', '10.0.0.4'],
+            'IP Dest Address' : ['10.0.0.1', '10.0.1.1', '10.0.1.1']})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_keys(self):
+        keys = CorrelationKeys(self.csv_df, TraceCorrelator().csv_keys)
+        self.assertListEqual(list(keys.keys['imsi']),
+                             [214010000000001, 214010000000002,
+                              214010000000004])
+        self.assertListEqual(list(keys.get_rows('imsi', '214010000000002')),
+                             [1])
+        plain_keys = TraceCorrelator().get_plain_keys(self.plain_df)
+        # Address pairs are unordered and addresses normalized
+        self.assertEqual(plain_keys.keys['ip_pair'][0], keys.keys['ip_pair'][0])
+        self.assertEqual(plain_keys.keys['ip_pair'][2], keys.keys['ip_pair'][1])
+        self.assertNotEqual(plain_keys.keys['ip_pair'][0],
+                            plain_keys.keys['ip_pair'][1])
+
+    def test_correlate(self):
+        correlator = TraceCorrelator()
+        df = correlator.correlate(self.plain_df, self.csv_df)
+        self.assertListEqual(list(df['TID']), [1, 1, 2, 2, 4, 4])
+        self.assertListEqual(list(df['Start Time']), ['12:00:01'] * 2 +
+                             ['12:00:02'] * 2 + ['12:00:09'] * 2)
+        df = correlator.correlate(self.plain_df, self.csv_df,
+                                  on=['imsi', 'ip_pair'], how='left')
+        self.assertListEqual(list(df['TID']), [1, 1, 2, 2, 3, 3, 4, 4])
+        self.assertListEqual(list(df['Start Time'].notna()),
+                             [True, False, True, False, False, False, True,
+                              False])
+        # As of joins, within the time window only
+        df = correlator.correlate(self.plain_df, self.csv_df, on='imsi',
+                                  tolerance='1s')
+        self.assertListEqual(list(df['TID']), [1, 1, 2, 2])
+        with self.assertRaises(ValueError):
+            correlator.correlate(self.plain_df, self.csv_df, on='msisdn')
+
+
+class TestTraceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(self.trace_filename, 4)
+        self.cache = TraceCache(os.path.join(self.temp_dir.name, 'cache'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_trace_file(self):
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE, cache=self.cache)
+        trace_reader.read_trace_file(self.trace_filename, use_cache=False)
+        self.assertEqual(len(self.cache.get_entries()), 0)
+        trace_reader.read_trace_file(self.trace_filename)
+        df_expected = trace_reader.get_data()
+        self.assertEqual(len(self.cache.get_entries()), 1)
+        with mock.patch.object(TraceReaderPlain, 'get_trace_context') as context:
+            trace_reader.read_trace_file(self.trace_filename)
+            context.assert_not_called()
+        pd.testing.assert_frame_equal(trace_reader.get_data(), df_expected)
+        # A different config must not use the cached result
+        trace_reader.encoding = 'latin-1'
+        trace_reader.read_trace_file(self.trace_filename)
+        self.assertEqual(len(self.cache.get_entries()), 2)
+
+    def test_eviction(self):
+        df = pd.DataFrame({'TID': range(100)})
+        self.cache.store(self.trace_filename, 'config 1', df)
+        entry_size = self.cache.get_size()
+        self.cache.max_size = entry_size
+        os.utime(self.cache.get_entries()[0][2], (0, 0))
+        self.cache.store(self.trace_filename, 'config 2', df)
+        self.assertEqual(self.cache.get_size(), entry_size)
+        self.assertIsNone(self.cache.load(self.trace_filename, 'config 1'))
+        pd.testing.assert_frame_equal(
+            self.cache.load(self.trace_filename, 'config 2'), df)
+
+
+class TestTraceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        write_plain_trace(self.trace_filename, 10)
+        self.trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_CONFIG_FILE)
+        self.index_columns = ['GTP v.1 - IMSI', 'GTP v.2 - IMSI']
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_transactions(self):
+        trace_index = get_trace_index(self.trace_reader, self.trace_filename,
+                                      self.index_columns)
+        self.assertEqual(len(trace_index), 10)
+        self.assertTrue(os.path.exists(self.trace_filename + '.idx'))
+        df_full = self.trace_reader.get_data()
+        df = trace_index.read_transactions(
+            self.trace_reader, values={'GTP v.2 - IMSI': ['214010000000004',
+                                                          '214010000000008']})
+        pd.testing.assert_frame_equal(
+            df, df_full[df_full['TID'].isin([4, 8])].reset_index(drop=True),
+            check_dtype=False)
+        df = trace_index.read_transactions(
+            self.trace_reader, time_range=('2021-10-11 12:00:02',
+                                           '2021-10-11 12:00:05'))
+        self.assertListEqual(list(df['TID']), [2, 2, 3, 3, 4, 4])
+        df = trace_index.read_transactions(self.trace_reader, tids=[1, 10])
+        self.assertListEqual(list(df['TID']), [1, 1, 10, 10])
+        with self.assertRaises(ValueError):
+            trace_index.get_tids(values={'IP - Source IP address': '10.0.0.1'})
+
+    def test_get_trace_index(self):
+        trace_index = get_trace_index(self.trace_reader, self.trace_filename,
+                                      self.index_columns)
+        with mock.patch.object(TraceIndex, 'build') as build:
+            get_trace_index(self.trace_reader, self.trace_filename,
+                            self.index_columns[:1])
+            build.assert_not_called()
+        write_plain_trace(self.trace_filename, 12)
+        self.assertFalse(trace_index.is_valid(self.trace_reader))
+        trace_index = get_trace_index(self.trace_reader, self.trace_filename)
+        self.assertEqual(len(trace_index), 12)
+
+
+class TestTraceReaderPlainTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        PlainTraceGenerator(num_calls=6).write(self.trace_filename)
+        self.trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_TYPED_CONFIG_FILE)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_column_types(self):
+        self.trace_reader.read_trace_file(self.trace_filename)
+        df = self.trace_reader.get_data()
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['timestamp']))
+        self.assertEqual(df['timestamp'].iloc[0],
+                         pd.Timestamp('2021-10-08 12:00:01.001'))
+        uplink = df['GTP v.1 - Maximum bit rate for uplink']
+        self.assertEqual(uplink.dtype, 'Int64')
+        self.assertEqual(uplink.iloc[0], 64000)
+        self.assertEqual(uplink.isna().sum(), 6)
+        self.assertEqual(df['GTP v.1 - Rat Type Value'].dtype, 'category')
+        self.assertEqual(df['GTP v.2 - IMSI'].dtype, 'string')
+        chunks = list(self.trace_reader.iter_trace_file(self.trace_filename,
+                                                        2))
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(
+            chunks[0]['timestamp']))
+
+    def test_non_integer_values(self):
+        with open(self.trace_filename) as f:
+            trace = f.read()
+        with open(self.trace_filename, 'w') as f:
+            f.write(trace.replace('uplink = 64000 kbps', 'uplink = 64.5 kbps',
+                                  1))
+        with self.assertLogs('trace_analyzer', 'WARNING'):
+            self.trace_reader.read_trace_file(self.trace_filename,
+                                              use_cache=False)
+        uplink = self.trace_reader.get_data()[
+            'GTP v.1 - Maximum bit rate for uplink']
+        self.assertEqual(uplink.dtype, 'Int64')
+        self.assertTrue(pd.isna(uplink.iloc[0]))
+        self.assertEqual(uplink.isna().sum(), 7)
+
+    def test_incorrect_type(self):
+        config_filename = os.path.join(self.temp_dir.name, 'config.txt')
+        with open(TRACE_READER_PLAIN_TYPED_CONFIG_FILE) as f:
+            config = f.read()
+        with open(config_filename, 'w') as f:
+            f.write(config.replace('\t category', '\t not a type'))
+        with self.assertRaises(ValueError):
+            TraceReaderPlain(config_filename=config_filename)
+
+
+class TestTraceGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_plain_trace(self):
+        trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        num_messages = PlainTraceGenerator(num_calls=6, messages_per_call=3,
+                                           params_per_section=2).write(
+                                               trace_filename)
+        self.assertEqual(num_messages, 18)
+        trace_reader = TraceReaderPlain(
+            config_filename=TRACE_READER_PLAIN_SAMPLE_CONFIG_FILE,
+            trace_filename=trace_filename)
+        df = trace_reader.get_data()
+        self.assertEqual(df.shape[0], num_messages)
+        self.assertEqual(df['TID'].nunique(), 6)
+        self.assertEqual(df['GTP v.1 - IMSI'].count(), 9)
+        self.assertEqual(df['GTP v.2 - IMSI'].count(), 9)
+
+    def test_csv_trace(self):
+        trace_filename = os.path.join(self.temp_dir.name, 'trace.csv')
+        trace_reader = TraceReaderCSV(
+            config_filename=TRACE_READER_CSV_CONFIG_FILE)
+        CSVTraceGenerator(trace_reader.get_fields(), num_rows=25).write(
+            trace_filename)
+        trace_reader.read_trace_file(trace_filename)
+        self.assertTupleEqual(trace_reader.get_data().shape,
+                              (25, len(trace_reader.get_fields())))
+
+    def test_benchmark(self):
+        trace_filename = os.path.join(self.temp_dir.name, 'trace.txt')
+        PlainTraceGenerator(num_calls=4).write(trace_filename)
+        result = run_benchmark('plain mmap',
+                               TRACE_READER_PLAIN_SAMPLE_CONFIG_FILE,
+                               trace_filename, isolated=False)
+        self.assertEqual(result['rows'], 8)
+        self.assertGreater(result['lines_per_sec'], 0)
+        self.assertGreater(result['mb_per_sec'], 0)
+
+
 class TestTransaction(unittest.TestCase):
     
     def setUp(self):
@@ -127,6 +1116,125 @@ class TestTransaction(unittest.TestCase):
         print(40 * '*' + '\nTesting Transaction to DataFrame')        
         print(df)
         self.assertTupleEqual((3, 5), df.shape)    
- 
-    
-unittest.main()
+
+    def test_shared_field_index(self):
+        field_index = FieldIndex(['A', 'B'])
+        first = Transaction(0, self.triggers[0], field_index)
+        second = Transaction(1, self.triggers[0], field_index)
+        first.set_field("Message #1", "C", 1)
+        second.set_field("Message #1", "A", 2)
+        self.assertEqual(field_index.names, ['A', 'B', 'C'])
+        self.assertFalse(hasattr(first["Message #1"], '__dict__'))
+        self.assertEqual(first.to_dict(), {"Message #1": {"C": 1}})
+        self.assertEqual(second.to_dict(), {"Message #1": {"A": 2}})
+
+
+class TestTransactionAccumulator(unittest.TestCase):
+
+    def setUp(self):
+        trace_reader = TraceReaderPlain(config_filename=
+                                        TRACE_READER_PLAIN_CONFIG_FILE)
+        self.triggers = trace_reader.get_triggers()
+
+    def test_empty(self):
+        accumulator = TransactionAccumulator()
+        self.assertEqual(len(accumulator), 0)
+        self.assertTrue(accumulator.to_DataFrame().empty)
+
+    def test_to_dataframe(self):
+        first = Transaction(1, self.triggers[0])
+        first.set_field("Message #1", "A", 1)
+        first.set_field("Message #2", "B", 2)
+        second = Transaction(2, self.triggers[0])
+        second.set_field("Message #1", "C", 3)
+        accumulator = TransactionAccumulator()
+        accumulator.add_transaction(first)
+        accumulator.add_transaction(second)
+        df = accumulator.to_DataFrame()
+        print(40 * '*' + '\nTesting TransactionAccumulator to DataFrame')
+        print(df)
+        self.assertEqual(len(accumulator), 3)
+        self.assertListEqual(list(df.columns), ['TID', 'A', 'B', 'C'])
+        self.assertListEqual(list(df['TID']), [1, 1, 2])
+        self.assertEqual(df['C'].count(), 1)
+        expected = pd.concat([first.to_DataFrame(), second.to_DataFrame()],
+                             ignore_index=True)
+        self.assertTrue(df.equals(expected))
+
+
+class TestPatternSet(unittest.TestCase):
+
+    def test_literal_patterns(self):
+        self.assertEqual(CompiledPattern('IMSI = ').literal, 'IMSI = ')
+        self.assertEqual(CompiledPattern('IP\\n').literal, 'IP\n')
+        self.assertIsNone(CompiledPattern('Call #[0-9]+\\n').literal)
+        self.assertIsNone(CompiledPattern('^   \\w+ Tag =').literal)
+        self.assertTrue(CompiledPattern('IP\\n').search('IP\n'))
+        self.assertFalse(CompiledPattern('IMSI = ').match('  IMSI = 1'))
+
+    def test_search_order(self):
+        patterns = PatternSet(['IP address =', 'Source IP address =',
+                               '^   \\w+ Tag ='])
+        self.assertIsNotNone(patterns.combined)
+        line = '   Source IP address = 10.0.0.1\n'
+        self.assertListEqual(patterns.search_all(line), [0, 1])
+        self.assertEqual(patterns.search_first(line), 0)
+        self.assertListEqual(patterns.search_all('   Type = 1\n'), [])
+        self.assertEqual(PatternSet(['b', 'a']).search_first('ab'), 0)
+
+    def test_back_references(self):
+        patterns = PatternSet(['(a)\\1', 'b'])
+        self.assertIsNone(patterns.combined)
+        self.assertListEqual(patterns.search_all('aab'), [0, 1])
+
+
+class TestTriggerDispatcher(unittest.TestCase):
+
+    def get_trigger(self, name, timestamp_trigger):
+        return TransactionTrigger(name, 'Call #', timestamp_trigger,
+                                  'Message #([0-9]+)')
+
+    def test_config_order(self):
+        short = '(Message #[0-9]+)\t(.*)\t(.*)\t'
+        long = '(Message #[0-9]+)\t(.*)\t(.*)\tLength'
+        matcher = TransactionMatcher([self.get_trigger('Delete', short),
+                                      self.get_trigger('Create', long),
+                                      self.get_trigger('Create PDP', short)])
+        dispatcher = matcher.search_start_triggers('Call #1\n')
+        self.assertEqual(len(dispatcher.groups), 2)
+        line = 'Message #1\tFri\tCreate PDP Request\tLength = 1\n'
+        trigger, groups = dispatcher.get_trigger(line)
+        self.assertEqual(trigger.transaction_name, 'Create')
+        self.assertEqual(groups[2], 'Create PDP Request')
+        line = 'Message #1\tFri\tCreate PDP Request\tSize = 1\n'
+        trigger, _ = dispatcher.get_trigger(line)
+        self.assertEqual(trigger.transaction_name, 'Create PDP')
+        line = 'Message #1\tFri\tEcho Request\tLength = 1\n'
+        self.assertEqual(dispatcher.get_trigger(line), (None, None))
+        self.assertIsNone(matcher.search_start_triggers('Message #1\n'))
+
+
+class TestCompiledSectionTrigger(unittest.TestCase):
+
+    def test_parameter_dispatch(self):
+        field_index = FieldIndex()
+        section_trigger = CompiledSectionTrigger(
+            SectionTrigger('GTP v.2\\n', ['IMSI = ', 'Message Type =', 
+                                           '00000110 Value = 6 (EUTRAN)']),
+            field_index)
+        self.assertEqual(list(section_trigger.parameter_keys), 
+                         ['IMSI', 'Message Type'])
+        self.assertEqual(field_index.names[0], 'GTP v.2 - IMSI')
+        self.assertEqual(
+            section_trigger.search_parameter_indexes('   IMSI  = 2140\n'), [0])
+        self.assertEqual(
+            section_trigger.search_parameter_indexes('   Served IMSI = 1\n'),
+            [])
+        self.assertEqual(section_trigger.search_parameters(
+            '   00000110 Value = 6 EUTRAN\n'), ['00000110 Value = 6 (EUTRAN)'])
+        self.assertEqual(section_trigger.get_required_literals(),
+                         {'IMSI', 'Message Type', '00000110 Value = 6 EUTRAN'})
+
+
+if __name__ == '__main__':
+    unittest.main()
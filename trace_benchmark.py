@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Throughput and memory benchmarks of the trace readers"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak RSS is not reported
+    resource = None
+
+from trace_analyzer import TraceReaderCSV, TraceReaderPlain
+from trace_generator import CSVTraceGenerator, PlainTraceGenerator
+
+TRACE_READER_PLAIN_CONFIG_FILE = 'TraceReaderPlain - config file.txt'
+TRACE_READER_CSV_CONFIG_FILE = 'TraceReaderCSV - Test fields.txt'
+
+# Benchmark name: (reader class, reader options, read_trace_file options)
+BENCHMARKS = {
+    'plain' : (TraceReaderPlain, {}, {}),
+    'plain mmap' : (TraceReaderPlain, {'use_mmap': True}, {}),
+    'csv' : (TraceReaderCSV, {}, {}),
+    'csv pyarrow' : (TraceReaderCSV, {}, {'engine': 'pyarrow'}),
+}
+
+
+def count_lines(trace_filename):
+    with open(trace_filename, 'rb') as f:
+        return sum(block.count(b'\n')
+                   for block in iter(lambda: f.read(1 << 20), b''))
+
+
+def get_peak_rss():
+    ''' Peak resident set size of this process in bytes, None if unknown '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_reader(benchmark_name, config_filename, trace_filename):
+    ''' Reads trace_filename. Returns (seconds, rows, peak RSS) '''
+    reader_class, reader_options, read_options = BENCHMARKS[benchmark_name]
+    reader = reader_class(config_filename=config_filename, **reader_options)
+    start_time = time.perf_counter()
+    reader.read_trace_file(trace_filename, use_cache=False, **read_options)
+    seconds = time.perf_counter() - start_time
+    return seconds, reader.get_data().shape[0], get_peak_rss()
+
+
+def run_benchmark(benchmark_name, config_filename, trace_filename,
+                  isolated=True):
+    ''' Runs a benchmark and returns its metrics. If isolated, the reader runs
+        in a new process so peak RSS only accounts for that benchmark
+    '''
+    if isolated:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            seconds, rows, peak_rss = executor.submit(
+                run_reader, benchmark_name, config_filename,
+                trace_filename).result()
+    else:
+        seconds, rows, peak_rss = run_reader(benchmark_name, config_filename,
+                                             trace_filename)
+    lines = count_lines(trace_filename)
+    megabytes = os.path.getsize(trace_filename) / 1e6
+    return {'benchmark' : benchmark_name,
+            'seconds' : seconds,
+            'rows' : rows,
+            'lines_per_sec' : lines / seconds,
+            'mb_per_sec' : megabytes / seconds,
+            'peak_rss_mb' : peak_rss / 1e6 if peak_rss is not None else None}
+
+
+def print_results(results):
+    print(f'{"benchmark":<14}{"seconds":>10}{"rows":>10}{"lines/s":>12}'
+          f'{"MB/s":>8}{"peak RSS MB":>13}')
+    for result in results:
+        peak_rss = result['peak_rss_mb']
+        peak_rss = f'{peak_rss:13.1f}' if peak_rss is not None else f'{"-":>13}'
+        print(f'{result["benchmark"]:<14}{result["seconds"]:10.2f}'
+              f'{result["rows"]:10d}{result["lines_per_sec"]:12.0f}'
+              f'{result["mb_per_sec"]:8.1f}{peak_rss}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks trace readers on synthetic traces')
+    parser.add_argument('--calls', type=int, default=10000,
+                        help='calls in the plain trace')
+    parser.add_argument('--messages', type=int, default=2,
+                        help='messages per call in the plain trace')
+    parser.add_argument('--params', type=int, default=10,
+                        help='extra params per section in the plain trace')
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='rows in the CSV trace')
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument('--workdir', default=None,
+                        help='directory for the generated traces')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        plain_filename = os.path.join(workdir, 'trace.txt')
+        csv_filename = os.path.join(workdir, 'trace.csv')
+        PlainTraceGenerator(args.calls, args.messages,
+                            args.params).write(plain_filename)
+        fields = TraceReaderCSV(
+            config_filename=TRACE_READER_CSV_CONFIG_FILE).get_fields()
+        CSVTraceGenerator(fields, args.rows).write(csv_filename)
+        results = []
+        for benchmark_name in args.benchmarks:
+            if BENCHMARKS[benchmark_name][0] is TraceReaderPlain:
+                config_filename = TRACE_READER_PLAIN_CONFIG_FILE
+                trace_filename = plain_filename
+            else:
+                config_filename = TRACE_READER_CSV_CONFIG_FILE
+                trace_filename = csv_filename
+            results.append(run_benchmark(benchmark_name, config_filename,
+                                         trace_filename))
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
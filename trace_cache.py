@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""On disk cache of parsed traces"""
+import hashlib
+import importlib.util
+import os
+import pandas as pd
+
+import trace_analyzer_constants as tac
+
+
+class TraceCache():
+    ''' On disk cache of parsed traces
+        Entries are keyed by trace file (path, size, modification time and a
+        hash of its content) and by the reader config. They are stored as
+        Parquet files, or pickles if pyarrow is not available. When the cache
+        grows over max_size bytes, least recently used entries are evicted
+    '''
+    def __init__(self, cache_dir=tac.TRACE_CACHE_DIR,
+                 max_size=tac.TRACE_CACHE_MAX_SIZE, full_hash=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.full_hash = full_hash
+        self.file_format = 'parquet' if self.parquet_available() else 'pickle'
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def parquet_available():
+        return importlib.util.find_spec('pyarrow') is not None
+
+    def get_key(self, trace_filename, config):
+        ''' Returns the cache key of trace_filename read with config, a string
+            describing everything that affects the parsed result
+        '''
+        stat = os.stat(trace_filename)
+        key = hashlib.sha256()
+        key.update(tac.TRACE_CACHE_VERSION.encode())
+        key.update(os.path.abspath(trace_filename).encode())
+        key.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        key.update(self.get_content_hash(trace_filename, stat.st_size))
+        key.update(config.encode())
+        return key.hexdigest()
+
+    def get_content_hash(self, trace_filename, file_size):
+        ''' Hashes the whole file if full_hash is set. Otherwise only its
+            first and last TRACE_CACHE_SAMPLE_SIZE bytes, so keys of multi GB
+            traces are computed in milliseconds
+        '''
+        content = hashlib.sha256()
+        sample_size = tac.TRACE_CACHE_SAMPLE_SIZE
+        with open(trace_filename, 'rb') as f:
+            if self.full_hash or file_size <= 2 * sample_size:
+                for block in iter(lambda: f.read(sample_size), b''):
+                    content.update(block)
+            else:
+                content.update(f.read(sample_size))
+                f.seek(-sample_size, os.SEEK_END)
+                content.update(f.read(sample_size))
+        return content.digest()
+
+    def get_entry_filename(self, key):
+        return os.path.join(self.cache_dir, f'{key}.{self.file_format}')
+
+    def load(self, trace_filename, config):
+        ''' Returns the cached DataFrame, or None if not in cache '''
+        entry_filename = self.get_entry_filename(
+            self.get_key(trace_filename, config))
+        if not os.path.exists(entry_filename):
+            return None
+        try:
+            if self.file_format == 'parquet':
+                df = pd.read_parquet(entry_filename)
+            else:
+                df = pd.read_pickle(entry_filename)
+        except Exception:
+            # Unreadable entry, e.g. partially written. Parse again
+            os.remove(entry_filename)
+            return None
+        # Marks entry as recently used
+        os.utime(entry_filename)
+        return df
+
+    def store(self, trace_filename, config, df):
+        entry_filename = self.get_entry_filename(
+            self.get_key(trace_filename, config))
+        temp_filename = entry_filename + '.tmp'
+        if self.file_format == 'parquet':
+            df.to_parquet(temp_filename, index=False)
+        else:
+            df.to_pickle(temp_filename)
+        os.replace(temp_filename, entry_filename)
+        self.evict()
+
+    def get_entries(self):
+        ''' Returns (last use, size, file name) of every cache entry '''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(('.parquet', '.pickle')):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get_size(self):
+        return sum(size for _, size, _ in self.get_entries())
+
+    def evict(self):
+        ''' Removes least recently used entries until under max_size '''
+        entries = sorted(self.get_entries())
+        cache_size = sum(size for _, size, _ in entries)
+        for _, size, entry_filename in entries:
+            if cache_size <= self.max_size:
+                break
+            os.remove(entry_filename)
+            cache_size -= size
+
+    def clear(self):
+        for _, _, entry_filename in self.get_entries():
+            os.remove(entry_filename)
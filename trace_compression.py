@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Detection and streaming decompression of compressed trace files"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+try:
+    import zstandard
+except ImportError:
+    # zstd traces cannot be read
+    zstandard = None
+
+import trace_analyzer_constants as tac
+
+
+def get_compression(trace_filename):
+    ''' Returns the compression of a trace file ('gzip', 'bz2', 'xz' or
+        'zstd') from its extension or, failing that, its first bytes.
+        None if not compressed
+    '''
+    extension = os.path.splitext(trace_filename)[1].lower()
+    if extension in tac.TRACE_COMPRESSION_EXTENSIONS:
+        return tac.TRACE_COMPRESSION_EXTENSIONS[extension]
+    with open(trace_filename, 'rb') as f:
+        header = f.read(tac.TRACE_COMPRESSION_MAGIC_SIZE)
+    for magic, compression in tac.TRACE_COMPRESSION_MAGIC.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def open_compressed(trace_filename, compression):
+    ''' Opens a compressed trace file for binary reading '''
+    if compression == 'gzip':
+        return gzip.open(trace_filename, 'rb')
+    if compression == 'bz2':
+        return bz2.open(trace_filename, 'rb')
+    if compression == 'xz':
+        return lzma.open(trace_filename, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise(ValueError("zstandard is required to read zstd traces"))
+        # read_across_frames: multi frame files are read whole
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(trace_filename, 'rb'), read_across_frames=True,
+            closefd=True)
+    raise(ValueError(f"Incorrect compression: {compression}"))
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    ''' Raw binary stream of the decompressed content of a file
+        Decompression runs in its own thread, which keeps up to queue_size
+        blocks ahead of the reader. zlib, bz2, lzma and zstd release the GIL,
+        so decompression overlaps with parsing
+    '''
+    def __init__(self, f, block_size=tac.TRACE_DECOMPRESS_BLOCK_SIZE,
+                 queue_size=tac.TRACE_DECOMPRESS_QUEUE_SIZE):
+        super().__init__()
+        self.f = f
+        self.block_size = block_size
+        self.blocks = queue.Queue(queue_size)
+        self.block = b''
+        self.position = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        try:
+            while not self.stopped.is_set():
+                block = self.f.read(self.block_size)
+                self.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            # Raised again in the reader thread
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.block is None:
+            # End of file
+            return 0
+        if self.position >= len(self.block):
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise(block)
+            self.position = 0
+            self.block = block
+            if not block:
+                self.block = None
+                return 0
+        size = min(len(buffer), len(self.block) - self.position)
+        buffer[:size] = self.block[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.f.close()
+        super().close()
+
+
+def open_trace_file(trace_filename, compression, encoding=None, errors=None,
+                    newline=None):
+    ''' Opens a compressed trace file in text mode, as open(..., 'r') would
+        open the uncompressed one
+    '''
+    raw = ThreadedDecompressor(open_compressed(trace_filename, compression))
+    return io.TextIOWrapper(io.BufferedReader(raw, tac.TRACE_DECOMPRESS_BLOCK_SIZE),
+                            encoding=encoding, errors=errors, newline=newline)
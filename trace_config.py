@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Validation and compilation of TraceReaderPlain config files"""
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from trace_analyzer import TraceReaderPlain, get_parameter_name
+import trace_analyzer_constants as tac
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConfigIssue():
+    ''' Problem found in a TraceReaderPlain config. Errors make the config
+        unusable, warnings point at patterns never or badly matched
+    '''
+    severity : str = tac.CONFIG_WARNING
+    location : str = ""
+    pattern : str = ""
+    message : str = ""
+
+    def __str__(self):
+        return (f'{self.severity}: {self.location}: "{self.pattern}": '
+                f'{self.message}')
+
+
+def get_backtracking_risks(pattern, searched=True):
+    ''' Returns descriptions of constructs of pattern prone to catastrophic
+        or quadratic backtracking. searched is True for patterns looked for
+        anywhere in a line, False for patterns matched at its start
+    '''
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    risks = []
+    collect_backtracking_risks(parsed, risks)
+    if searched:
+        items = get_sequence_items(parsed)
+        anchored = items and items[0][0] is sre_parse.AT and \
+            items[0][1] is sre_parse.AT_BEGINNING
+        for index, item in enumerate(items):
+            if not anchored and is_unbounded_wildcard(item) and \
+                    index + 1 < len(items):
+                risks.append('wildcard repeat searched in every position '
+                             '(quadratic on lines without a match). Anchor '
+                             'the pattern or replace the wildcard with a '
+                             'negated class, e.g. [^\\t]*')
+                break
+    return risks
+
+
+def collect_backtracking_risks(parsed, risks, repeated=False):
+    ''' Appends to risks nested unbounded repeats and adjacent unbounded
+        wildcards found in parsed
+    '''
+    previous_wildcard = False
+    for item in parsed:
+        opcode, argument = item
+        if opcode in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            _, maximum, repeated_items = argument
+            unbounded = maximum is sre_parse.MAXREPEAT
+            if unbounded and repeated:
+                risks.append('nested unbounded repeats (exponential '
+                             'backtracking)')
+            if is_unbounded_wildcard(item):
+                if previous_wildcard:
+                    risks.append('adjacent unbounded wildcards (polynomial '
+                                 'backtracking)')
+                previous_wildcard = True
+            collect_backtracking_risks(repeated_items, risks,
+                                       repeated or unbounded)
+            continue
+        if opcode is sre_parse.SUBPATTERN:
+            collect_backtracking_risks(argument[-1], risks, repeated)
+        elif opcode is sre_parse.BRANCH:
+            for branch in argument[1]:
+                collect_backtracking_risks(branch, risks, repeated)
+        previous_wildcard = False
+
+
+def get_sequence_items(parsed):
+    ''' Returns the items of parsed, with groups replaced by their items '''
+    items = []
+    for opcode, argument in parsed:
+        if opcode is sre_parse.SUBPATTERN:
+            items.extend(get_sequence_items(argument[-1]))
+        else:
+            items.append((opcode, argument))
+    return items
+
+
+def is_unbounded_wildcard(item):
+    ''' True for .* .+ .*? and the like '''
+    opcode, argument = item
+    if opcode not in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        return False
+    _, maximum, repeated_items = argument
+    items = get_sequence_items(repeated_items)
+    return maximum is sre_parse.MAXREPEAT and len(items) == 1 and \
+        items[0][0] is sre_parse.ANY
+
+
+def check_pattern(issues, location, pattern, searched=True, min_groups=0,
+                  max_groups=None):
+    ''' Compiles pattern, adding to issues an error if incorrect or without
+        the groups required, and warnings about how it is matched
+    '''
+    try:
+        regex = re.compile(pattern)
+    except re.error as e:
+        issues.append(ConfigIssue(tac.CONFIG_ERROR, location, pattern,
+                                  f'incorrect regex: {e}'))
+        return
+    if regex.groups < min_groups or (max_groups is not None and
+                                     regex.groups > max_groups):
+        required = f'{min_groups}' if min_groups == max_groups else \
+            f'at least {min_groups}'
+        issues.append(ConfigIssue(tac.CONFIG_ERROR, location, pattern,
+                                  f'groups required: {required}, '
+                                  f'found: {regex.groups}'))
+    if regex.search('') is not None:
+        issues.append(ConfigIssue(tac.CONFIG_WARNING, location, pattern,
+                                  'matches every line'))
+    for risk in get_backtracking_risks(pattern, searched):
+        issues.append(ConfigIssue(tac.CONFIG_WARNING, location, pattern, risk))
+
+
+def validate_triggers(transaction_triggers):
+    ''' Returns the ConfigIssues of the transaction triggers of a config:
+        incorrect regexes, duplicate or unreachable triggers and params, and
+        patterns prone to catastrophic backtracking
+    '''
+    issues = []
+    if not transaction_triggers:
+        issues.append(ConfigIssue(tac.CONFIG_ERROR, 'config', '',
+                                  'no transaction triggers found'))
+    for position, transaction_trigger in enumerate(transaction_triggers):
+        name = transaction_trigger.transaction_name
+        location = f'transaction "{name}"'
+        check_pattern(issues, f'{location} transaction_start_trigger',
+                      transaction_trigger.transaction_start_trigger)
+        # Timestamp and message triggers are matched at line start
+        check_pattern(issues, f'{location} msg_timestamp_trigger',
+                      transaction_trigger.msg_timestamp_trigger,
+                      searched=False, min_groups=3, max_groups=3)
+        check_pattern(issues, f'{location} msg_trigger',
+                      transaction_trigger.msg_trigger, searched=False,
+                      min_groups=1)
+        for previous in transaction_triggers[:position]:
+            # The first trigger whose name is in the message type is taken
+            if previous.transaction_start_trigger == \
+                    transaction_trigger.transaction_start_trigger and \
+                    previous.msg_timestamp_trigger == \
+                    transaction_trigger.msg_timestamp_trigger and \
+                    previous.transaction_name in name:
+                issues.append(ConfigIssue(
+                    tac.CONFIG_WARNING, location, name,
+                    f'unreachable, transaction "{previous.transaction_name}"'
+                    f' is always taken first'))
+                break
+        section_patterns = set()
+        for section_trigger in transaction_trigger.section_triggers:
+            pattern = section_trigger.section_trigger
+            section_location = f'{location} section "{pattern.strip()}"'
+            if pattern in section_patterns:
+                issues.append(ConfigIssue(
+                    tac.CONFIG_WARNING, section_location, pattern,
+                    'unreachable, same section_trigger found before'))
+            section_patterns.add(pattern)
+            check_pattern(issues, f'{section_location} section_trigger',
+                          pattern)
+            names = set()
+            for parameter in section_trigger.parameters:
+                parameter_name = get_parameter_name(pattern, parameter)
+                if parameter_name in names:
+                    issues.append(ConfigIssue(
+                        tac.CONFIG_WARNING, f'{section_location} param',
+                        parameter, f'duplicate column "{parameter_name}"'))
+                names.add(parameter_name)
+                check_pattern(issues, f'{section_location} param', parameter)
+    return issues
+
+
+class CompiledConfig():
+    ''' TraceReaderPlain config, parsed, validated and compiled once and
+        saved as a versioned artifact, so workers and later runs load it
+        instead of parsing the config file again. The artifact keeps the
+        analysis of every pattern (literals, combined alternations, dispatch
+        tables), so loading only compiles the regexes themselves, which re
+        cannot store. It is rebuilt whenever the config file content changes
+    '''
+    def __init__(self, config_filename, encoding=None, errors=None):
+        self.version = tac.CONFIG_COMPILED_VERSION
+        self.config_hash = self.get_config_hash(config_filename, encoding,
+                                                errors)
+        trace_reader = TraceReaderPlain(encoding=encoding, errors=errors)
+        try:
+            trace_reader.read_config_file(config_filename)
+        except re.error:
+            # Triggers are parsed, their matcher could not be compiled.
+            # Reported by validate_triggers
+            trace_reader.transaction_matcher = None
+        self.transaction_triggers = trace_reader.get_triggers()
+        self.transaction_matcher = trace_reader.get_matcher()
+        self.issues = validate_triggers(self.transaction_triggers)
+
+    @staticmethod
+    def get_config_hash(config_filename, encoding=None, errors=None):
+        content = hashlib.sha256()
+        content.update(tac.CONFIG_COMPILED_VERSION.encode())
+        content.update(f'{encoding}:{errors}'.encode())
+        with open(config_filename, 'rb') as f:
+            content.update(f.read())
+        return content.hexdigest()
+
+    def get_errors(self):
+        return [issue for issue in self.issues
+                if issue.severity == tac.CONFIG_ERROR]
+
+    def get_warnings(self):
+        return [issue for issue in self.issues
+                if issue.severity == tac.CONFIG_WARNING]
+
+    def is_valid(self, config_filename, encoding=None, errors=None):
+        ''' True if compiled from the current content of config_filename '''
+        return self.version == tac.CONFIG_COMPILED_VERSION and \
+            self.config_hash == self.get_config_hash(config_filename,
+                                                     encoding, errors)
+
+    def apply(self, trace_reader):
+        ''' Sets the config of trace_reader, a TraceReaderPlain '''
+        if self.get_errors():
+            raise(ValueError("Incorrect config file: " +
+                             '; '.join(str(issue)
+                                       for issue in self.get_errors())))
+        trace_reader.transaction_triggers = self.transaction_triggers
+        trace_reader.transaction_matcher = self.transaction_matcher
+        return trace_reader
+
+    @staticmethod
+    def get_compiled_filename(config_filename):
+        return config_filename + tac.CONFIG_COMPILED_EXTENSION
+
+    def save(self, compiled_filename):
+        ''' Writes the artifact atomically. Concurrent saves of the same
+            config each write their own temporary file
+        '''
+        with tempfile.NamedTemporaryFile(
+                'wb', dir=os.path.dirname(compiled_filename) or '.',
+                prefix=os.path.basename(compiled_filename), suffix='.tmp',
+                delete=False) as f:
+            try:
+                pickle.dump(self, f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, compiled_filename)
+
+    @classmethod
+    def load(cls, compiled_filename):
+        with open(compiled_filename, 'rb') as f:
+            return pickle.load(f)
+
+
+def compile_config(config_filename, encoding=None, errors=None,
+                   compiled_filename=None, strict=True):
+    ''' Returns the CompiledConfig of config_filename, loading its artifact
+        if up to date, or compiling and saving it otherwise. Warnings are
+        logged once, when compiled. If strict, config errors raise ValueError
+    '''
+    compiled_filename = compiled_filename or \
+        CompiledConfig.get_compiled_filename(config_filename)
+    compiled_config = None
+    if os.path.exists(compiled_filename):
+        try:
+            compiled_config = CompiledConfig.load(compiled_filename)
+        except Exception:
+            # Unreadable artifact, e.g. from an older version
+            compiled_config = None
+        if compiled_config is not None and \
+                not compiled_config.is_valid(config_filename, encoding, errors):
+            compiled_config = None
+    if compiled_config is None:
+        compiled_config = CompiledConfig(config_filename, encoding, errors)
+        for issue in compiled_config.get_warnings():
+            logger.warning('%s: %s', config_filename, issue)
+        try:
+            compiled_config.save(compiled_filename)
+        except OSError as e:
+            # E.g. read only config directory. Compiled on every run
+            logger.warning('Compiled config not saved: %s', e)
+    if strict and compiled_config.get_errors():
+        raise(ValueError(f"Incorrect config file {config_filename}: " +
+                         '; '.join(str(issue) for issue in
+                                   compiled_config.get_errors())))
+    return compiled_config
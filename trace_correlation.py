@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Correlation of decoded plain messages with CSV call records"""
+import ipaddress
+import numpy as np
+import pandas as pd
+
+import trace_analyzer_constants as tac
+
+# Value of missing keys
+MISSING_KEY = -1
+
+
+def get_imsi_keys(df, columns):
+    ''' Returns IMSIs as int64 values, the first found in columns, or
+        MISSING_KEY. Any text around the digits is ignored
+    '''
+    keys = np.full(df.shape[0], MISSING_KEY, dtype=np.int64)
+    for column in columns:
+        if column not in df.columns:
+            continue
+        # Only distinct values are normalized
+        codes, uniques = pd.factorize(df[column])
+        values = pd.Series(np.asarray(uniques, dtype=str), dtype=object)
+        # Plain IMSIs skip the regex
+        digits = values.where(values.str.isdigit() &
+                              values.str.len().between(6, 15))
+        other = digits.isna()
+        if other.any():
+            digits[other] = values[other].str.extract(
+                tac.CORRELATION_IMSI_PATTERN, expand=False)
+        # Missing values, at code -1, take the last key
+        unique_keys = np.append(pd.to_numeric(digits).fillna(
+            MISSING_KEY).to_numpy(np.int64), MISSING_KEY)
+        column_keys = unique_keys[codes]
+        keys = np.where(keys == MISSING_KEY, column_keys, keys)
+    return keys
+
+
+def normalize_ip_address(value):
+    ''' Returns the compressed text of an IP address, e.g. 10.0.0.1 for
+        010.000.000.001, or None if value is not an address
+    '''
+    value = str(value).strip().split('/')[0]
+    parts = value.split('.')
+    if len(parts) == 4 and all(part.isdigit() for part in parts):
+        # Leading zeros are rejected by ipaddress
+        value = '.'.join(str(int(part)) for part in parts)
+    try:
+        return ipaddress.ip_address(value).compressed
+    except ValueError:
+        return None
+
+
+def get_ip_pair_keys(df, source_column, destination_column):
+    ''' Returns int64 hashes of the (source, destination) address pairs of
+        df, or MISSING_KEY. Pairs are unordered, so a request and its
+        response have the same key
+    '''
+    if source_column not in df.columns or destination_column not in df.columns:
+        return np.full(df.shape[0], MISSING_KEY, dtype=np.int64)
+    source_codes, sources = pd.factorize(df[source_column])
+    destination_codes, destinations = pd.factorize(df[destination_column])
+    # Only distinct pairs are normalized. Codes are shifted so that missing
+    # addresses, at -1, take 0
+    width = len(destinations) + 1
+    pair_codes, pairs = pd.factorize(
+        (source_codes.astype(np.int64) + 1) * width + destination_codes + 1)
+    sources = [None] + [normalize_ip_address(source) for source in sources]
+    destinations = [None] + [normalize_ip_address(destination)
+                             for destination in destinations]
+    pair_names = []
+    for pair in pairs:
+        source_code, destination_code = divmod(int(pair), width)
+        source = sources[source_code]
+        destination = destinations[destination_code]
+        if source is None or destination is None:
+            pair_names.append(None)
+        else:
+            pair_names.append(' '.join(sorted((source, destination))))
+    unique_keys = np.full(len(pair_names), MISSING_KEY, dtype=np.int64)
+    valid = np.array([name is not None for name in pair_names], dtype=bool)
+    if valid.any():
+        unique_keys[valid] = pd.util.hash_array(
+            np.array(pair_names, dtype=object)[valid]).view(np.int64)
+        # Hashes never take the missing value
+        unique_keys[valid & (unique_keys == MISSING_KEY)] = 0
+    return unique_keys[pair_codes]
+
+
+def get_times(df, columns, timestamp_format=None):
+    ''' Returns datetime64 values of the timestamp column of df, or the sum
+        of a date column and a time of day column
+    '''
+    if any(column not in df.columns for column in columns):
+        return np.full(df.shape[0], np.datetime64('NaT'),
+                       dtype='datetime64[ns]')
+    times = df[columns[0]]
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, format=timestamp_format,
+                               errors='coerce')
+    for column in columns[1:]:
+        times = times + pd.to_timedelta(df[column].astype(str), errors='coerce')
+    return times.to_numpy()
+
+
+class CorrelationKeys():
+    ''' Normalized join keys of the rows of a DataFrame, as int64 values
+        that are cheap to hash and compare:
+        - imsi: IMSI digits
+        - ip_pair: hash of the unordered pair of IP addresses
+        - time: message or record time
+        key_columns maps each key to the columns it is taken from. If
+        by_transaction, the IMSI found in any message of a TID is set in all
+        of them, as decoded traces often carry it in the request only
+    '''
+    def __init__(self, df, key_columns, timestamp_format=None,
+                 by_transaction=False):
+        self.size = df.shape[0]
+        self.keys = {}
+        self.indexes = {}
+        self.keys['imsi'] = get_imsi_keys(df, key_columns.get('imsi', ()))
+        if by_transaction and 'TID' in df.columns:
+            self.keys['imsi'] = pd.Series(self.keys['imsi']).groupby(
+                df['TID'].to_numpy()).transform('max').to_numpy()
+        ip_columns = key_columns.get('ip_pair', ())
+        if len(ip_columns) == 2:
+            self.keys['ip_pair'] = get_ip_pair_keys(df, *ip_columns)
+        else:
+            self.keys['ip_pair'] = np.full(self.size, MISSING_KEY,
+                                           dtype=np.int64)
+        self.times = get_times(df, key_columns.get('time', ()),
+                               timestamp_format)
+
+    def get_frame(self, on, with_time=False):
+        ''' Returns the keys in on, with row positions, of the rows where
+            all of them are present
+        '''
+        frame = pd.DataFrame({kind: self.keys[kind] for kind in on})
+        frame['row'] = np.arange(self.size)
+        if with_time:
+            frame['time'] = self.times
+        valid = (frame[list(on)] != MISSING_KEY).all(axis=1)
+        if with_time:
+            valid &= frame['time'].notna()
+        return frame[valid]
+
+    def get_rows(self, kind, value):
+        ''' Returns the sorted row positions whose key kind is value, e.g.
+            an IMSI as an int or text. The index of each key, its values
+            sorted with their rows, is built on the first lookup
+        '''
+        if kind == 'imsi':
+            value = get_imsi_keys(pd.DataFrame({kind: [value]}), [kind])[0]
+        if kind not in self.indexes:
+            order = np.argsort(self.keys[kind], kind='stable')
+            self.indexes[kind] = (self.keys[kind][order], order)
+        sorted_keys, rows = self.indexes[kind]
+        return rows[np.searchsorted(sorted_keys, value, 'left'):
+                    np.searchsorted(sorted_keys, value, 'right')]
+
+
+class TraceCorrelator():
+    ''' Joins decoded TraceReaderPlain messages with TraceReaderCSV call
+        records. Both sides get normalized int64 keys (see CorrelationKeys),
+        so joins hash integers and never compare strings, and only keys and
+        row positions are merged before the result rows are taken
+        - plain_keys, csv_keys: columns of each key in each source
+        - timestamp_format: of plain message timestamps
+    '''
+    def __init__(self, plain_keys=tac.CORRELATION_PLAIN_KEYS,
+                 csv_keys=tac.CORRELATION_CSV_KEYS,
+                 timestamp_format=tac.TRACE_TIMESTAMP_FORMAT):
+        self.plain_keys = plain_keys
+        self.csv_keys = csv_keys
+        self.timestamp_format = timestamp_format
+
+    def get_plain_keys(self, df):
+        return CorrelationKeys(df, self.plain_keys, self.timestamp_format,
+                               by_transaction=True)
+
+    def get_csv_keys(self, df):
+        return CorrelationKeys(df, self.csv_keys)
+
+    def correlate(self, plain_df, csv_df, on=('imsi',), tolerance=None,
+                  direction='nearest', how='inner', plain_keys=None,
+                  csv_keys=None):
+        ''' Returns the plain messages joined with the CSV records with the
+            same keys in on ('imsi', 'ip_pair' or both). With tolerance (e.g.
+            '5s') each message is joined as of its time with the CSV record
+            nearest in time (or backward, forward, see pd.merge_asof) within
+            tolerance. Otherwise with every CSV record with the same keys.
+            how is 'inner' or 'left', keeping unmatched messages.
+            Keys already computed with get_plain_keys and get_csv_keys can be
+            passed, e.g. to join the same data several times
+        '''
+        on = [on] if isinstance(on, str) else list(on)
+        for kind in on:
+            if kind not in ('imsi', 'ip_pair'):
+                raise(ValueError(f"Incorrect correlation key: {kind}"))
+        if how not in ('inner', 'left'):
+            raise(ValueError(f"Incorrect join type: {how}"))
+        plain_keys = plain_keys or self.get_plain_keys(plain_df)
+        csv_keys = csv_keys or self.get_csv_keys(csv_df)
+        with_time = tolerance is not None
+        plain_frame = plain_keys.get_frame(on, with_time)
+        csv_frame = csv_keys.get_frame(on, with_time)
+        if with_time:
+            matches = pd.merge_asof(
+                plain_frame.sort_values('time'), csv_frame.sort_values('time'),
+                on='time', by=on, suffixes=('_plain', '_csv'),
+                tolerance=pd.Timedelta(tolerance), direction=direction)
+            matches = matches.dropna(subset=['row_csv'])
+        else:
+            matches = plain_frame.merge(csv_frame, on=on,
+                                        suffixes=('_plain', '_csv'))
+        plain_rows = matches['row_plain'].to_numpy(np.int64)
+        csv_rows = matches['row_csv'].to_numpy(np.int64)
+        if how == 'left':
+            unmatched = np.setdiff1d(np.arange(plain_df.shape[0]), plain_rows)
+            plain_rows = np.concatenate([plain_rows, unmatched])
+            csv_rows = np.concatenate(
+                [csv_rows, np.full(len(unmatched), MISSING_KEY)])
+        order = np.lexsort((csv_rows, plain_rows))
+        return self.get_joined(plain_df, csv_df, plain_rows[order],
+                               csv_rows[order])
+
+    def get_joined(self, plain_df, csv_df, plain_rows, csv_rows):
+        ''' Returns plain rows side by side with CSV rows. CSV rows at
+            MISSING_KEY are empty. CSV columns also in plain_df get a suffix
+        '''
+        plain_part = plain_df.iloc[plain_rows].reset_index(drop=True)
+        missing = csv_rows == MISSING_KEY
+        csv_part = csv_df.iloc[np.where(missing, 0, csv_rows)].reset_index(
+            drop=True) if csv_df.shape[0] else pd.DataFrame(
+                index=range(len(csv_rows)), columns=csv_df.columns)
+        if missing.any():
+            csv_part = csv_part.astype(object)
+            csv_part.loc[missing] = None
+        csv_part.columns = [column + tac.CORRELATION_CSV_SUFFIX
+                            if column in plain_part.columns else column
+                            for column in csv_part.columns]
+        return pd.concat([plain_part, csv_part], axis=1)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Synthetic plain and CSV trace generators for tests and benchmarks"""
+import datetime
+import random
+
+import trace_analyzer_constants as tac
+
+
+class PlainTraceGenerator():
+    ''' Writes synthetic plain traces in the "Call #/Message #" format read
+        with TraceReaderPlain - config file.txt. Calls alternate between
+        "Create PDP Context" (GTP v.1) and "Create Session" (GTP v.2)
+        - messages_per_call: messages of each call, alternating request and
+          response
+        - params_per_section: decoded "key = value" lines added to each
+          section besides the configured params
+    '''
+    def __init__(self, num_calls=1000, messages_per_call=2,
+                 params_per_section=10, seed=0):
+        self.num_calls = num_calls
+        self.messages_per_call = messages_per_call
+        self.params_per_section = params_per_section
+        self.random = random.Random(seed)
+        self.start_time = datetime.datetime(2021, 10, 8, 12, 0, 0)
+
+    def write(self, trace_filename):
+        ''' Writes the trace. Returns the number of messages written '''
+        with open(trace_filename, 'w') as f:
+            for call in range(1, self.num_calls + 1):
+                f.write(self.get_call(call))
+        return self.num_calls * self.messages_per_call
+
+    def get_call(self, call):
+        version = 1 if call % 2 else 2
+        name = tac.GENERATOR_TRANSACTION_NAMES[version]
+        imsi = f'21401{self.random.randrange(10**10):010d}'
+        call_time = self.start_time + datetime.timedelta(seconds=call)
+        lines = [f'Call #{call}\n']
+        for message in range(1, self.messages_per_call + 1):
+            kind = 'Request' if message % 2 else 'Response'
+            timestamp = call_time + datetime.timedelta(milliseconds=message)
+            timestamp = timestamp.strftime(tac.TRACE_TIMESTAMP_FORMAT)[:-3]
+            lines.append(f'Message #{message}\t{timestamp}\t{name} {kind}\t'
+                         f'Length = {self.random.randint(100, 500)}\n')
+        lines.append('\n')
+        for message in range(1, self.messages_per_call + 1):
+            lines.append(f'Message #{message}\n')
+            lines.extend(self.get_ip_section(message))
+            lines.extend(self.get_gtp_section(version, message, imsi))
+            lines.append('\n')
+        # Two more empty lines end the call
+        lines.append('\n\n')
+        return ''.join(lines)
+
+    def get_ip_section(self, message):
+        source, destination = '10.0.0.1', f'10.1.{self.random.randrange(256)}.1'
+        if not message % 2:
+            source, destination = destination, source
+        lines = ['IP\n',
+                 f'   Source IP address = {source}\n',
+                 f'   Destination IP address = {destination}\n']
+        lines.extend(self.get_filler_params())
+        return lines
+
+    def get_gtp_section(self, version, message, imsi):
+        lines = [f'GTP v.{version}\n']
+        if version == 2:
+            lines.append(f'   Message Type = {32 + message % 2}\n')
+        lines.append(f'   IMSI = {imsi}\n')
+        lines.append(f'   Address signals = 3460{self.random.randrange(10**7):07d}\n')
+        if version == 1:
+            lines.append('   Maximum bit rate for uplink = 64000 kbps\n')
+            lines.append('   Maximum bit rate for downlink = 256000 kbps\n')
+            lines.append(f'   Rat Type Value = {self.random.choice((1, 2, 6))}\n')
+        else:
+            lines.append('   APN-AMBR for uplink = 64000 kbps\n')
+            lines.append('   APN-AMBR for downlink = 256000 kbps\n')
+            lines.append('   00000110 Value = 6 EUTRAN\n')
+        lines.extend(self.get_filler_params())
+        return lines
+
+    def get_filler_params(self):
+        return [f'   Spare field {index} = {self.random.randrange(256)}\n'
+                for index in range(self.params_per_section)]
+
+
+class CSVTraceGenerator():
+    ''' Writes synthetic CSV traces with the fields of a TraceReaderCSV
+        config, e.g. TraceReaderCSV - Test fields.txt. Values are drawn from
+        small vocabularies, as in real exports, except for identifiers
+    '''
+    def __init__(self, fields, num_rows=10000, seed=0):
+        self.fields = fields
+        self.num_rows = num_rows
+        self.random = random.Random(seed)
+
+    def write(self, trace_filename, sep='\t'):
+        ''' Writes the trace. Returns the number of rows written '''
+        start_date = datetime.date(2021, 10, 8)
+        with open(trace_filename, 'w') as f:
+            f.write(sep.join(self.fields) + '\n')
+            for row in range(self.num_rows):
+                values = [self.get_value(name, dtype, start_date)
+                          for name, dtype in self.fields.items()]
+                f.write(sep.join(values) + '\n')
+        return self.num_rows
+
+    def get_value(self, name, dtype, start_date):
+        if dtype == tac.PD_DATETIME_TYPE:
+            days = datetime.timedelta(days=self.random.randrange(7))
+            return (start_date + days).isoformat()
+        if dtype.lower().startswith('int'):
+            return str(self.random.randint(1, 20))
+        if 'IMSI' in name:
+            return f'21401{self.random.randrange(10**10):010d}'
+        if 'Address' in name:
+            return f'10.{self.random.randrange(4)}.{self.random.randrange(256)}.1'
+        if 'Number' in name or 'MSISDN' in name:
+            return f'3460{self.random.randrange(10**7):07d}'
+        if 'Time' in name:
+            return (f'{self.random.randrange(24):02d}:'
+                    f'{self.random.randrange(60):02d}:'
+                    f'{self.random.randrange(60):02d}')
+        return self.random.choice(tac.GENERATOR_VALUES.get(name, ('A', 'B')))
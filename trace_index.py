@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Sidecar indexes of plain traces, to read only the transactions needed"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from trace_analyzer import TransactionFilter, read_trace_range
+import trace_analyzer_constants as tac
+
+
+class TraceIndex():
+    ''' Sidecar index of a plain trace, built while it is parsed by
+        TraceReaderPlain. It keeps:
+        - the byte offset where each transaction (TID) starts
+        - for each column of index_columns (e.g. an IMSI param), its values
+          sorted, with the TIDs where they were found
+        - every message timestamp, sorted, with its TID
+        Transactions selected by TID, value or time are then parsed again
+        from their byte ranges only, see read_transactions
+    '''
+    def __init__(self, trace_filename, config, offsets, index_columns=(),
+                 df=None, timestamp_format=tac.TRACE_TIMESTAMP_FORMAT):
+        stat = os.stat(trace_filename)
+        self.version = tac.TRACE_INDEX_VERSION
+        self.trace_filename = trace_filename
+        self.file_stat = (stat.st_size, stat.st_mtime_ns)
+        self.config = config
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.index_columns = list(index_columns)
+        if df is None:
+            df = pd.DataFrame(columns=['TID'])
+        # Columns of the full read, kept by partial reads
+        self.columns = list(df.columns)
+        # Column: (sorted values, TIDs)
+        self.values = {}
+        for column in self.index_columns:
+            if column not in df.columns:
+                self.values[column] = (np.array([], dtype=object),
+                                       np.array([], dtype=np.int64))
+                continue
+            column_df = df[['TID', column]].dropna()
+            values = column_df[column].astype(str).to_numpy(dtype=object)
+            order = np.argsort(values, kind='stable')
+            self.values[column] = (values[order],
+                                   column_df['TID'].to_numpy(np.int64)[order])
+        timestamp_column = tac.MESSAGE_FIELDS[tac.TIMESTAMP_INDEX]
+        times = pd.Series(dtype='datetime64[ns]')
+        tids = pd.Series(dtype=np.int64)
+        if timestamp_column in df.columns:
+            times = pd.to_datetime(df[timestamp_column],
+                                   format=timestamp_format, errors='coerce')
+            tids = df['TID'][times.notna()]
+            times = times[times.notna()]
+        order = np.argsort(times.to_numpy(), kind='stable')
+        self.times = times.to_numpy()[order]
+        self.time_tids = tids.to_numpy(np.int64)[order]
+
+    @classmethod
+    def build(cls, trace_reader, trace_filename, index_columns=()):
+        ''' Reads the whole trace with trace_reader, a TraceReaderPlain,
+            and returns its index. The reader keeps the trace data
+        '''
+        df, offsets = trace_reader.read_trace_file_offsets(trace_filename)
+        for column in index_columns:
+            if column not in trace_reader.get_columns():
+                raise(ValueError(f"Incorrect column: {column}"))
+        return cls(trace_filename, trace_reader.get_cache_config(), offsets,
+                   index_columns, df,
+                   trace_reader.get_matcher().get_timestamp_format())
+
+    @staticmethod
+    def get_index_filename(trace_filename):
+        return trace_filename + tac.TRACE_INDEX_EXTENSION
+
+    def save(self, index_filename=None):
+        index_filename = index_filename or self.get_index_filename(
+            self.trace_filename)
+        temp_filename = index_filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(temp_filename, index_filename)
+
+    @classmethod
+    def load(cls, index_filename):
+        with open(index_filename, 'rb') as f:
+            return pickle.load(f)
+
+    def is_valid(self, trace_reader, index_columns=()):
+        ''' True if the index is up to date with the trace file and the
+            config of trace_reader, and covers index_columns
+        '''
+        if self.version != tac.TRACE_INDEX_VERSION:
+            return False
+        try:
+            stat = os.stat(self.trace_filename)
+        except OSError:
+            return False
+        return (self.file_stat == (stat.st_size, stat.st_mtime_ns) and
+                self.config == trace_reader.get_cache_config() and
+                set(index_columns) <= set(self.index_columns))
+
+    def __len__(self):
+        ''' Number of transactions started in the trace '''
+        return len(self.offsets) - 1
+
+    def get_tids(self, tids=None, values=None, time_range=None):
+        ''' Returns the sorted TIDs meeting every criterion given:
+            - tids: list of TIDs
+            - values: index column: value, or set (list, tuple) of values,
+              compared with the text found in the trace
+            - time_range: (start, end), end excluded. Either can be None.
+              TIDs with a message timestamp in range are returned
+        '''
+        result = np.arange(1, len(self) + 1, dtype=np.int64)
+        if tids is not None:
+            result = np.intersect1d(result, np.asarray(tids, dtype=np.int64))
+        for column, column_values in (values or {}).items():
+            if column not in self.values:
+                raise(ValueError(f"Column not indexed: {column}"))
+            sorted_values, value_tids = self.values[column]
+            found = [value_tids[np.searchsorted(sorted_values, value, 'left'):
+                                np.searchsorted(sorted_values, value, 'right')]
+                     for value in TransactionFilter.get_values(column_values)]
+            result = np.intersect1d(result, np.concatenate(
+                found + [np.array([], dtype=np.int64)]))
+        if time_range is not None:
+            start_time, end_time = [TransactionFilter.get_time(value)
+                                    for value in time_range]
+            start = 0
+            end = len(self.times)
+            if start_time is not None:
+                start = np.searchsorted(self.times, np.datetime64(start_time),
+                                        'left')
+            if end_time is not None:
+                end = np.searchsorted(self.times, np.datetime64(end_time),
+                                      'left')
+            result = np.intersect1d(result, self.time_tids[start:end])
+        return result
+
+    def get_ranges(self, tids):
+        ''' Returns (first TID, start offset, end offset) of each run of
+            consecutive TIDs in sorted tids
+        '''
+        ranges = []
+        for run in np.split(tids, np.flatnonzero(np.diff(tids) != 1) + 1):
+            if len(run):
+                ranges.append((int(run[0]), int(self.offsets[run[0] - 1]),
+                               int(self.offsets[run[-1]])))
+        return ranges
+
+    def read_transactions(self, trace_reader, tids=None, values=None,
+                          time_range=None):
+        ''' Parses again, with trace_reader, only the transactions selected
+            as in get_tids. Returns their DataFrame, with the TIDs of a full
+            read of the trace
+        '''
+        frames = []
+        for first_tid, start, end in self.get_ranges(
+                self.get_tids(tids, values, time_range)):
+            df = read_trace_range(trace_reader, self.trace_filename,
+                                  start, end)[0]
+            if not df.empty:
+                df['TID'] += first_tid - 1
+                frames.append(df)
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True).reindex(columns=self.columns)
+        return trace_reader.get_matcher().get_column_converter().convert(df)
+
+
+def get_trace_index(trace_reader, trace_filename, index_columns=(),
+                    index_filename=None):
+    ''' Returns the index of trace_filename. The sidecar index file is
+        loaded if up to date, or built and saved otherwise
+    '''
+    index_filename = index_filename or TraceIndex.get_index_filename(
+        trace_filename)
+    if os.path.exists(index_filename):
+        try:
+            trace_index = TraceIndex.load(index_filename)
+        except Exception:
+            # Unreadable index, e.g. from an older version. Built again
+            trace_index = None
+        if trace_index is not None and \
+                trace_index.trace_filename == trace_filename and \
+                trace_index.is_valid(trace_reader, index_columns):
+            return trace_index
+    trace_index = TraceIndex.build(trace_reader, trace_filename,
+                                   index_columns)
+    trace_index.save(index_filename)
+    return trace_index
+
+
+def read_indexed_traces(trace_reader, trace_filenames, index_columns=(),
+                        tids=None, values=None, time_range=None):
+    ''' Reads the transactions selected as in TraceIndex.get_tids from
+        several traces, e.g. of several days, building their indexes if
+        needed. Returns a DataFrame with a source file column
+    '''
+    frames = []
+    for trace_filename in trace_filenames:
+        trace_index = get_trace_index(trace_reader, trace_filename,
+                                      index_columns)
+        df = trace_index.read_transactions(trace_reader, tids, values,
+                                           time_range)
+        if not df.empty:
+            df.insert(0, tac.TRACE_SOURCE_COLUMN,
+                      os.path.basename(trace_filename))
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
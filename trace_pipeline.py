@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Threaded stages of the pipelined trace reader"""
+import io
+import queue
+import threading
+
+from trace_compression import open_compressed
+import trace_analyzer_constants as tac
+
+# Marks the end of the items of a stage
+END = object()
+
+
+class PipelineStage():
+    ''' Thread of a pipeline stage, passing items to the next stage through
+        a queue of up to queue_size items. When the queue is full the stage
+        waits, so memory use is bounded by the slowest stage. Exceptions
+        are raised again in the thread of the next stage
+    '''
+    def __init__(self, queue_size):
+        self.items = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, target, *args):
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        ''' Waits until there is room for item. False if stopped '''
+        while not self.stopped.is_set():
+            try:
+                self.items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        item = self.items.get()
+        if isinstance(item, Exception):
+            raise(item)
+        return item
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class BlockReader(PipelineStage):
+    ''' Read stage. Reads the trace in blocks of about block_size bytes,
+        ending at a line end, decompressing it if compression is given.
+        Iterating over the reader returns the blocks
+    '''
+    def __init__(self, trace_filename, compression=None,
+                 block_size=tac.TRACE_PIPELINE_BLOCK_SIZE,
+                 queue_size=tac.TRACE_PIPELINE_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self.start(self.run, trace_filename, compression, block_size)
+
+    def run(self, *args):
+        try:
+            self.read_blocks(*args)
+            self.put(END)
+        except Exception as e:
+            # Raised again by get
+            self.put(e)
+
+    def read_blocks(self, trace_filename, compression, block_size):
+        if compression:
+            f = open_compressed(trace_filename, compression)
+        else:
+            f = open(trace_filename, 'rb')
+        with f:
+            remainder = b''
+            while not self.stopped.is_set():
+                block = f.read(block_size)
+                if not block:
+                    break
+                line_end = block.rfind(b'\n') + 1
+                if not line_end:
+                    # Line longer than the block
+                    remainder += block
+                    continue
+                if not self.put(remainder + block[:line_end]):
+                    return
+                remainder = block[line_end:]
+            if remainder:
+                self.put(remainder)
+
+    def __iter__(self):
+        while True:
+            block = self.get()
+            if block is END:
+                return
+            yield block
+
+
+def iter_block_lines(blocks, encoding, errors, lines_read=None):
+    ''' Yields the lines of blocks of a trace, decoded and with '\r\n' line
+        endings translated to '\n'. If given, lines_read(num_lines,
+        num_bytes) is called for each block
+    '''
+    for block in blocks:
+        if lines_read is not None:
+            # Only the last block may not end a line
+            lines_read(block.count(b'\n') + (not block.endswith(b'\n')),
+                       len(block))
+        text = block.decode(encoding, errors).replace('\r\n', '\n')
+        # Only '\n' ends lines, as in the byte blocks
+        yield from io.StringIO(text, newline='\n')
+
+
+class SinkWriter(PipelineStage):
+    ''' Write stage. Writes the DataFrames passed to write to sink in its
+        own thread, while the next ones are parsed
+    '''
+    def __init__(self, sink, queue_size=tac.TRACE_PIPELINE_WRITE_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self.sink = sink
+        self.error = None
+        self.start(self.write_chunks)
+
+    def write_chunks(self):
+        while True:
+            df = self.items.get()
+            if df is END:
+                return
+            try:
+                self.sink.write(df)
+            except Exception as e:
+                # Raised in the parser thread by the next write or close
+                self.error = e
+                self.stopped.set()
+                return
+
+    def write(self, df):
+        if self.error is None:
+            self.put(df)
+        if self.error is not None:
+            raise(self.error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Chunks already queued are written
+        self.put(END)
+        self.thread.join()
+        if exc_type is None and self.error is not None:
+            raise(self.error)
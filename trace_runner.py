@@ -4,22 +4,199 @@ Created on Fri Oct 22 01:17:23 2021
 
 @author: orubio
 """
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import os
+import time
 
-from trace_analyzer import TraceReaderPlain
+from trace_analyzer import TraceReaderCSV, TraceReaderPlain
+from trace_config import compile_config
+from trace_sink import SINKS, get_sink
+import trace_analyzer_constants as tac
 
 TRACE_READER_PLAIN_CONFIG_FILE = 'TraceReaderPlain - config file.txt'
-#INPUT_TRACE = 'TraceReaderPlain - Test trace.txt'
-INPUT_TRACE = 'VF - GTP - Create PDP_Session - 081021.txt'
-OUTPUT_FILE = 'TraceReaderOut - 271021.xlsx'
+
+READERS = {
+    'plain' : TraceReaderPlain,
+    'csv' : TraceReaderCSV,
+}
+
+
+def get_trace_files(inputs, pattern='*'):
+    ''' Expands inputs (files, glob patterns or directories, whose files
+        matching pattern are taken) to a sorted list of trace files
+    '''
+    trace_filenames = set()
+    for name in inputs:
+        if os.path.isdir(name):
+            names = glob.glob(os.path.join(name, pattern))
+        else:
+            names = glob.glob(name) or [name]
+        for trace_filename in names:
+            if not os.path.isfile(trace_filename):
+                raise(ValueError(f"Incorrect file name: {trace_filename}"))
+            trace_filenames.add(trace_filename)
+    return sorted(trace_filenames)
+
+
+def get_output_filename(trace_filename, output_dir, output_format):
+    name, extension = os.path.splitext(os.path.basename(trace_filename))
+    if extension.lower() in tac.TRACE_COMPRESSION_EXTENSIONS:
+        # e.g. probe.txt.gz
+        name = os.path.splitext(name)[0]
+    return os.path.join(output_dir, f'{name}.{output_format}')
+
+
+def get_reader(reader_name, config_filename, reader_options):
+    if reader_name == 'plain':
+        # Plain configs are loaded as compiled by run_batch
+        compiled_config = compile_config(config_filename,
+                                         reader_options.get('encoding'),
+                                         reader_options.get('errors'))
+        return compiled_config.apply(TraceReaderPlain(**reader_options))
+    return READERS[reader_name](config_filename=config_filename,
+                                **reader_options)
+
+
+def write_trace(reader_name, config_filename, reader_options, read_options,
+                trace_filename, output_filename):
+    ''' Parses a trace into its own output file. Returns rows written '''
+    reader = get_reader(reader_name, config_filename, reader_options)
+    # Declared types, so that every file has the same schema
+    sink = get_sink(output_filename, reader.get_columns(),
+                    reader.get_column_types())
+    return reader.write_trace_file(trace_filename, sink, **read_options)
+
+
+def read_trace(reader_name, config_filename, reader_options, read_options,
+               trace_filename):
+    ''' Parses a trace. Returns its DataFrame, with the source file column '''
+    reader = get_reader(reader_name, config_filename, reader_options)
+    reader.read_trace_file(trace_filename, use_cache=False, **read_options)
+    df = reader.get_data().reindex(columns=reader.get_columns())
+    df.insert(0, tac.TRACE_SOURCE_COLUMN, os.path.basename(trace_filename))
+    return df
+
+
+class BatchProgress():
+    ''' Aggregate progress of a batch of trace files '''
+    def __init__(self, trace_filenames):
+        self.num_files = len(trace_filenames)
+        self.total_bytes = sum(os.path.getsize(trace_filename)
+                               for trace_filename in trace_filenames)
+        self.files = 0
+        self.bytes = 0
+        self.rows = 0
+        self.start_time = time.perf_counter()
+
+    def file_done(self, trace_filename, rows):
+        self.files += 1
+        self.bytes += os.path.getsize(trace_filename)
+        self.rows += rows
+        elapsed = time.perf_counter() - self.start_time
+        percent = 100 * self.bytes / self.total_bytes if self.total_bytes else 100
+        print(f'[{self.files}/{self.num_files}] {percent:5.1f}% '
+              f'{self.rows} rows, {self.bytes / 1e6 / elapsed:.1f} MB/s - '
+              f'{trace_filename}: {rows} rows', flush=True)
+
+
+def run_batch(trace_filenames, reader_name, config_filename,
+              reader_options=None, read_options=None, output_dir='.',
+              output_format='parquet', merged_filename=None, workers=None):
+    ''' Parses trace_filenames in a pool of workers. Each trace is written to
+        output_dir, or all of them to merged_filename, with a source file
+        column. reader_options are passed to the reader class and
+        read_options to its read methods. Returns the number of rows written
+    '''
+    reader_options = reader_options or {}
+    read_options = read_options or {}
+    if reader_name == 'plain':
+        # Incorrect configs fail here, before any trace is parsed
+        compile_config(config_filename, reader_options.get('encoding'),
+                       reader_options.get('errors'))
+    progress = BatchProgress(trace_filenames)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if merged_filename:
+            reader = get_reader(reader_name, config_filename, reader_options)
+            columns = [tac.TRACE_SOURCE_COLUMN] + reader.get_columns()
+            # Results are written in input order. A file is only submitted
+            # once an earlier one has been written, so at most one result
+            # per worker is held in memory, even behind a slow file
+            pending = iter(trace_filenames)
+            futures = deque()
+            def submit_next():
+                trace_filename = next(pending, None)
+                if trace_filename is not None:
+                    futures.append((trace_filename, executor.submit(
+                        read_trace, reader_name, config_filename,
+                        reader_options, read_options, trace_filename)))
+            for _ in range(workers or os.cpu_count() or 1):
+                submit_next()
+            with get_sink(merged_filename, columns,
+                          reader.get_column_types()) as sink:
+                while futures:
+                    trace_filename, future = futures.popleft()
+                    progress.file_done(trace_filename,
+                                       sink.write(future.result()))
+                    submit_next()
+            return progress.rows
+        output_filenames = [get_output_filename(trace_filename, output_dir,
+                                                output_format)
+                            for trace_filename in trace_filenames]
+        if len(set(output_filenames)) < len(output_filenames):
+            raise(ValueError("Trace files with the same name. Use --merge"))
+        os.makedirs(output_dir, exist_ok=True)
+        futures = {executor.submit(write_trace, reader_name, config_filename,
+                                   reader_options, read_options,
+                                   trace_filename, output_filename):
+                   trace_filename
+                   for trace_filename, output_filename in
+                   zip(trace_filenames, output_filenames)}
+        for future in as_completed(futures):
+            progress.file_done(futures[future], future.result())
+    return progress.rows
 
 
 def main():
-    reader = TraceReaderPlain(config_filename=TRACE_READER_PLAIN_CONFIG_FILE,
-                              trace_filename=INPUT_TRACE)
-    df = reader.get_data()
-    df.to_excel(OUTPUT_FILE, index=False)
-    
+    parser = argparse.ArgumentParser(
+        description='Parses batches of trace files in parallel')
+    parser.add_argument('inputs', nargs='+',
+                        help='trace files, glob patterns or directories')
+    parser.add_argument('--config', default=TRACE_READER_PLAIN_CONFIG_FILE,
+                        help='reader config file')
+    parser.add_argument('--reader', default='plain', choices=list(READERS))
+    parser.add_argument('--pattern', default='*',
+                        help='pattern of trace files in input directories')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--output-dir', default='.',
+                        help='directory for one output file per trace')
+    output.add_argument('--merge', default=None, metavar='OUTPUT_FILE',
+                        help='single output file for all traces')
+    parser.add_argument('--format', default='parquet',
+                        choices=[extension[1:] for extension in SINKS],
+                        help='format of the output files per trace')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, by default one per CPU')
+    parser.add_argument('--encoding', default=None,
+                        help='encoding of plain traces')
+    parser.add_argument('--mmap', action='store_true',
+                        help='read plain traces with mmap')
+    parser.add_argument('--sep', default='\t', help='separator of CSV traces')
+    args = parser.parse_args()
+    if args.reader == 'plain':
+        reader_options = {'encoding': args.encoding, 'use_mmap': args.mmap}
+        read_options = {}
+    else:
+        reader_options = {}
+        read_options = {'sep': args.sep}
+    trace_filenames = get_trace_files(args.inputs, args.pattern)
+    rows = run_batch(trace_filenames, args.reader, args.config,
+                     reader_options, read_options, output_dir=args.output_dir,
+                     output_format=args.format, merged_filename=args.merge,
+                     workers=args.workers)
+    print(f'{len(trace_filenames)} trace files, {rows} rows')
+
 if __name__ == "__main__":
     main()
-
-    
\ No newline at end of file
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Sinks writing parsed trace chunks to CSV, Parquet or Excel files"""
+from abc import ABC, abstractmethod
+import os
+import pandas as pd
+
+import trace_analyzer_constants as tac
+
+
+class TraceSink(ABC):
+    ''' Abstract class to define the interface to output sinks
+        Parsed chunks are written as they are completed, so memory use does
+        not depend on trace size. If columns is given, every chunk is written
+        with those columns, in that order, missing ones being empty.
+        column_types maps columns to their declared dtype names, e.g. from
+        TraceReader.get_column_types(), for sinks with typed columns
+    '''
+    def __init__(self, output_filename, columns=None, column_types=None):
+        self.output_filename = output_filename
+        self.columns = list(columns) if columns is not None else None
+        self.column_types = column_types
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, df):
+        ''' Writes a DataFrame chunk. Returns the number of rows written '''
+        if self.columns is None:
+            self.columns = list(df.columns)
+        df = df.reindex(columns=self.columns)
+        self.write_chunk(df)
+        self.rows += df.shape[0]
+        return df.shape[0]
+
+    @abstractmethod
+    def write_chunk(self, df):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class CSVSink(TraceSink):
+    ''' Appends chunks to a CSV file, with a single header line '''
+    def __init__(self, output_filename, columns=None, column_types=None,
+                 sep=','):
+        super().__init__(output_filename, columns, column_types)
+        self.sep = sep
+        self.f = open(output_filename, 'w', newline='')
+        self.header = True
+
+    def write_chunk(self, df):
+        df.to_csv(self.f, sep=self.sep, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        if self.header and self.columns is not None:
+            # No chunks written. Leaves a file with the header only
+            pd.DataFrame(columns=self.columns).to_csv(self.f, sep=self.sep,
+                                                      index=False)
+            self.header = False
+        self.f.close()
+
+
+class ParquetSink(TraceSink):
+    ''' Writes each chunk as a row group of a Parquet file. The schema is
+        fixed before the first chunk is written:
+        - with column_types, from the declared types. Columns not declared
+          are strings, as parsed trace values are text
+        - otherwise, inferred from the first chunk. Columns without values
+          in it are strings
+        Every chunk is converted to the schema, so columns missing from it,
+        which are NaN, and numeric text, e.g. IMSIs, keep the schema types
+    '''
+    def __init__(self, output_filename, columns=None, column_types=None):
+        super().__init__(output_filename, columns, column_types)
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = None
+        self.writer = None
+
+    def get_field_type(self, dtype):
+        ''' Returns the arrow type of a declared dtype name '''
+        pa = self.pa
+        if dtype is None:
+            return pa.string()
+        if dtype == tac.PD_DATETIME_TYPE:
+            return pa.timestamp('ns')
+        try:
+            pandas_dtype = pd.api.types.pandas_dtype(dtype)
+        except (TypeError, ImportError):
+            return pa.string()
+        if pd.api.types.is_datetime64_any_dtype(pandas_dtype):
+            return pa.timestamp('ns')
+        if pd.api.types.is_bool_dtype(pandas_dtype):
+            return pa.bool_()
+        if pd.api.types.is_numeric_dtype(pandas_dtype):
+            # Nullable types, e.g. Int64, have the numpy dtype of their values
+            return pa.from_numpy_dtype(
+                getattr(pandas_dtype, 'numpy_dtype', pandas_dtype))
+        return pa.string()
+
+    def get_schema(self, df):
+        pa = self.pa
+        if self.column_types is not None:
+            return pa.schema(
+                [pa.field(column, self.get_field_type(
+                    self.column_types.get(column)))
+                 for column in df.columns])
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        # pandas str columns are large strings
+        return pa.schema(
+            [schema_field.with_type(pa.string())
+             if df[column].isna().all() or
+             pa.types.is_large_string(schema_field.type) else schema_field
+             for column, schema_field in zip(df.columns, schema)]
+            ).remove_metadata()
+
+    def get_column(self, values, field_type):
+        ''' Returns values ready to be converted to field_type '''
+        pa = self.pa
+        if values.isna().all():
+            # Missing columns are NaN, which only casts to numbers
+            return pd.Series(None, index=values.index, dtype=object)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        if pa.types.is_string(field_type):
+            if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+                return values
+            return values.astype(object).where(values.notna(), None).map(
+                str, na_action='ignore')
+        if pa.types.is_timestamp(field_type) and \
+                not pd.api.types.is_datetime64_any_dtype(values):
+            return pd.to_datetime(values, errors='coerce')
+        return values
+
+    def get_table(self, df):
+        if self.schema is None:
+            self.schema = self.get_schema(df)
+        df = pd.DataFrame(
+            {column: self.get_column(df[column], schema_field.type)
+             for column, schema_field in zip(df.columns, self.schema)},
+            index=df.index)
+        return self.pa.Table.from_pandas(df, schema=self.schema,
+                                         preserve_index=False)
+
+    def write_chunk(self, df):
+        table = self.get_table(df)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.output_filename,
+                                                self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            if self.columns is None:
+                self.columns = []
+            # No chunks written. Leaves a file with the schema only
+            self.write_chunk(pd.DataFrame(columns=self.columns))
+        self.writer.close()
+
+
+class ExcelSink(TraceSink):
+    ''' Writes chunks to a write only openpyxl workbook, so rows are not
+        kept in memory. When a sheet reaches the Excel row limit, writing
+        continues in a new sheet, with its own header row
+    '''
+    def __init__(self, output_filename, columns=None, column_types=None,
+                 max_rows=tac.EXCEL_MAX_ROWS):
+        super().__init__(output_filename, columns, column_types)
+        if max_rows < 2:
+            raise(ValueError("Incorrect number of rows per sheet"))
+        import openpyxl
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.max_rows = max_rows
+        self.sheet = None
+        self.sheet_rows = 0
+        self.sheets = 0
+
+    def add_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.create_sheet(
+            f'{tac.EXCEL_SHEET_NAME} {self.sheets}')
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def write_chunk(self, df):
+        # Empty cells are None, not NaN
+        df = df.astype(object).where(df.notna(), None)
+        for row in df.itertuples(index=False, name=None):
+            if self.sheet is None or self.sheet_rows >= self.max_rows:
+                self.add_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def close(self):
+        if self.sheet is None:
+            if self.columns is None:
+                self.columns = []
+            self.add_sheet()
+        self.workbook.save(self.output_filename)
+
+
+# Output file extension: sink class
+SINKS = {
+    '.csv' : CSVSink,
+    '.parquet' : ParquetSink,
+    '.xlsx' : ExcelSink,
+}
+
+
+def get_sink(output_filename, columns=None, column_types=None, **kwargs):
+    ''' Returns the sink of output_filename, chosen by its extension '''
+    extension = os.path.splitext(output_filename)[1].lower()
+    if extension not in SINKS:
+        raise(ValueError(f"Incorrect output file type: {extension}"))
+    return SINKS[extension](output_filename, columns, column_types, **kwargs)